@@ -0,0 +1,7 @@
+"""Benchmarks of the loading, statistics and dashboard hot paths.
+
+Generate synthetic Strava histories and time the app against them::
+
+    python -m benchmarks.run --sizes 1000 10000
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
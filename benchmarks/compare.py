@@ -0,0 +1,50 @@
+"""Compares two benchmark result files, flagging regressions::
+
+python -m benchmarks.compare baseline.json candidate.json
+"""
+
+import argparse
+import json
+
+
+def load_medians(path: str) -> dict[tuple[str, int], float]:
+    with open(path, "r") as f:
+        report = json.load(f)
+    return {
+        (result["name"], result["size"]): result["median"]
+        for result in report["results"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold", type=float, default=1.1, help="slowdown ratio to flag"
+    )
+    args = parser.parse_args()
+
+    baseline = load_medians(args.baseline)
+    candidate = load_medians(args.candidate)
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys(), key=lambda k: (k[1], k[0])):
+        name, size = key
+        ratio = candidate[key] / baseline[key] if baseline[key] else float("inf")
+        flag = ""
+        if ratio >= args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(
+            f"{size:>8} {name:<60} {baseline[key] * 1000:>10.3f} ms"
+            f" -> {candidate[key] * 1000:>10.3f} ms  x{ratio:.2f}{flag}"
+        )
+    for name, size in sorted(baseline.keys() ^ candidate.keys()):
+        print(f"{size:>8} {name:<60} only in one of the files")
+
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
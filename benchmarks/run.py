@@ -0,0 +1,232 @@
+"""Times the hot paths of the app against synthetic histories and saves the
+results as JSON, one file per run::
+
+    python -m benchmarks.run --sizes 1000 10000 --output results.json
+"""
+
+import argparse
+import datetime
+import inspect
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import tempfile
+import timeit
+from typing import Callable
+
+import numpy as np
+
+from benchmarks.synthetic import DEFAULT_SEED, END_DATE, SIZES, write_activities
+
+BENCHMARKS_DIR = pathlib.Path(__file__).parent
+DATA_DIR = BENCHMARKS_DIR / "data"
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+ACTIVITY_TYPE = "Ride"
+
+
+def time_call(func: Callable, repeat: int, min_time: float) -> dict:
+    """Times a call, looping fast ones so every sample takes at least
+    min_time, and returns per-call seconds."""
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time and number < 1_000_000:
+        number *= 10
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def module_functions(module, prefix: str) -> dict[str, Callable]:
+    """Returns the public functions of a module whose name starts with prefix."""
+    return {
+        name: func
+        for name, func in inspect.getmembers(module, inspect.isfunction)
+        if name.startswith(prefix) and func.__module__ == module.__name__
+    }
+
+
+def benchmark_cases(path: pathlib.Path, work_dir: pathlib.Path):
+    """Yields (name, callable) for every benchmarked function at one size."""
+    from strava_stats import plots, strava_stats
+    from strava_stats.activity_table import ActivityTable
+    from strava_stats.strava_api import load_activity_table, load_strava_activities
+
+    year = END_DATE.year
+    activities = load_strava_activities(str(path))
+    table = ActivityTable.from_activities(activities)
+    year_table = table.filter(ACTIVITY_TYPE, year)
+    all_years_table = table.filter(ACTIVITY_TYPE)
+
+    yield "load_strava_activities", lambda: load_strava_activities(str(path))
+    yield "load_activity_table", lambda: load_activity_table(str(path))
+    yield (
+        "ActivityTable.from_activities",
+        lambda: ActivityTable.from_activities(activities),
+    )
+    yield (
+        "filter_strava_activities[list]",
+        lambda: strava_stats.filter_strava_activities(activities, ACTIVITY_TYPE, year),
+    )
+    yield (
+        "filter_strava_activities[table]",
+        lambda: strava_stats.filter_strava_activities(table, ACTIVITY_TYPE, year),
+    )
+    yield "summarize_activities", lambda: strava_stats.summarize_activities(year_table)
+
+    # the multi-year functions get every year, the rest the selected one
+    for module in (strava_stats, plots):
+        for prefix in ("calculate_", "generate_"):
+            for name, func in module_functions(module, prefix).items():
+                data = all_years_table if "by_year" in name else year_table
+                yield (
+                    f"{module.__name__.rsplit('.', 1)[-1]}.{name}",
+                    (lambda func=func, data=data: func(data)),
+                )
+
+    yield from update_app_cases(path, work_dir, year)
+
+
+def update_app_cases(path: pathlib.Path, work_dir: pathlib.Path, year: int):
+    """Yields full update_app invocations served from the raw activities and
+    from a rollup, uncached and cached."""
+    from strava_stats import main
+    from strava_stats.athletes import Dataset
+    from strava_stats.rollups import write_rollup
+
+    rollup_path = work_dir / f"{path.stem}-rollup.json"
+
+    def update_app(year=year, cached=False):
+        if not cached:
+            main.default_dataset.dashboard_cache.clear()
+        return main.update_app(year, ACTIVITY_TYPE)
+
+    main.default_dataset = Dataset(str(path), str(work_dir / "missing-rollup.json"))
+    yield "update_app[raw]", update_app
+    yield "update_app[raw, all time]", lambda: update_app(main.ALL_YEARS)
+
+    write_rollup(main.default_dataset.activity_store.get_table(), str(rollup_path))
+    main.default_dataset = Dataset(str(path), str(rollup_path))
+    yield "update_app[rollup]", update_app
+    yield "update_app[rollup, all time]", lambda: update_app(main.ALL_YEARS)
+    yield "update_app[cached]", lambda: update_app(cached=True)
+
+
+def payload_sizes(path: pathlib.Path, year: int) -> list[dict]:
+    """Returns the serialized size of every figure in the update_app response
+    of a year and the all time view, and the time to parse each one."""
+    from plotly.utils import PlotlyJSONEncoder
+
+    from strava_stats import main
+    from strava_stats.athletes import Dataset
+
+    main.default_dataset = Dataset(str(path), str(path.with_name("missing-rollup")))
+    payloads = []
+    for view in (year, main.ALL_YEARS):
+        _, figures = main.update_app(view, ACTIVITY_TYPE)
+        for name, figure in figures.items():
+            encoded = json.dumps(figure, cls=PlotlyJSONEncoder)
+            parse = time_call(lambda encoded=encoded: json.loads(encoded), 5, 0.01)
+            payloads.append(
+                {
+                    "view": str(view),
+                    "figure": name,
+                    "bytes": len(encoded),
+                    "parse_median": parse["median"],
+                }
+            )
+    return payloads
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=BENCHMARKS_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    sizes: list[int],
+    repeat: int,
+    min_time: float,
+    seed: int = DEFAULT_SEED,
+    match: str | None = None,
+) -> dict:
+    """Runs every benchmark at every size and returns the results."""
+    results = []
+    payloads = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            path = write_activities(
+                DATA_DIR / f"activities-{size}-{seed}.json", size, seed
+            )
+            for name, func in benchmark_cases(path, pathlib.Path(work_dir)):
+                if match and match not in name:
+                    continue
+                timing = time_call(func, repeat, min_time)
+                results.append({"name": name, "size": size, **timing})
+                print(
+                    f"{size:>8} {name:<60} {timing['median'] * 1000:>10.3f} ms"
+                    f" (x{timing['number']})"
+                )
+            for payload in payload_sizes(path, END_DATE.year):
+                payloads.append({"size": size, **payload})
+                label = f"payload[{payload['view']}, {payload['figure']}]"
+                print(f"{size:>8} {label:<60} {payload['bytes']:>10} bytes")
+
+    return {
+        "metadata": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": seed,
+            "sizes": sizes,
+        },
+        "results": results,
+        "payloads": payloads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES[:2])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--min-time", type=float, default=0.05, help="minimum seconds per sample"
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--match", help="only run benchmarks containing this")
+    parser.add_argument("--output", help="results JSON file")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.repeat, args.min_time, args.seed, args.match)
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = (
+            RESULTS_DIR / f"{timestamp}-{report['metadata']['commit'] or 'local'}.json"
+        )
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Deterministic generator of realistic Strava summary activities.
+
+The same count and seed always produce the same activities, so benchmark
+results are comparable across commits and machines::
+
+    python -m benchmarks.synthetic --count 10000 --output activities.json
+"""
+
+import argparse
+import datetime
+import json
+import math
+import pathlib
+import random
+
+SIZES = [1_000, 10_000, 100_000, 500_000]
+DEFAULT_SEED = 0
+# fixed so the generated history doesn't depend on the day it's generated
+END_DATE = datetime.datetime(2025, 12, 31, tzinfo=datetime.timezone.utc)
+
+# type: (weight, median km, log-normal sigma, km/h, meters climbed per km)
+TYPE_PROFILES = {
+    "Ride": (0.50, 40.0, 0.5, 25.0, 10.0),
+    "VirtualRide": (0.08, 30.0, 0.3, 30.0, 8.0),
+    "Run": (0.25, 8.0, 0.4, 11.0, 8.0),
+    "Walk": (0.07, 4.0, 0.4, 5.0, 5.0),
+    "Hike": (0.06, 10.0, 0.4, 4.0, 40.0),
+    "Swim": (0.04, 1.5, 0.3, 2.5, 0.0),
+}
+
+SUMMARY_POLYLINE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def history_years(count: int) -> int:
+    """Returns the number of years a history of count activities spans."""
+    return min(max(count // 1_000 + 2, 3), 15)
+
+
+def generate_activities(count: int, seed: int = DEFAULT_SEED) -> list[dict]:
+    """Generates count summary activities, newest first like the Strava API."""
+    rng = random.Random(f"{seed}:{count}")
+    types = list(TYPE_PROFILES)
+    weights = [profile[0] for profile in TYPE_PROFILES.values()]
+
+    end = END_DATE.timestamp()
+    start = end - history_years(count) * 365.25 * 24 * 60 * 60
+    timestamps = sorted(rng.uniform(start, end) for _ in range(count))
+
+    activities = []
+    for activity_id, timestamp in enumerate(timestamps, start=1):
+        activity_type = rng.choices(types, weights)[0]
+        _, median_km, sigma, speed_kmh, climb = TYPE_PROFILES[activity_type]
+        distance_km = rng.lognormvariate(math.log(median_km), sigma)
+        moving_time = int(distance_km / speed_kmh * 3600 * rng.uniform(0.85, 1.15))
+        start_date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+        activities.append(
+            {
+                "resource_state": 2,
+                "athlete": {"id": 1, "resource_state": 1},
+                "name": f"{activity_type} {activity_id}",
+                "distance": round(distance_km * 1000, 1),
+                "moving_time": moving_time,
+                "elapsed_time": int(moving_time * rng.uniform(1.0, 1.3)),
+                "total_elevation_gain": round(
+                    distance_km * climb * rng.uniform(0.3, 1.7), 1
+                ),
+                "type": activity_type,
+                "sport_type": activity_type,
+                "id": activity_id,
+                "start_date": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "start_date_local": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "timezone": "(GMT+00:00) Europe/London",
+                "utc_offset": 0.0,
+                "kudos_count": rng.randint(0, 30),
+                "map": {
+                    "id": f"a{activity_id}",
+                    "summary_polyline": SUMMARY_POLYLINE,
+                    "resource_state": 2,
+                },
+                "average_speed": round(distance_km * 1000 / max(moving_time, 1), 3),
+                "max_speed": round(speed_kmh / 3.6 * rng.uniform(1.3, 2.0), 3),
+                "has_heartrate": rng.random() < 0.7,
+            }
+        )
+
+    activities.reverse()
+    return activities
+
+
+def write_activities(
+    path: str | pathlib.Path, count: int, seed: int = DEFAULT_SEED
+) -> pathlib.Path:
+    """Writes a generated history to a JSON file unless it already exists."""
+    path = pathlib.Path(path)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(generate_activities(count, seed), f)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic activities")
+    parser.add_argument("--count", type=int, default=SIZES[0])
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", required=True, help="activities JSON file")
+    args = parser.parse_args()
+
+    with open(args.output, "w") as f:
+        json.dump(generate_activities(args.count, args.seed), f)
+    print(f"wrote {args.count} activities to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Gunicorn settings, each overridable through the environment.
+
+The app keeps no per-request global state, so threaded (gthread) workers
+serve concurrent requests from a single in-memory copy of the activities
+per worker process. gevent workers work too once gevent is installed, but
+the statistics and figures are CPU bound, so gthread is the default.
+
+With preloading the master imports the app and loads the data once, through
+``create_app(warm=True)``, before forking the workers, which then share
+those pages copy-on-write rather than each importing and loading their own.
+"""
+
+import gc
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8050")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+# threads per worker for gthread, concurrent connections per worker for gevent
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+
+def pre_fork(server, worker):
+    # move everything the master allocated out of the collector's reach, so
+    # collections in the workers don't write to the shared pages
+    gc.freeze()
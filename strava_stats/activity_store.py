@@ -0,0 +1,150 @@
+import abc
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from strava_stats.activity_table import ActivityTable
+from strava_stats.strava_api import (
+    load_activity_table,
+    resolve_activities_path,
+)
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class FileStore(abc.ABC):
+    """Keeps a data file parsed in memory and reloads it only when the file
+    on disk changes. Subclasses parse the file in ``load`` and report the
+    memory it takes in ``nbytes``.
+
+    With a ``check_interval`` the file is checked for changes at most that
+    often once loaded, and ``invalidate`` forces a check on the next access.
+    A file ``load`` rejects with ValueError is remembered by version, so it
+    is only parsed again once it changes.
+    """
+
+    description = "data"
+
+    def __init__(self, path: str, check_interval: float = 0):
+        self.path = path
+        self.check_interval = check_interval
+        self.file_path = resolve_activities_path(path)
+        self.version: Optional[str] = None
+        self.hits = 0
+        self.reloads = 0
+        self.file_size = 0
+
+        self._lock = threading.Lock()
+        self._stat_key: Optional[tuple[int, int]] = None
+        self._checked_at = float("-inf")
+        self._data: Any = None
+        self._rejection: Optional[str] = None
+
+    @abc.abstractmethod
+    def load(self) -> Any:
+        """Parses and validates the file."""
+
+    def _hash_file(self) -> str:
+        digest = hashlib.sha1()
+        with open(self.file_path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def invalidate(self) -> None:
+        """Makes the next access check the file for changes."""
+        self._checked_at = float("-inf")
+
+    def get(self) -> Any:
+        """Returns the data, re-parsing the file only if its version changed."""
+        if self.loaded and time.monotonic() - self._checked_at < self.check_interval:
+            self.hits += 1
+            return self._data
+
+        self._checked_at = time.monotonic()
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError as err:
+            raise FileNotFoundError(
+                f"{self.description} file not found at {self.file_path}"
+            ) from err
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if stat_key == self._stat_key:
+                self.hits += 1
+                return self._checked_data()
+
+            # mtime/size changed, only re-parse if the content did too
+            version = self._hash_file()
+
+            if version == self.version:
+                self._stat_key = stat_key
+                self.hits += 1
+                return self._checked_data()
+
+            try:
+                data = self.load()
+            except ValueError as error:
+                self._data = None
+                self._rejection = str(error)
+                self._stat_key = stat_key
+                self.version = version
+                self.file_size = 0
+                logger.warning(
+                    f"ignoring {self.description} at {self.path} until it "
+                    f"changes: {error}"
+                )
+                raise
+            self._data = data
+            self._rejection = None
+            self._stat_key = stat_key
+            self.version = version
+            self.file_size = stat.st_size
+            self.reloads += 1
+            logger.info(
+                f"loaded {self.description} from {self.path} "
+                f"(version {version[:8]}, reload #{self.reloads})"
+            )
+            return self._data
+
+    def _checked_data(self) -> Any:
+        if self._rejection is not None:
+            raise ValueError(self._rejection)
+        return self._data
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    @abc.abstractmethod
+    def nbytes(self) -> int:
+        """Returns the memory held by the loaded data."""
+
+    def stats(self) -> dict:
+        """Returns the hit/reload counters of the store."""
+        return {"hits": self.hits, "reloads": self.reloads, "version": self.version}
+
+
+class ActivityTableStore(FileStore):
+    """Keeps only the compact columnar table of the saved activities in
+    memory, streaming it from the file whenever the file changes."""
+
+    description = "activity table"
+
+    def __init__(self, path: str = "data/activities.json", check_interval: float = 0):
+        super().__init__(path, check_interval)
+
+    def load(self) -> ActivityTable:
+        return load_activity_table(self.path)
+
+    def get_table(self) -> ActivityTable:
+        return self.get()
+
+    def nbytes(self) -> int:
+        return self._data.nbytes if self.loaded else 0
@@ -0,0 +1,256 @@
+import array
+import datetime
+import sys
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+import numpy as np
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def to_day(date: datetime.date) -> int:
+    """Returns the day ordinal (days since 1970-01-01) of a date."""
+    return date.toordinal() - EPOCH_ORDINAL
+
+
+@dataclass(frozen=True)
+class DayIndex:
+    """Sorted, de-duplicated activity day ordinals with the runs of
+    consecutive days they form.
+
+    ``run_start[i]`` is the position of the first day of the run containing
+    ``days[i]``, so the streak ending on any day is a binary search away.
+    A year slice shares the arrays of its parent and clips runs at
+    ``offset``, the position of its first day in the parent.
+    """
+
+    days: np.ndarray
+    run_start: np.ndarray
+    offset: int = 0
+
+    @classmethod
+    def from_days(cls, days: np.ndarray) -> "DayIndex":
+        days = np.unique(days)
+        starts = np.ones(len(days), dtype=bool)
+        starts[1:] = np.diff(days) != 1
+        positions = np.where(starts, np.arange(len(days)), 0)
+        return cls(days=days, run_start=np.maximum.accumulate(positions))
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def slice_year(self, year: int) -> "DayIndex":
+        """Returns the index of the days within a year, without copying."""
+        return self.slice_years(range(year, year + 1))
+
+    def slice_years(self, years: range) -> "DayIndex":
+        """Returns the index of the days within a range of years, without
+        copying."""
+        lo, hi = np.searchsorted(
+            self.days,
+            [
+                to_day(datetime.date(years.start, 1, 1)),
+                to_day(datetime.date(years.stop, 1, 1)),
+            ],
+        )
+        return DayIndex(
+            days=self.days[lo:hi],
+            run_start=self.run_start[lo:hi],
+            offset=self.offset + int(lo),
+        )
+
+    def current_streak(self, from_date: Optional[datetime.date] = None) -> int:
+        """Returns the number of consecutive days with activities ending on
+        from_date (today by default)."""
+        if not from_date:
+            from_date = datetime.datetime.now().date()
+        from_day = to_day(from_date)
+
+        i = int(np.searchsorted(self.days, from_day, side="right")) - 1
+        if i < 0 or self.days[i] != from_day:
+            return 0
+        return i - max(int(self.run_start[i]) - self.offset, 0) + 1
+
+    def runs(self) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the first day and the length of every streak, oldest first."""
+        starts = np.flatnonzero(np.diff(self.days, prepend=self.days[:1] - 2) != 1)
+        lengths = np.diff(starts, append=len(self.days))
+        return self.days[starts], lengths
+
+    def longest_streak(self) -> int:
+        """Returns the length of the longest streak."""
+        _, lengths = self.runs()
+        return int(lengths.max(initial=0))
+
+    def longest_streak_per_year(self) -> dict[int, int]:
+        """Returns the longest streak of every year, with streaks spanning
+        New Year split at the year boundary."""
+        if not len(self.days):
+            return {}
+        years = (
+            self.days.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64)
+        )
+        breaks = np.ones(len(self.days), dtype=bool)
+        breaks[1:] = (np.diff(self.days) != 1) | (np.diff(years) != 0)
+        starts = np.flatnonzero(breaks)
+        lengths = np.diff(starts, append=len(self.days))
+
+        unique_years, year_index = np.unique(years[starts], return_inverse=True)
+        longest = np.zeros(len(unique_years), dtype=np.int64)
+        np.maximum.at(longest, year_index, lengths)
+        return {
+            int(year) + 1970: int(length) for year, length in zip(unique_years, longest)
+        }
+
+
+@dataclass(frozen=True)
+class ActivityTable:
+    """Columnar representation of Strava activities.
+
+    Holds one NumPy array per field used by the statistics, so every
+    aggregate is a vectorized operation instead of a loop over dicts.
+    """
+
+    distance: np.ndarray  # meters
+    moving_time: np.ndarray  # seconds
+    elevation: np.ndarray  # meters
+    type: np.ndarray
+    day: np.ndarray  # days since 1970-01-01 of start_date
+    year: np.ndarray
+    month: np.ndarray  # 1-12
+    day_of_month: np.ndarray  # 1-31
+    # DayIndex per activity type (None for all types), built on first use
+    _day_indexes: dict = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    def __len__(self) -> int:
+        return len(self.distance)
+
+    @property
+    def nbytes(self) -> int:
+        """Returns the memory held by the columns and built day indexes."""
+        columns = (
+            self.distance,
+            self.moving_time,
+            self.elevation,
+            self.type,
+            self.day,
+            self.year,
+            self.month,
+            self.day_of_month,
+        )
+        day_indexes = (
+            index.days.nbytes + index.run_start.nbytes
+            for index in self._day_indexes.values()
+        )
+        return sum(column.nbytes for column in columns) + sum(day_indexes)
+
+    @classmethod
+    def from_activities(cls, activities: Iterable[dict]) -> "ActivityTable":
+        """Builds a table from Strava summary activities in a single pass.
+
+        Accepts any iterable, so activities can be streamed from disk without
+        ever holding them all as dicts.
+        """
+        distance = array.array("d")
+        moving_time = array.array("q")
+        elevation = array.array("d")
+        days = array.array("q")
+        types = []
+        for activity in activities:
+            distance.append(activity["distance"])
+            moving_time.append(int(activity["moving_time"]))
+            elevation.append(activity["total_elevation_gain"])
+            types.append(sys.intern(activity["type"]))
+            days.append(
+                datetime.date.fromisoformat(activity["start_date"][:10]).toordinal()
+                - EPOCH_ORDINAL
+            )
+
+        return cls.from_columns(
+            distance=np.frombuffer(distance, dtype=np.float64),
+            moving_time=np.frombuffer(moving_time, dtype=np.int64),
+            elevation=np.frombuffer(elevation, dtype=np.float64),
+            type=np.array(types, dtype=str),
+            days=np.frombuffer(days, dtype=np.int64).astype("datetime64[D]"),
+        )
+
+    @classmethod
+    def from_columns(
+        cls,
+        distance: np.ndarray,
+        moving_time: np.ndarray,
+        elevation: np.ndarray,
+        type: np.ndarray,
+        days: np.ndarray,
+    ) -> "ActivityTable":
+        """Builds a table from column arrays, deriving the calendar columns
+        from an array of ``datetime64[D]`` days."""
+        months = days.astype("datetime64[M]")
+        return cls(
+            distance=distance,
+            moving_time=moving_time,
+            elevation=elevation,
+            type=type,
+            day=days.astype(np.int64),
+            year=days.astype("datetime64[Y]").astype(np.int64) + 1970,
+            month=months.astype(np.int64) % 12 + 1,
+            day_of_month=(days - months).astype(np.int64) + 1,
+        )
+
+    def take(self, mask: np.ndarray) -> "ActivityTable":
+        """Returns a new table with the rows selected by a mask or index array."""
+        return ActivityTable(
+            distance=self.distance[mask],
+            moving_time=self.moving_time[mask],
+            elevation=self.elevation[mask],
+            type=self.type[mask],
+            day=self.day[mask],
+            year=self.year[mask],
+            month=self.month[mask],
+            day_of_month=self.day_of_month[mask],
+        )
+
+    def filter(
+        self, activity_type: Optional[str] = None, year: Optional[int | range] = None
+    ) -> "ActivityTable":
+        """Returns the rows matching the given activity type and year, or
+        range of years. All years are kept if year is None.
+
+        The day index of the result is sliced from this table's, so streaks
+        of a filtered view don't rebuild it.
+        """
+        if year is not None and not isinstance(year, range):
+            year = range(year, year + 1)
+        mask = np.ones(len(self), dtype=bool)
+        if year is not None:
+            mask &= (self.year >= year.start) & (self.year < year.stop)
+        if activity_type:
+            mask &= self.type == activity_type
+        table = self.take(mask)
+
+        day_index = self.day_index(activity_type)
+        if year is not None:
+            day_index = day_index.slice_years(year)
+        table._day_indexes[None] = day_index
+        return table
+
+    def day_index(self, activity_type: Optional[str] = None) -> DayIndex:
+        """Returns the sorted unique activity days of a type (all types if
+        None), built once per table."""
+        activity_type = activity_type or None
+        if activity_type not in self._day_indexes:
+            days = self.day
+            if activity_type:
+                days = days[self.type == activity_type]
+            self._day_indexes[activity_type] = DayIndex.from_days(days)
+        return self._day_indexes[activity_type]
+
+
+def as_activity_table(activities: "list[dict] | ActivityTable") -> ActivityTable:
+    """Returns the activities as an ActivityTable, converting a list if needed."""
+    if isinstance(activities, ActivityTable):
+        return activities
+    return ActivityTable.from_activities(activities)
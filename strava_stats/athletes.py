@@ -0,0 +1,316 @@
+import datetime
+import json
+import logging
+import os
+import pathlib
+import re
+import threading
+import time
+import uuid
+from typing import Any, Optional
+
+from strava_stats.activity_store import ActivityTableStore, FileStore
+from strava_stats.best_efforts import BEST_EFFORTS_FILENAME, BestEffortsStore
+from strava_stats.cache import LRUCache, estimate_nbytes
+from strava_stats.rollups import RollupStore
+from strava_stats.routes import ROUTE_TILES_FILENAME, RouteTileStore
+from strava_stats.storage import DATABASE_FILENAME, ActivityDatabase
+from strava_stats.strava_api import (
+    API_ENDPOINT,
+    AUTH_ENDPOINT,
+    StravaAPIError,
+    StravaClient,
+    resolve_activities_path,
+    write_json_atomic,
+)
+from strava_stats.strava_client import RateLimiter
+from strava_stats.strava_stats import get_strava_activities_years
+from strava_stats.training_load import TRAINING_LOAD_FILENAME, TrainingLoadStore
+
+logger = logging.getLogger(__name__)
+
+# Every athlete has a partition of their own below the data directory,
+# holding their tokens, activities, database and rollup
+ATHLETES_DIR = "data/athletes"
+ATHLETE_ID_PATTERN = re.compile(r"\d+")
+TOKEN_FILENAME = "token.json"
+
+# The sync publishes a new data version next to the rollup once everything is
+# written. Web workers check it at most every DATA_CHECK_INTERVAL seconds and
+# reload on a change, so requests in between never touch the filesystem. The
+# data files are still checked every STORE_CHECK_INTERVAL seconds, for data
+# written by anything other than the sync.
+DATA_VERSION_FILENAME = "version.json"
+DATA_CHECK_INTERVAL = float(os.getenv("STRAVA_DATA_CHECK_INTERVAL", "5"))
+STORE_CHECK_INTERVAL = 60
+
+_clients: dict[str, StravaClient] = {}
+_clients_lock = threading.Lock()
+
+
+def is_athlete_id(athlete_id: str) -> bool:
+    """Returns whether a string is a Strava athlete id, and so safe to use as
+    a partition name."""
+    return ATHLETE_ID_PATTERN.fullmatch(athlete_id) is not None
+
+
+def athlete_data_dir(athlete_id: str) -> pathlib.Path:
+    """Returns the data partition of an athlete."""
+    if not is_athlete_id(athlete_id):
+        raise ValueError(f"invalid athlete id {athlete_id!r}")
+    return resolve_activities_path(f"{ATHLETES_DIR}/{athlete_id}")
+
+
+def list_athletes() -> list[str]:
+    """Returns the ids of the athletes with stored tokens."""
+    athletes_dir = resolve_activities_path(ATHLETES_DIR)
+    if not athletes_dir.is_dir():
+        return []
+    return sorted(
+        path.name
+        for path in athletes_dir.iterdir()
+        if is_athlete_id(path.name) and (path / TOKEN_FILENAME).exists()
+    )
+
+
+def athlete_exists(athlete_id: str) -> bool:
+    """Returns whether an athlete has stored tokens, like those list_athletes
+    returns."""
+    return (
+        is_athlete_id(athlete_id)
+        and (athlete_data_dir(athlete_id) / TOKEN_FILENAME).exists()
+    )
+
+
+def load_athlete_token(athlete_id: str) -> dict:
+    """Returns the stored refresh token, access token and expiry of an athlete."""
+    with open(athlete_data_dir(athlete_id) / TOKEN_FILENAME, "r") as f:
+        return json.load(f)
+
+
+def save_athlete_token(athlete_id: str, token: dict) -> None:
+    """Stores the tokens of an athlete, readable only by the owner."""
+    token = {
+        "refresh_token": token["refresh_token"],
+        "access_token": token.get("access_token"),
+        "expires_at": token.get("expires_at", 0),
+    }
+    write_json_atomic(athlete_data_dir(athlete_id) / TOKEN_FILENAME, token, mode=0o600)
+
+
+def get_athlete_client(
+    athlete_id: str, rate_limiter: Optional[RateLimiter] = None
+) -> StravaClient:
+    """Returns the client of an athlete, created once from the stored tokens.
+
+    Rotated tokens are written back to the athlete's partition. Strava rate
+    limits are per application, so all athletes should share a rate limiter.
+    """
+    with _clients_lock:
+        if athlete_id in _clients:
+            return _clients[athlete_id]
+
+        client_id = os.getenv("STRAVA_CLIENT_ID")
+        client_secret = os.getenv("STRAVA_CLIENT_SECRET")
+        if not all([client_id, client_secret]):
+            raise StravaAPIError(
+                "missing required environment variables: STRAVA_CLIENT_ID "
+                "or STRAVA_CLIENT_SECRET"
+            )
+
+        token = load_athlete_token(athlete_id)
+        client = StravaClient(
+            client_id=client_id,
+            client_secret=client_secret,
+            refresh_token=token["refresh_token"],
+            auth_endpoint=AUTH_ENDPOINT,
+            api_endpoint=API_ENDPOINT,
+            max_workers=int(os.getenv("STRAVA_MAX_WORKERS", "4")),
+            rate_limiter=rate_limiter,
+            access_token=token.get("access_token"),
+            expires_at=token.get("expires_at", 0),
+            on_token_refresh=lambda token: save_athlete_token(athlete_id, token),
+        )
+        _clients[athlete_id] = client
+        return client
+
+
+def publish_data_version(data_dir: str | pathlib.Path) -> str:
+    """Publishes a new version of the data in a directory, for the web workers
+    to reload it. The file is replaced atomically, so every worker reads
+    either the old or the new version."""
+    version = uuid.uuid4().hex
+    write_json_atomic(
+        pathlib.Path(data_dir) / DATA_VERSION_FILENAME,
+        {
+            "version": version,
+            "published_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        },
+    )
+    return version
+
+
+class Dataset:
+    """The saved activities and rollup of one athlete, with the dashboard
+    views rendered from them.
+
+    Everything is loaded lazily on first use, so creating a dataset is cheap.
+    """
+
+    def __init__(
+        self,
+        activities_path: str = "data/activities.json",
+        rollup_path: str = "data/rollup.json",
+        cache_size: int = 128,
+    ):
+        self.activity_store = ActivityTableStore(
+            activities_path, check_interval=STORE_CHECK_INTERVAL
+        )
+        self.rollup_store = RollupStore(
+            rollup_path, check_interval=STORE_CHECK_INTERVAL
+        )
+        # written by the sync next to the rollup
+        data_dir = self.rollup_store.file_path.parent
+        self.best_efforts_store = BestEffortsStore(
+            str(data_dir / BEST_EFFORTS_FILENAME), check_interval=STORE_CHECK_INTERVAL
+        )
+        self.route_tile_store = RouteTileStore(
+            str(data_dir / ROUTE_TILES_FILENAME), check_interval=STORE_CHECK_INTERVAL
+        )
+        self.training_load_store = TrainingLoadStore(
+            str(data_dir / TRAINING_LOAD_FILENAME), check_interval=STORE_CHECK_INTERVAL
+        )
+        # the indexed copy of the activities the sync writes next to them
+        self.database_path = self.activity_store.file_path.with_name(DATABASE_FILENAME)
+        # views are measured as they are cached, so they count toward nbytes
+        self.dashboard_cache = LRUCache(maxsize=cache_size, sizeof=estimate_nbytes)
+        self.version_path = data_dir / DATA_VERSION_FILENAME
+        self.data_version: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self._checked_at = float("-inf")
+        self._version_stat: Optional[tuple[int, int, int]] = None
+
+    @classmethod
+    def for_athlete(cls, athlete_id: str, cache_size: int = 32) -> "Dataset":
+        data_dir = athlete_data_dir(athlete_id)
+        return cls(
+            str(data_dir / "activities.json"),
+            str(data_dir / "rollup.json"),
+            cache_size=cache_size,
+        )
+
+    def check_for_updates(self) -> bool:
+        """Reloads the data on the next access if the sync published a new
+        version since the last check, checking at most every
+        DATA_CHECK_INTERVAL seconds. Returns whether it changed."""
+        if time.monotonic() - self._checked_at < DATA_CHECK_INTERVAL:
+            return False
+        with self._lock:
+            if time.monotonic() - self._checked_at < DATA_CHECK_INTERVAL:
+                return False
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.version_path)
+            except FileNotFoundError:
+                return False
+            # the file is replaced rather than rewritten, so its inode changes
+            version_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if version_stat == self._version_stat:
+                return False
+            self._version_stat = version_stat
+
+            try:
+                with open(self.version_path, "r") as f:
+                    version = json.load(f)["version"]
+            except (FileNotFoundError, ValueError, KeyError):
+                logger.warning(
+                    f"ignoring unreadable data version at {self.version_path}"
+                )
+                return False
+            if version == self.data_version:
+                return False
+
+            if self.data_version is not None:
+                logger.info(f"data version changed to {version[:8]}, reloading")
+            self.data_version = version
+            for store in self.stores():
+                store.invalidate()
+            return True
+
+    def stores(self) -> list[FileStore]:
+        return [
+            self.activity_store,
+            self.rollup_store,
+            *self.derived_stores(),
+        ]
+
+    def derived_stores(self) -> list[FileStore]:
+        """Returns the stores of the files the sync derives from the
+        activities besides the rollup, each optional."""
+        return [
+            self.best_efforts_store,
+            self.route_tile_store,
+            self.training_load_store,
+        ]
+
+    def get_published(self, store: FileStore) -> Optional[Any]:
+        """Returns the data of a file written by the sync, None if there is
+        none yet or it can't be used"""
+        try:
+            return store.get()
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # e.g. written by an older sync, the store remembers the rejected
+            # version and skips it until the next sync replaces the file
+            return None
+
+    def get_rollup(self) -> Optional[dict]:
+        """Returns the rollup written by the sync, None if there is none yet,
+        in which case the raw activities are served"""
+        return self.get_published(self.rollup_store)
+
+    def get_database(self) -> Optional[ActivityDatabase]:
+        """Returns the activity database written by the sync, None if there
+        is none yet, in which case the activities file is read"""
+        try:
+            return ActivityDatabase(self.database_path, create=False)
+        except FileNotFoundError:
+            return None
+
+    def get_available_years(self) -> list[int]:
+        """Returns the years with activities, from the rollup when available,
+        else from the database"""
+        rollup = self.get_rollup()
+        if rollup is not None:
+            return rollup["years"]
+        database = self.get_database()
+        if database is not None:
+            return database.get_years()
+        try:
+            return get_strava_activities_years(self.activity_store.get_table())
+        except FileNotFoundError:
+            logger.warning(
+                f"no saved activities at {self.activity_store.path}, run the sync first"
+            )
+            return []
+
+    def load(self) -> "Dataset":
+        """Loads the data the dashboard serves, the rollup and derived files
+        or else the activities, so nbytes reflects it. Returns the dataset."""
+        if self.get_rollup() is None and self.get_database() is None:
+            try:
+                self.activity_store.get_table()
+            except FileNotFoundError:
+                pass
+        for store in self.derived_stores():
+            self.get_published(store)
+        return self
+
+    def nbytes(self) -> int:
+        """Returns the memory held by the loaded data and the cached views."""
+        return (
+            sum(store.nbytes() for store in self.stores())
+            + self.dashboard_cache.nbytes()
+        )
@@ -0,0 +1,260 @@
+import json
+import logging
+from typing import TYPE_CHECKING, Iterable, Optional
+
+import numpy as np
+
+from strava_stats.activity_store import FileStore
+from strava_stats.strava_api import resolve_activities_path, write_json_atomic
+from strava_stats.strava_stats import ALL_YEARS
+from strava_stats.streams import StreamStore
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+BEST_EFFORTS_FORMAT_VERSION = 1
+BEST_EFFORTS_FILENAME = "best_efforts.json"
+# seconds of the mean-maximal power curve
+POWER_DURATIONS = np.array([5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600])
+POWER_DURATION_LABELS = [
+    "5s",
+    "15s",
+    "30s",
+    "1min",
+    "2min",
+    "5min",
+    "10min",
+    "20min",
+    "30min",
+    "60min",
+]
+# meters of the best efforts
+EFFORT_DISTANCES = np.array([1000, 5000, 10000, 20000, 40000, 50000, 100000])
+EFFORT_DISTANCE_LABELS = ["1km", "5km", "10km", "20km", "40km", "50km", "100km"]
+# longer gaps between samples are pauses in the recording, ridden at 0 watts
+MAX_SAMPLE_GAP_SECONDS = 10
+
+
+def mean_max_power(
+    time: np.ndarray, watts: np.ndarray, durations: np.ndarray = POWER_DURATIONS
+) -> np.ndarray:
+    """Returns the highest average power held for each duration, NaN for
+    durations longer than the activity or activities without power.
+
+    The power is resampled to one value per second through the cumulative
+    energy, so the average of every window is a difference of two sums.
+    """
+    result = np.full(len(durations), np.nan)
+    if len(time) < 2 or np.isnan(watts).all():
+        return result
+
+    time = time.astype(np.float64)
+    gaps = np.diff(time, prepend=time[0])
+    # dropped samples and pauses contribute no energy
+    joules = np.nan_to_num(watts, nan=0.0) * np.where(
+        gaps > MAX_SAMPLE_GAP_SECONDS, 0.0, gaps
+    )
+    seconds = np.arange(time[0], time[-1] + 1)
+    energy = np.interp(seconds, time, np.cumsum(joules))
+
+    for i, duration in enumerate(durations):
+        if duration < len(energy):
+            result[i] = (energy[duration:] - energy[:-duration]).max() / duration
+    return result
+
+
+def fastest_times(
+    time: np.ndarray, distance: np.ndarray, distances: np.ndarray = EFFORT_DISTANCES
+) -> np.ndarray:
+    """Returns the fastest time in seconds covering each distance, NaN for
+    distances longer than the activity."""
+    result = np.full(len(distances), np.nan)
+    valid = ~np.isnan(distance)
+    time, distance = time[valid].astype(np.float64), distance[valid]
+    if len(time) < 2:
+        return result
+
+    distance = np.maximum.accumulate(distance.astype(np.float64))
+    # the first sample reaching each distance, so standing still at the end
+    # of an effort doesn't count towards it
+    reached = np.diff(distance, prepend=-np.inf) > 0
+    for i, target in enumerate(distances):
+        starts = distance <= distance[-1] - target
+        if starts.any():
+            ends = np.interp(
+                distance[starts] + target, distance[reached], time[reached]
+            )
+            result[i] = (ends - time[starts]).min()
+    return result
+
+
+def activity_best_efforts(
+    streams: dict[str, np.ndarray],
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the power curve and fastest times of a single activity."""
+    time = streams["time"]
+    return (
+        mean_max_power(time, streams["watts"]),
+        fastest_times(time, streams["distance"]),
+    )
+
+
+def update_best_efforts(
+    store: StreamStore,
+    activities: Iterable[dict],
+    path: str = f"data/{BEST_EFFORTS_FILENAME}",
+) -> dict:
+    """Computes the curves of the activities with streams and writes them,
+    one row per activity.
+
+    Rows of the previous file are reused, so only activities whose streams
+    were fetched since are computed, and rows of deleted activities dropped.
+    """
+    previous = {}
+    try:
+        cached = BestEffortsStore(path).load()
+        for i, activity_id in enumerate(cached["activity_ids"].tolist()):
+            previous[activity_id] = (cached["power"][i], cached["times"][i])
+    except (FileNotFoundError, ValueError):
+        pass
+
+    activities = {activity["id"]: activity for activity in activities}
+    stored = [
+        activity_id
+        for activity_id in store.activity_ids().tolist()
+        if activity_id in activities
+    ]
+    missing = [activity_id for activity_id in stored if activity_id not in previous]
+    for activity_id, streams in store.iter_activities(
+        missing, channels=["time", "distance", "watts"]
+    ):
+        previous[activity_id] = activity_best_efforts(streams)
+
+    rows = [activity_id for activity_id in stored if activity_id in previous]
+    power = np.array([previous[activity_id][0] for activity_id in rows])
+    times = np.array([previous[activity_id][1] for activity_id in rows])
+    best_efforts = dict(
+        format=BEST_EFFORTS_FORMAT_VERSION,
+        durations=POWER_DURATIONS.tolist(),
+        distances=EFFORT_DISTANCES.tolist(),
+        activity_ids=rows,
+        years=[int(activities[activity_id]["start_date"][:4]) for activity_id in rows],
+        types=[activities[activity_id]["type"] for activity_id in rows],
+        # NaN isn't valid JSON, durations and distances not reached are null
+        power=np.where(np.isnan(power), None, power).tolist(),
+        times=np.where(np.isnan(times), None, times).tolist(),
+    )
+    write_json_atomic(resolve_activities_path(path), best_efforts)
+    logger.info(
+        f"wrote best efforts of {len(rows)} activities to {path} "
+        f"({len(missing)} computed)"
+    )
+    return best_efforts
+
+
+def select_best_efforts(
+    best_efforts: dict, year, activity_type: Optional[str]
+) -> np.ndarray:
+    """Returns a mask of the activities of a year, or ALL_YEARS, and type."""
+    mask = np.ones(len(best_efforts["activity_ids"]), dtype=bool)
+    if year != ALL_YEARS:
+        mask &= best_efforts["years"] == year
+    if activity_type:
+        mask &= best_efforts["types"] == activity_type
+    return mask
+
+
+def best_effort_curves(
+    best_efforts: dict, year, activity_type: Optional[str]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the power curve and fastest times over a year, or ALL_YEARS for
+    the lifetime curves, as an element-wise max and min of the activity rows."""
+    mask = select_best_efforts(best_efforts, year, activity_type)
+    # fmax and fmin skip the NaN of durations and distances an activity lacks
+    return (
+        np.fmax.reduce(best_efforts["power"][mask], axis=0, initial=np.nan),
+        np.fmin.reduce(best_efforts["times"][mask], axis=0, initial=np.nan),
+    )
+
+
+def yearly_best_effort_curves(
+    best_efforts: dict, activity_type: Optional[str]
+) -> tuple[list[int], np.ndarray, np.ndarray]:
+    """Returns the years and the power curves and fastest times of every year,
+    one row per year."""
+    mask = select_best_efforts(best_efforts, ALL_YEARS, activity_type)
+    years, group = np.unique(best_efforts["years"][mask], return_inverse=True)
+    power = np.full((len(years), len(POWER_DURATIONS)), np.nan)
+    np.fmax.at(power, group, best_efforts["power"][mask])
+    times = np.full((len(years), len(EFFORT_DISTANCES)), np.nan)
+    np.fmin.at(times, group, best_efforts["times"][mask])
+    return years.tolist(), power, times
+
+
+def power_curve_frame(curves: dict[str, np.ndarray]) -> "pd.DataFrame":
+    """Returns labeled power curves as a long frame for plotting."""
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            "Duration": POWER_DURATION_LABELS * len(curves),
+            "Watts": np.concatenate(list(curves.values())) if curves else [],
+            "Curve": np.repeat(list(curves), len(POWER_DURATIONS)),
+        }
+    ).dropna()
+
+
+def best_efforts_frame(curves: dict[str, np.ndarray]) -> "pd.DataFrame":
+    """Returns labeled fastest times as a long frame of average speeds for
+    plotting."""
+    import pandas as pd
+
+    times = np.concatenate(list(curves.values())) if curves else np.zeros(0)
+    return pd.DataFrame(
+        {
+            "Distance": EFFORT_DISTANCE_LABELS * len(curves),
+            "Speed": np.tile(EFFORT_DISTANCES, len(curves)) / times * 3.6,
+            "Curve": np.repeat(list(curves), len(EFFORT_DISTANCES)),
+        }
+    ).dropna()
+
+
+class BestEffortsStore(FileStore):
+    """Keeps the per-activity curves written by the sync in memory, reloading
+    them when the sync writes new ones."""
+
+    description = "best efforts"
+
+    def __init__(
+        self, path: str = f"data/{BEST_EFFORTS_FILENAME}", check_interval: float = 0
+    ):
+        super().__init__(path, check_interval)
+
+    def load(self) -> dict:
+        with open(self.file_path, "r") as f:
+            best_efforts = json.load(f)
+        if (
+            best_efforts.get("format") != BEST_EFFORTS_FORMAT_VERSION
+            or best_efforts["durations"] != POWER_DURATIONS.tolist()
+            or best_efforts["distances"] != EFFORT_DISTANCES.tolist()
+        ):
+            raise ValueError(f"unsupported best efforts format in {self.path}")
+        # the rows are only ever reduced, as arrays
+        return dict(
+            activity_ids=np.array(best_efforts["activity_ids"], dtype=np.int64),
+            years=np.array(best_efforts["years"], dtype=np.int64),
+            types=np.array(best_efforts["types"], dtype=str),
+            power=np.array(best_efforts["power"], dtype=np.float64).reshape(
+                -1, len(POWER_DURATIONS)
+            ),
+            times=np.array(best_efforts["times"], dtype=np.float64).reshape(
+                -1, len(EFFORT_DISTANCES)
+            ),
+        )
+
+    def nbytes(self) -> int:
+        if not self.loaded:
+            return 0
+        return sum(column.nbytes for column in self._data.values())
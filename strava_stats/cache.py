@@ -0,0 +1,174 @@
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_nbytes(value: Any) -> int:
+    """Returns an estimate of the memory held by a value made of dicts,
+    lists, strings and arrays, such as a serialized figure."""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_nbytes(key) + estimate_nbytes(item) for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(item) for item in value)
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Bounded least-recently-used cache scoped to a single dataset version.
+
+    Keys are expected to start with the dataset version, and entries from
+    any other version are dropped as soon as a new version is seen, so a sync
+    that writes new data invalidates the cache automatically. With a
+    ``sizeof``, every value is measured once when stored and ``nbytes``
+    returns their total.
+    """
+
+    def __init__(
+        self, maxsize: int = 128, sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.version: Optional[Hashable] = None
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._sizes: dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_compute(
+        self, version: Hashable, key: tuple, compute: Callable[[], Any]
+    ) -> Any:
+        """Returns the cached value for (version, *key), computing and storing
+        it on a miss."""
+        full_key = (version, *key)
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    logger.info(
+                        f"dataset version changed, dropping {len(self._entries)} cached entries"
+                    )
+                self._entries.clear()
+                self._sizes.clear()
+                self.version = version
+
+            if full_key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(full_key)
+                return self._entries[full_key]
+            self.misses += 1
+
+        # compute and measure outside the lock so slow builds don't block
+        # cache hits
+        value = compute()
+        size = self.sizeof(value) if self.sizeof else 0
+
+        with self._lock:
+            if version == self.version:
+                self._entries[full_key] = value
+                self._sizes[full_key] = size
+                self._entries.move_to_end(full_key)
+                while len(self._entries) > self.maxsize:
+                    evicted, _ = self._entries.popitem(last=False)
+                    del self._sizes[evicted]
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+    def nbytes(self) -> int:
+        """Returns the total size of the cached values, 0 without sizeof."""
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters and size of the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "nbytes": self.nbytes(),
+        }
+
+
+class SizedLRUCache:
+    """Least-recently-used cache bounded by the total size of its values.
+
+    Sizes are measured with ``sizeof`` whenever an entry is accessed, since
+    values such as datasets grow as they cache views. ``create`` should
+    return the value fully loaded, so a new entry counts against the budget
+    before the eviction check that follows it. The
+    most recently used entry is never evicted, so a single value larger than
+    the budget is still served.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int]):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], Any]) -> Any:
+        """Returns the value for key, creating it on a miss, and evicts the
+        least recently used values beyond the budget."""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self.misses += 1
+                self._entries[key] = create()
+            value = self._entries[key]
+
+            sizes = {k: self.sizeof(v) for k, v in self._entries.items()}
+            total = sum(sizes.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                evicted, _ = self._entries.popitem(last=False)
+                total -= sizes[evicted]
+                self.evictions += 1
+                logger.info(
+                    f"evicted {evicted} ({sizes[evicted] / 1024 / 1024:.1f} MB) "
+                    f"from the cache, {total / 1024 / 1024:.1f} MB in use"
+                )
+            return value
+
+    def values(self) -> list[Any]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def nbytes(self) -> int:
+        """Returns the current total size of the cached values."""
+        return sum(self.sizeof(value) for value in self.values())
+
+    def stats(self) -> dict:
+        """Returns the counters and size of the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "nbytes": self.nbytes(),
+            "max_bytes": self.max_bytes,
+        }
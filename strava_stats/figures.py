@@ -0,0 +1,428 @@
+import json
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
+
+from strava_stats.activity_table import ActivityTable, DayIndex
+from strava_stats.athletes import Dataset
+from strava_stats.best_efforts import (
+    best_effort_curves,
+    best_efforts_frame,
+    power_curve_frame,
+    yearly_best_effort_curves,
+)
+from strava_stats.metrics import metrics
+from strava_stats.plots import (
+    plot_best_efforts,
+    plot_cumulative_distance_by_year,
+    plot_daily_series,
+    plot_km_per_day_by_year_heatmap,
+    plot_km_per_day_heatmap,
+    plot_monthly_distance_binned,
+    plot_monthly_distance_by_year,
+    plot_power_curve,
+    plot_ride_length_binned,
+    plot_route_density,
+)
+from strava_stats.rollups import (
+    get_rollup_view,
+    rollup_calendar_years,
+    rollup_longest_streak,
+    rollup_view_calendar,
+    rollup_view_heatmap,
+    rollup_view_summary,
+)
+from strava_stats.routes import ROUTE_ZOOMS, route_density, route_density_frame
+from strava_stats.storage import ActivityDatabase
+from strava_stats.strava_stats import (
+    ALL_YEARS,
+    DISTANCE_BIN_LABELS,
+    calendar_years,
+    cumulative_distance_by_year,
+    cumulative_distance_frame,
+    current_year,
+    filter_strava_activities,
+    generate_km_per_day_by_year_heatmap_data,
+    generate_km_per_day_heatmap_data,
+    generate_monthly_distance_binned_data,
+    generate_monthly_distance_by_year_data,
+    generate_ride_length_binned_data,
+    monthly_distance_by_year_frame,
+    monthly_distance_frame,
+    ride_length_binned_frame,
+    summarize_activities,
+    year_pace,
+)
+from strava_stats.templates import load_reds_dark_template, load_reds_template
+from strava_stats.training_load import (
+    rolling_distance_frame,
+    training_load_frame,
+    training_load_view,
+)
+
+HEATMAP_COLORSCALES = {"light": "reds", "dark": "inferno"}
+MAP_STYLES = {"light": "carto-positron", "dark": "carto-darkmatter"}
+LOAD_LABELS = {"suffer_score": "Relative Effort", "moving_time": "Moving Minutes"}
+# figures are built with the light template, sent without it and restyled in
+# the browser, the template is passed to each figure so no global plotly state
+# is touched
+FIGURE_TEMPLATES = {"light": load_reds_template(), "dark": load_reds_dark_template()}
+
+
+def get_figure_themes() -> dict:
+    """Returns the plotly template and heatmap colorscale of each theme, for
+    restyling the figures in the browser"""
+    return {
+        theme: {
+            "template": FIGURE_TEMPLATES[theme].to_plotly_json(),
+            "heatmap_colorscale": px.colors.get_colorscale(colorscale),
+            "map_style": MAP_STYLES[theme],
+        }
+        for theme, colorscale in HEATMAP_COLORSCALES.items()
+    }
+
+
+FIGURE_THEMES = get_figure_themes()
+
+
+def apply_figure_theme(figure: dict, theme: str) -> dict:
+    """Returns a serialized figure restyled for a theme, the server side
+    counterpart of the restyling done in the browser"""
+    layout = {**figure["layout"], "template": FIGURE_TEMPLATES[theme].to_plotly_json()}
+    if "coloraxis" in layout:
+        layout["coloraxis"] = {
+            **layout["coloraxis"],
+            "colorscale": px.colors.get_colorscale(HEATMAP_COLORSCALES[theme]),
+        }
+    if "map" in layout:
+        layout["map"] = {**layout["map"], "style": MAP_STYLES[theme]}
+    return {**figure, "layout": layout}
+
+
+def serialize_figure(name: str, figure: go.Figure) -> dict:
+    """Returns a figure as sent to the browser, recording its size.
+
+    The template is dropped, since the browser applies the template of the
+    selected theme anyway, and it would otherwise be the bulk of the payload.
+    """
+    serialized = figure.to_dict()
+    serialized["layout"].pop("template", None)
+    metrics.observe(
+        "figure_bytes",
+        len(json.dumps(serialized, cls=PlotlyJSONEncoder)),
+        help="Serialized size of the dashboard figures",
+        figure=name,
+    )
+    return serialized
+
+
+def build_view_figures(
+    year,
+    years: Optional[range],
+    heatmap: np.ndarray,
+    ride_length: pd.DataFrame,
+    monthly_distance: pd.DataFrame,
+) -> dict:
+    """Plots and serializes the heatmap, ride length and monthly distance
+    figures of a view from its precomputed arrays and frames"""
+    with metrics.timer("figure"):
+        if year == ALL_YEARS:
+            heatmap_figure = plot_km_per_day_by_year_heatmap(
+                years,
+                heatmap,
+                color=HEATMAP_COLORSCALES["light"],
+                template=FIGURE_TEMPLATES["light"],
+            )
+            monthly_distance_figure = plot_monthly_distance_by_year(
+                monthly_distance, template=FIGURE_TEMPLATES["light"]
+            )
+        else:
+            heatmap_figure = plot_km_per_day_heatmap(
+                heatmap,
+                color=HEATMAP_COLORSCALES["light"],
+                template=FIGURE_TEMPLATES["light"],
+            )
+            monthly_distance_figure = plot_monthly_distance_binned(
+                monthly_distance, template=FIGURE_TEMPLATES["light"]
+            )
+        return {
+            "heatmap": serialize_figure("heatmap", heatmap_figure),
+            "ride_length": serialize_figure(
+                "ride_length",
+                plot_ride_length_binned(
+                    ride_length, template=FIGURE_TEMPLATES["light"]
+                ),
+            ),
+            "monthly_distance": serialize_figure(
+                "monthly_distance", monthly_distance_figure
+            ),
+        }
+
+
+def build_dashboard_data_from_rollup(rollup: dict, year, activity_type) -> dict:
+    """Builds the stat card aggregates and serialized figures for a view from
+    the rollup, without touching the raw activities"""
+    year = year or current_year()
+    with metrics.timer("aggregate"):
+        view = get_rollup_view(rollup, year, activity_type)
+        summary = rollup_view_summary(view)
+        ride_length = ride_length_binned_frame(
+            view["ride_length_bins"] if view else [0] * len(DISTANCE_BIN_LABELS)
+        )
+        if year == ALL_YEARS:
+            years = rollup_calendar_years(rollup)
+            heatmap = rollup_view_calendar(view, years)
+            monthly_distance = monthly_distance_by_year_frame(
+                years, view["monthly_by_year"] if view else [[0.0] * 12] * len(years)
+            )
+        else:
+            years = None
+            heatmap = rollup_view_heatmap(view, year)
+            monthly_distance = monthly_distance_frame(
+                view["monthly"] if view else [0.0] * 12
+            )
+
+    return {
+        "summary": summary,
+        "longest_streak_ever": rollup_longest_streak(rollup, activity_type),
+        **build_view_figures(year, years, heatmap, ride_length, monthly_distance),
+    }
+
+
+def query_view_table(
+    dataset: Dataset, database: Optional[ActivityDatabase], year, activity_type
+) -> tuple[ActivityTable, int]:
+    """Returns the activities of a view and the longest streak ever of its
+    type, only reading the matching rows when the sync wrote the database"""
+    if database is None:
+        all_activities = dataset.activity_store.get_table()
+        activities = filter_strava_activities(
+            all_activities, year=year, activity_type=activity_type
+        )
+        return activities, all_activities.day_index(activity_type).longest_streak()
+    year = None if year == ALL_YEARS else year or current_year()
+    longest_streak_ever = DayIndex.from_days(
+        database.get_activity_days(activity_type)
+    ).longest_streak()
+    return database.query_table(activity_type, year), longest_streak_ever
+
+
+def build_dashboard_data(
+    dataset: Dataset, year, activity_type, database: Optional[ActivityDatabase] = None
+) -> dict:
+    """Computes the stat card aggregates and serialized figures for a view"""
+    with metrics.timer("filter"):
+        activities, longest_streak_ever = query_view_table(
+            dataset, database, year, activity_type
+        )
+
+    with metrics.timer("aggregate"):
+        summary = summarize_activities(activities)
+        ride_length = generate_ride_length_binned_data(activities)
+        if year == ALL_YEARS:
+            years = calendar_years(activities)
+            heatmap = generate_km_per_day_by_year_heatmap_data(activities, years)
+            monthly_distance = generate_monthly_distance_by_year_data(activities, years)
+        else:
+            years = None
+            heatmap = generate_km_per_day_heatmap_data(
+                activities, year or current_year()
+            )
+            monthly_distance = generate_monthly_distance_binned_data(activities)
+
+    return {
+        "summary": summary,
+        "longest_streak_ever": longest_streak_ever,
+        **build_view_figures(year, years, heatmap, ride_length, monthly_distance),
+    }
+
+
+def build_best_effort_figures(
+    best_efforts: Optional[dict], year, activity_type
+) -> dict:
+    """Builds the power curve and best effort figures of a view, comparing a
+    year with the lifetime curves and every year with each other"""
+    year = year or current_year()
+    with metrics.timer("aggregate"):
+        power_curves, fastest_times = {}, {}
+        if best_efforts is not None and year == ALL_YEARS:
+            years, power, times = yearly_best_effort_curves(best_efforts, activity_type)
+            for i, curve_year in enumerate(years):
+                power_curves[str(curve_year)] = power[i]
+                fastest_times[str(curve_year)] = times[i]
+        elif best_efforts is not None:
+            for label, curve_year in [("Lifetime", ALL_YEARS), (str(year), year)]:
+                power_curves[label], fastest_times[label] = best_effort_curves(
+                    best_efforts, curve_year, activity_type
+                )
+
+    with metrics.timer("figure"):
+        return {
+            "power_curve": serialize_figure(
+                "power_curve",
+                plot_power_curve(
+                    power_curve_frame(power_curves), template=FIGURE_TEMPLATES["light"]
+                ),
+            ),
+            "best_efforts": serialize_figure(
+                "best_efforts",
+                plot_best_efforts(
+                    best_efforts_frame(fastest_times),
+                    template=FIGURE_TEMPLATES["light"],
+                ),
+            ),
+        }
+
+
+def build_route_figure(tiles: Optional[dict], year, activity_type) -> dict:
+    """Builds the route density map of a view from the tiles rasterized by
+    the sync"""
+    year = year or current_year()
+    with metrics.timer("aggregate"):
+        if tiles is None:
+            zoom, density = ROUTE_ZOOMS[0], route_density_frame()
+        else:
+            zoom, density = route_density(tiles, year, activity_type)
+
+    with metrics.timer("figure"):
+        return {
+            "routes": serialize_figure(
+                "routes",
+                plot_route_density(
+                    density,
+                    zoom,
+                    color=HEATMAP_COLORSCALES["light"],
+                    template=FIGURE_TEMPLATES["light"],
+                ),
+            )
+        }
+
+
+def build_training_load_figures(
+    training_load: Optional[dict], year, activity_type
+) -> dict:
+    """Builds the training load and rolling distance figures of a view, a
+    year day by day or every year week by week"""
+    year = year or current_year()
+    with metrics.timer("aggregate"):
+        view = None
+        if training_load is not None:
+            view = training_load_view(training_load, year, activity_type)
+        start, step_days, series = view or (f"{current_year()}-01-01", 1, {})
+        load_label = LOAD_LABELS[training_load["source"]] if training_load else "Load"
+
+    with metrics.timer("figure"):
+        return {
+            "training_load": serialize_figure(
+                "training_load",
+                plot_daily_series(
+                    training_load_frame(series),
+                    str(start),
+                    step_days,
+                    load_label,
+                    template=FIGURE_TEMPLATES["light"],
+                ),
+            ),
+            "rolling_distance": serialize_figure(
+                "rolling_distance",
+                plot_daily_series(
+                    rolling_distance_frame(series),
+                    str(start),
+                    step_days,
+                    "Distance (km)",
+                    template=FIGURE_TEMPLATES["light"],
+                ),
+            ),
+        }
+
+
+def build_derived_figures(
+    best_efforts: Optional[dict],
+    route_tiles: Optional[dict],
+    training_load: Optional[dict],
+    year,
+    activity_type,
+) -> dict:
+    """Builds the figures of the data the sync derives besides the rollup,
+    in the order of Dataset.derived_stores"""
+    return {
+        **build_best_effort_figures(best_efforts, year, activity_type),
+        **build_route_figure(route_tiles, year, activity_type),
+        **build_training_load_figures(training_load, year, activity_type),
+    }
+
+
+def build_year_over_year(years: range, cumulative: np.ndarray, year) -> dict:
+    """Builds the pace against the year before and the cumulative distance
+    figure of a view, highlighting the selected year, or the current one for
+    ALL_YEARS"""
+    year = year or current_year()
+    highlight = current_year() if year == ALL_YEARS else year
+    with metrics.timer("aggregate"):
+        pace = year_pace(years, cumulative, highlight)
+        cumulative_distance = cumulative_distance_frame(years, cumulative)
+
+    with metrics.timer("figure"):
+        return {
+            "year_pace": pace,
+            "cumulative_distance": serialize_figure(
+                "cumulative_distance",
+                plot_cumulative_distance_by_year(
+                    cumulative_distance,
+                    str(highlight),
+                    template=FIGURE_TEMPLATES["light"],
+                ),
+            ),
+        }
+
+
+def rollup_cumulative_distance(rollup: dict, activity_type) -> tuple[range, np.ndarray]:
+    """Returns the years and the years x 366 cumulative distance of an
+    activity type from the rollup"""
+    years = rollup_calendar_years(rollup)
+    daily = rollup_view_calendar(
+        get_rollup_view(rollup, ALL_YEARS, activity_type), years
+    )
+    return years, cumulative_distance_by_year(daily)
+
+
+def get_cumulative_distance(
+    dataset: Dataset,
+    rollup: Optional[dict],
+    activity_type,
+    version,
+    database: Optional[ActivityDatabase] = None,
+) -> tuple[range, np.ndarray]:
+    """Returns the years and the years x 366 cumulative distance of an
+    activity type, cached per dataset version so switching the year doesn't
+    recompute it"""
+
+    def compute():
+        with metrics.timer("aggregate"):
+            if rollup is not None:
+                return rollup_cumulative_distance(rollup, activity_type)
+            elif database is not None:
+                stored_years = database.get_years()
+                years = (
+                    range(stored_years[0], stored_years[-1] + 1)
+                    if stored_years
+                    else calendar_years([])
+                )
+                daily = generate_km_per_day_by_year_heatmap_data(
+                    database.query_daily_distance(activity_type), years
+                )
+            else:
+                table = dataset.activity_store.get_table()
+                years = calendar_years(table)
+                daily = generate_km_per_day_by_year_heatmap_data(
+                    filter_strava_activities(table, activity_type, ALL_YEARS), years
+                )
+            return years, cumulative_distance_by_year(daily)
+
+    return dataset.dashboard_cache.get_or_compute(
+        version, ("cumulative_distance", activity_type), compute
+    )
@@ -1,317 +1,581 @@
-from datetime import datetime
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date
+from typing import Optional
 
-import plotly.io as pio
-from dash import Dash, Input, Output, State, callback, dcc, html
+from dash import Dash, Input, Output, State, callback, clientside_callback, dcc, html
 
-from strava_stats.plots import (
-    generate_km_per_day_over_year_heatmap,
-    generate_monthly_distance_binned_plot,
-    generate_ride_length_binned_plot,
+from strava_stats.athletes import Dataset, athlete_exists
+from strava_stats.cache import SizedLRUCache
+from strava_stats.metrics import instrument_server, metrics
+from strava_stats.strava_stats import ALL_YEARS, YearPace, current_year
+
+logger = logging.getLogger(__name__)
+
+default_dataset = Dataset()
+# athlete datasets are loaded on demand and evicted beyond the memory budget
+dataset_cache = SizedLRUCache(
+    max_bytes=int(os.getenv("STRAVA_DATASET_CACHE_MB", "512")) * 1024 * 1024,
+    sizeof=lambda dataset: dataset.nbytes(),
+)
+
+
+def all_datasets() -> list[Dataset]:
+    return [default_dataset, *dataset_cache.values()]
+
+
+metrics.gauge(
+    "dashboard_cache_hits",
+    lambda: sum(dataset.dashboard_cache.hits for dataset in all_datasets()),
+    help="Dashboard views served from the cache",
+)
+metrics.gauge(
+    "dashboard_cache_misses",
+    lambda: sum(dataset.dashboard_cache.misses for dataset in all_datasets()),
+    help="Dashboard views computed on a cache miss",
 )
-from strava_stats.strava_api import load_strava_activities
-from strava_stats.strava_stats import (
-    calculate_biggest_ride,
-    calculate_elevation,
-    calculate_longest_ride,
-    calculate_moving_time,
-    calculate_num_rides,
-    calculate_ride_days,
-    calculate_streak_from_date,
-    calculate_total_distance,
-    filter_strava_activities,
-    get_strava_activities_years,
+metrics.gauge(
+    "activity_store_reloads",
+    lambda: sum(dataset.activity_store.reloads for dataset in all_datasets()),
+    help="Times the activities were reloaded from disk",
+)
+metrics.gauge(
+    "rollup_store_reloads",
+    lambda: sum(dataset.rollup_store.reloads for dataset in all_datasets()),
+    help="Times the rollup was reloaded from disk",
+)
+metrics.gauge(
+    "athlete_datasets_loaded",
+    lambda: len(dataset_cache),
+    help="Athlete datasets held in memory",
+)
+metrics.gauge(
+    "athlete_datasets_bytes",
+    lambda: dataset_cache.nbytes(),
+    help="Memory held by the athlete datasets",
+)
+metrics.gauge(
+    "athlete_dataset_evictions",
+    lambda: dataset_cache.evictions,
+    help="Athlete datasets evicted to stay within the memory budget",
 )
-from strava_stats.templates import load_reds_dark_template, load_reds_template
 
-app = Dash(external_scripts=["https://unpkg.com/@tailwindcss/browser@4"])
-app.title = "Strava Stats 🚲"
 
-activities = load_strava_activities()
-AVAILABLE_YEARS = sorted(get_strava_activities_years(activities), key=str, reverse=True)
-CURRENT_YEAR = datetime.now().date().year
+def parse_athlete_id(pathname: Optional[str]) -> Optional[str]:
+    """Returns the athlete id of an /athletes/<id> URL path, None for any
+    other path."""
+    match = re.fullmatch(r"/athletes/(\d+)/?", pathname or "")
+    return match.group(1) if match else None
 
-pio.templates["reds_dark"] = load_reds_dark_template()
-pio.templates["reds_light"] = load_reds_template()
 
+def get_dataset(athlete_id: Optional[str] = None) -> Optional[Dataset]:
+    """Returns the dataset of an athlete, or the default single-athlete one,
+    picking up any data the sync published since it was last used. Returns
+    None for an athlete without stored tokens, so arbitrary ids in URLs
+    don't fill the cache."""
+    if athlete_id is None:
+        dataset = default_dataset
+    elif not athlete_exists(athlete_id):
+        return None
+    else:
+        # loaded before it is stored, so it counts against the budget
+        dataset = dataset_cache.get_or_create(
+            athlete_id, lambda: Dataset.for_athlete(athlete_id).load()
+        )
+    dataset.check_for_updates()
+    return dataset
 
-def get_theme_colors(is_dark: bool) -> dict:
-    """Returns theme color configuration based on dark mode setting"""
-    if is_dark:
-        return {
-            "bg_primary": "bg-zinc-950",
-            "bg_card": "bg-zinc-900",
-            "text_primary": "text-zinc-100",
-            "text_secondary": "text-zinc-400",
-            "text_accent": "text-red-500",
-            "border": "border-zinc-800",
-            "shadow": "shadow-lg shadow-zinc-950/50",
-            "heatmap_color": "inferno",
-            "template": "reds_dark",
-        }
+
+def get_available_years(dataset: Dataset) -> list[int]:
+    """Returns the years with activities, latest first"""
+    return sorted(dataset.get_available_years(), key=str, reverse=True)
+
+
+# Tailwind classes of both themes, the dark: variants apply below the
+# element carrying the "dark" class, which is toggled client side
+THEME_CLASSES = {
+    "bg_primary": "bg-white dark:bg-zinc-950",
+    "bg_card": "bg-white dark:bg-zinc-900",
+    "text_primary": "text-gray-900 dark:text-zinc-100",
+    "text_secondary": "text-gray-600 dark:text-zinc-400",
+    "text_accent": "text-red-700 dark:text-red-500",
+    "border": "border-gray-200 dark:border-zinc-800",
+    "shadow": "shadow-md dark:shadow-lg dark:shadow-zinc-950/50",
+}
+
+
+def get_dashboard_data(year, activity_type, dataset: Optional[Dataset] = None) -> dict:
+    """Returns the dashboard data for a view, cached per dataset version"""
+    dataset = dataset or default_dataset
+    # the current streak is relative to today, so cached views expire daily,
+    # the theme is applied client side so it isn't part of the key
+    key = (year, activity_type, date.today())
+
+    # serve from the rollup written by the sync when there is one, else query
+    # the database it writes, else read the activities file
+    with metrics.timer("load"):
+        rollup = dataset.get_rollup()
+        database = dataset.get_database() if rollup is None else None
+        if rollup is None and database is None:
+            dataset.activity_store.get_table()
+        derived = [dataset.get_published(store) for store in dataset.derived_stores()]
+    derived_version = tuple(store.version for store in dataset.derived_stores())
+
+    if rollup is not None:
+        version = (dataset.rollup_store.version, *derived_version)
+    elif database is not None:
+        version = (f"database-{database.version()}", *derived_version)
     else:
+        version = (dataset.activity_store.version, *derived_version)
+
+    def build() -> dict:
+        # plotly and pandas are only imported once the first view is built
+        from strava_stats.figures import (
+            build_dashboard_data,
+            build_dashboard_data_from_rollup,
+            build_derived_figures,
+            build_year_over_year,
+            get_cumulative_distance,
+        )
+
+        if rollup is not None:
+            dashboard = build_dashboard_data_from_rollup(rollup, year, activity_type)
+        else:
+            dashboard = build_dashboard_data(dataset, year, activity_type, database)
+        years, cumulative = get_cumulative_distance(
+            dataset, rollup, activity_type, version, database
+        )
         return {
-            "bg_primary": "bg-white",
-            "bg_card": "bg-white",
-            "text_primary": "text-gray-900",
-            "text_secondary": "text-gray-600",
-            "text_accent": "text-red-700",
-            "border": "border-gray-200",
-            "shadow": "shadow-md",
-            "heatmap_color": "reds",
-            "template": "reds_light",
+            **dashboard,
+            **build_year_over_year(years, cumulative, year),
+            **build_derived_figures(*derived, year, activity_type),
         }
 
+    return dataset.dashboard_cache.get_or_compute(version, key, build)
+
+
+def year_options(years: list[int]) -> list[dict]:
+    """Returns the year dropdown options, All time first"""
+    return [{"label": "All time", "value": ALL_YEARS}] + [
+        {"label": str(year), "value": year} for year in years
+    ]
+
 
-def create_stat_card(title: str, value: str, theme_colors: dict) -> html.Div:
+def create_stat_card(title: str, value: str) -> html.Div:
     """Creates a consistent stat card component"""
     return html.Div(
         [
             html.Div(
                 title,
-                className=f"text-sm font-semibold mb-1 {theme_colors['text_accent']}",
+                className=f"text-sm font-semibold mb-1 {THEME_CLASSES['text_accent']}",
             ),
             html.Div(
                 value,
-                className=f"text-xl font-bold {theme_colors['text_primary']}",
+                className=f"text-xl font-bold {THEME_CLASSES['text_primary']}",
             ),
         ],
-        className=f"p-3 {theme_colors['bg_card']} {theme_colors['shadow']} rounded flex flex-col justify-center text-center border {theme_colors['border']} transition-transform duration-200",
+        className=f"p-3 {THEME_CLASSES['bg_card']} {THEME_CLASSES['shadow']} rounded flex flex-col justify-center text-center border {THEME_CLASSES['border']} transition-transform duration-200",
+    )
+
+
+def create_message(text: str) -> html.Div:
+    """Creates a message shown in place of the stat cards"""
+    return html.Div(
+        text,
+        className=f"col-span-2 p-3 text-center {THEME_CLASSES['text_secondary']}",
     )
 
 
 def create_chart_container(
-    title: str, graph_id: str, figure, theme_colors: dict, height: str = "300px"
+    title: str, graph_id: str, height: str = "300px"
 ) -> html.Div:
     """Creates a consistent chart container component"""
     return html.Div(
         children=[
             html.H2(
                 title,
-                className=f"text-base font-bold text-center {theme_colors['text_accent']} mb-2",
+                className=f"text-base font-bold text-center {THEME_CLASSES['text_accent']} mb-2",
             ),
             dcc.Graph(
                 id=graph_id,
-                figure=figure,
                 style={"height": height},
                 config={"displayModeBar": False},
             ),
         ],
-        className=f"p-3 {theme_colors['bg_card']} rounded {theme_colors['shadow']} border {theme_colors['border']}",
+        className=f"p-3 {THEME_CLASSES['bg_card']} rounded {THEME_CLASSES['shadow']} border {THEME_CLASSES['border']}",
     )
 
 
-@callback(
+def create_stat_cards(
+    summary, longest_streak_ever: int, pace: YearPace
+) -> list[html.Div]:
+    """Creates the stat cards of a view"""
+    return [
+        create_stat_card("Distance", f"{summary.total_distance:.2f} KM"),
+        create_stat_card("Current Streak", f"{summary.current_streak} days"),
+        create_stat_card("Rides", f"{summary.num_rides}"),
+        create_stat_card("Ride Days", f"{summary.ride_days}"),
+        create_stat_card("Duration", f"{summary.moving_time / 60 / 60:.1f} hrs"),
+        create_stat_card("Longest Ride", f"{summary.longest_ride / 60 / 60:.1f} hrs"),
+        create_stat_card("Biggest Ride", f"{summary.biggest_ride / 1000:.2f} KM"),
+        create_stat_card("Elevation", f"{summary.elevation:.0f} M"),
+        create_stat_card("Longest Streak", f"{summary.longest_streak} days"),
+        create_stat_card("All-Time Streak", f"{longest_streak_ever} days"),
+        create_stat_card(
+            f"{pace.year} vs {pace.year - 1}",
+            f"{pace.distance - pace.previous_distance:+.2f} KM",
+        ),
+        create_stat_card("Year-End Pace", f"{pace.projected_distance:.0f} KM"),
+    ]
+
+
+# Theme switching runs entirely in the browser: the toggle flips the stored
+# preference, which sets the "dark" class for the Tailwind dark: variants and
+# swaps the template and heatmap colorscale of the figures
+clientside_callback(
+    """
+    function (_, isDark) {
+        return !isDark;
+    }
+    """,
     Output("dark-mode-store", "data"),
     Input("theme-toggle", "n_clicks"),
     State("dark-mode-store", "data"),
     prevent_initial_call=True,
 )
-def toggle_dark_mode(_, current_mode):
-    """Toggle dark mode and save to cookie storage"""
-    return not current_mode if current_mode is not None else True
+
+clientside_callback(
+    """
+    function (isDark) {
+        return isDark ? "dark" : "";
+    }
+    """,
+    Output("theme-root", "className"),
+    Input("dark-mode-store", "data"),
+)
+
+clientside_callback(
+    """
+    function (figures, isDark, themes) {
+        if (!figures) {
+            return [{}, {}, {}, {}, {}, {}, {}, {}, {}];
+        }
+        const theme = themes[isDark ? "dark" : "light"];
+        const restyle = (figure) => {
+            const layout = {...figure.layout, template: theme.template};
+            if (layout.coloraxis) {
+                layout.coloraxis = {
+                    ...layout.coloraxis,
+                    colorscale: theme.heatmap_colorscale,
+                };
+            }
+            if (layout.map) {
+                layout.map = {...layout.map, style: theme.map_style};
+            }
+            return {...figure, layout: layout};
+        };
+        return [
+            restyle(figures.heatmap),
+            restyle(figures.ride_length),
+            restyle(figures.monthly_distance),
+            restyle(figures.cumulative_distance),
+            restyle(figures.power_curve),
+            restyle(figures.best_efforts),
+            restyle(figures.routes),
+            restyle(figures.training_load),
+            restyle(figures.rolling_distance),
+        ];
+    }
+    """,
+    Output("km-per-day-over-year-graph", "figure"),
+    Output("ride-length-binned-over-year-graph", "figure"),
+    Output("monthly-distance-graph-graph", "figure"),
+    Output("cumulative-distance-graph", "figure"),
+    Output("power-curve-graph", "figure"),
+    Output("best-efforts-graph", "figure"),
+    Output("routes-graph", "figure"),
+    Output("training-load-graph", "figure"),
+    Output("rolling-distance-graph", "figure"),
+    Input("dashboard-figures", "data"),
+    Input("dark-mode-store", "data"),
+    State("figure-themes", "data"),
+)
 
 
 @callback(
-    [
-        Output("main-container", "children"),
-        Output("app-container", "className"),
-        Output("header-container", "className"),
-        Output("footer-container", "className"),
-        Output("header-title", "className"),
-    ],
-    [
-        Input("year-dropdown", "value"),
-        Input("type-dropdown", "value"),
-        Input("dark-mode-store", "data"),
-    ],
+    Output("year-dropdown", "options"),
+    Input("url", "pathname"),
 )
-def update_app(year, activity_type, is_dark):
-    # Use dark mode from cookie storage
-    if is_dark is None:
-        is_dark = False
-    theme_colors = get_theme_colors(is_dark)
-
-    # set the appropriate plotly template
-    pio.templates.default = theme_colors["template"]
-
-    activities = load_strava_activities()
-    activities = filter_strava_activities(
-        activities, year=year, activity_type=activity_type
-    )
+def update_year_options(pathname):
+    dataset = get_dataset(parse_athlete_id(pathname))
+    if dataset is None:
+        return []
+    return year_options(get_available_years(dataset))
+
 
-    # update main content theme and children
-    main_content = [
-        html.Div(
-            id="main-container-inner",
+@callback(
+    Output("stat-cards", "children"),
+    Output("dashboard-figures", "data"),
+    Input("year-dropdown", "value"),
+    Input("type-dropdown", "value"),
+    Input("url", "pathname"),
+)
+def update_app(year, activity_type, pathname=None):
+    dataset = get_dataset(parse_athlete_id(pathname))
+    if dataset is None:
+        return [create_message("No such athlete")], None
+    try:
+        dashboard = get_dashboard_data(year, activity_type, dataset)
+    except FileNotFoundError:
+        return [create_message("No activities synced yet")], None
+
+    with metrics.timer("layout"):
+        stat_cards = create_stat_cards(
+            dashboard["summary"],
+            dashboard["longest_streak_ever"],
+            dashboard["year_pace"],
+        )
+    figures = {
+        "heatmap": dashboard["heatmap"],
+        "ride_length": dashboard["ride_length"],
+        "monthly_distance": dashboard["monthly_distance"],
+        "cumulative_distance": dashboard["cumulative_distance"],
+        "power_curve": dashboard["power_curve"],
+        "best_efforts": dashboard["best_efforts"],
+        "routes": dashboard["routes"],
+        "training_load": dashboard["training_load"],
+        "rolling_distance": dashboard["rolling_distance"],
+    }
+    return stat_cards, figures
+
+
+INDEX_STRING = """<!DOCTYPE html>
+<html>
+    <head>
+        {%metas%}
+        <title>{%title%}</title>
+        {%favicon%}
+        {%css%}
+        <style type="text/tailwindcss">
+            @custom-variant dark (&:where(.dark, .dark *));
+        </style>
+    </head>
+    <body>
+        {%app_entry%}
+        <footer>
+            {%config%}
+            {%scripts%}
+            {%renderer%}
+        </footer>
+    </body>
+</html>
+"""
+
+
+def serve_layout() -> html.Div:
+    """Builds the layout on every page load, so the year options and the
+    default year follow the data published by the sync"""
+    from strava_stats.figures import FIGURE_THEMES
+
+    return html.Div(
+        id="theme-root",
+        children=html.Div(
+            id="app-container",
+            className=f"{THEME_CLASSES['bg_primary']} min-h-screen transition-colors duration-300",
             children=[
-                # Heatmap section
+                # Store for dark mode preference (stored in browser cookie/localStorage)
+                dcc.Store(id="dark-mode-store", storage_type="local", data=False),
+                # the athlete is chosen by the URL, /athletes/<id>
+                dcc.Location(id="url", refresh=False),
+                dcc.Store(id="figure-themes", data=FIGURE_THEMES),
+                dcc.Store(id="dashboard-figures"),
+                # Header section
                 html.Div(
+                    id="header-container",
+                    className=f"max-w-7xl mx-auto px-2 py-4 mb-4 {THEME_CLASSES['bg_card']} rounded-b {THEME_CLASSES['shadow']} border-b border-x {THEME_CLASSES['border']} transition-colors duration-300",
                     children=[
-                        html.H2(
-                            "Distance (KM) by Date",
-                            className=f"text-base font-bold text-center {theme_colors['text_accent']} mb-2",
+                        html.Div(
+                            className="flex justify-between items-center mb-3",
+                            children=[
+                                html.Div(className="w-24"),  # spacer for centering
+                                html.H1(
+                                    "Strava Stats 🚲",
+                                    id="header-title",
+                                    className=f"text-4xl font-bold {THEME_CLASSES['text_primary']} text-center flex-1 transition-colors duration-300",
+                                ),
+                                html.Button(
+                                    "Light/Dark Mode",
+                                    id="theme-toggle",
+                                    n_clicks=0,
+                                    className="px-3 py-1 rounded bg-red-500 hover:bg-red-600 text-white text-sm font-medium transition-colors duration-200 cursor-pointer border-0 w-24",
+                                ),
+                            ],
                         ),
-                        dcc.Graph(
-                            id="km-per-day-over-year-graph",
-                            figure=generate_km_per_day_over_year_heatmap(
-                                activities, color=theme_colors["heatmap_color"]
-                            ),
-                            config={"displayModeBar": False},
+                        html.Div(
+                            className="flex justify-center gap-4 flex-wrap",
+                            children=[
+                                html.Div(
+                                    dcc.Dropdown(
+                                        year_options(
+                                            get_available_years(get_dataset())
+                                        ),
+                                        current_year(),
+                                        id="year-dropdown",
+                                        className="w-32",
+                                        placeholder="Year",
+                                    ),
+                                ),
+                                html.Div(
+                                    dcc.Dropdown(
+                                        ["Ride", "Run", "Hike"],
+                                        "Ride",
+                                        id="type-dropdown",
+                                        className="w-32",
+                                        placeholder="Type",
+                                        disabled=True,
+                                    ),
+                                ),
+                            ],
                         ),
                     ],
-                    className=f"max-w-7xl mx-auto px-2 mb-4 p-3 rounded {theme_colors['shadow']} {theme_colors['bg_card']} border {theme_colors['border']}",
                 ),
+                # Main content
                 html.Div(
-                    className="grid grid-cols-1 lg:grid-cols-3 gap-3 max-w-7xl mx-auto",
+                    id="main-container",
                     children=[
+                        # Heatmap section
                         html.Div(
-                            className="grid grid-cols-2 gap-2",
                             children=[
-                                create_stat_card(
-                                    "Distance",
-                                    f"{calculate_total_distance(activities):.2f} KM",
-                                    theme_colors,
-                                ),
-                                create_stat_card(
-                                    "Current Streak",
-                                    f"{calculate_streak_from_date(activities)} days",
-                                    theme_colors,
-                                ),
-                                create_stat_card(
-                                    "Rides",
-                                    f"{calculate_num_rides(activities)}",
-                                    theme_colors,
+                                html.H2(
+                                    "Distance (KM) by Date",
+                                    className=f"text-base font-bold text-center {THEME_CLASSES['text_accent']} mb-2",
                                 ),
-                                create_stat_card(
-                                    "Ride Days",
-                                    f"{calculate_ride_days(activities)}",
-                                    theme_colors,
+                                dcc.Graph(
+                                    id="km-per-day-over-year-graph",
+                                    config={"displayModeBar": False},
                                 ),
-                                create_stat_card(
-                                    "Duration",
-                                    f"{calculate_moving_time(activities) / 60 / 60:.1f} hrs",
-                                    theme_colors,
-                                ),
-                                create_stat_card(
-                                    "Longest Ride",
-                                    f"{calculate_longest_ride(activities) / 60 / 60:.1f} hrs",
-                                    theme_colors,
+                            ],
+                            className=f"max-w-7xl mx-auto px-2 mb-4 p-3 rounded {THEME_CLASSES['shadow']} {THEME_CLASSES['bg_card']} border {THEME_CLASSES['border']}",
+                        ),
+                        html.Div(
+                            className="grid grid-cols-1 lg:grid-cols-3 gap-3 max-w-7xl mx-auto",
+                            children=[
+                                html.Div(
+                                    id="stat-cards", className="grid grid-cols-2 gap-2"
                                 ),
-                                create_stat_card(
-                                    "Biggest Ride",
-                                    f"{calculate_biggest_ride(activities) / 1000:.2f} KM",
-                                    theme_colors,
+                                create_chart_container(
+                                    "Ride Count By Length",
+                                    "ride-length-binned-over-year-graph",
+                                    "300px",
                                 ),
-                                create_stat_card(
-                                    "Elevation",
-                                    f"{calculate_elevation(activities):.0f} M",
-                                    theme_colors,
+                                create_chart_container(
+                                    "Monthly Distance",
+                                    "monthly-distance-graph-graph",
+                                    "300px",
                                 ),
                             ],
                         ),
-                        create_chart_container(
-                            "Ride Count By Length",
-                            "ride-length-binned-over-year-graph",
-                            generate_ride_length_binned_plot(activities),
-                            theme_colors,
-                            "300px",
+                        html.Div(
+                            create_chart_container(
+                                "Distance vs Previous Years",
+                                "cumulative-distance-graph",
+                                "350px",
+                            ),
+                            className="max-w-7xl mx-auto mt-3",
                         ),
-                        create_chart_container(
-                            "Monthly Distance",
-                            "monthly-distance-graph-graph",
-                            generate_monthly_distance_binned_plot(activities),
-                            theme_colors,
-                            "300px",
+                        # curves computed from the activity streams
+                        html.Div(
+                            className="grid grid-cols-1 lg:grid-cols-2 gap-3 max-w-7xl mx-auto mt-3",
+                            children=[
+                                create_chart_container(
+                                    "Power Curve", "power-curve-graph", "300px"
+                                ),
+                                create_chart_container(
+                                    "Best Efforts", "best-efforts-graph", "300px"
+                                ),
+                            ],
                         ),
-                    ],
-                ),
-            ],
-        )
-    ]
-
-    # update the theme of the rest of the classes in the app
-    app_container_class = (
-        f"{theme_colors['bg_primary']} min-h-screen transition-colors duration-300"
-    )
-    header_class = f"max-w-7xl mx-auto px-2 py-4 mb-4 {theme_colors['bg_card']} rounded-b {theme_colors['shadow']} border-b border-x {theme_colors['border']} transition-colors duration-300"
-    footer_class = f"max-w-7xl mx-auto px-2 py-4 text-center {theme_colors['text_secondary']} text-xs mt-6 transition-colors duration-300"
-    header_title_class = f"text-4xl font-bold {theme_colors['text_primary']} text-center flex-1 transition-colors duration-300"
-
-    return (
-        main_content,
-        app_container_class,
-        header_class,
-        footer_class,
-        header_title_class,
-    )
-
-
-app.layout = html.Div(
-    id="app-container",
-    className="bg-white min-h-screen transition-colors duration-300",
-    children=[
-        # Store for dark mode preference (stored in browser cookie/localStorage)
-        dcc.Store(id="dark-mode-store", storage_type="local", data=False),
-        # Header section
-        html.Div(
-            id="header-container",
-            className="max-w-7xl mx-auto px-2 py-4 mb-4 bg-white rounded-b shadow-md border-b border-x border-gray-200 transition-colors duration-300",
-            children=[
-                html.Div(
-                    className="flex justify-between items-center mb-3",
-                    children=[
-                        html.Div(className="w-24"),  # spacer for centering
-                        html.H1(
-                            "Strava Stats 🚲",
-                            id="header-title",
-                            className="text-4xl font-bold text-gray-900 text-center flex-1 transition-colors duration-300",
+                        html.Div(
+                            className="grid grid-cols-1 lg:grid-cols-2 gap-3 max-w-7xl mx-auto mt-3",
+                            children=[
+                                create_chart_container(
+                                    "Training Load", "training-load-graph", "300px"
+                                ),
+                                create_chart_container(
+                                    "Rolling Distance",
+                                    "rolling-distance-graph",
+                                    "300px",
+                                ),
+                            ],
                         ),
-                        html.Button(
-                            "Light/Dark Mode",
-                            id="theme-toggle",
-                            n_clicks=0,
-                            className="px-3 py-1 rounded bg-red-500 hover:bg-red-600 text-white text-sm font-medium transition-colors duration-200 cursor-pointer border-0 w-24",
+                        html.Div(
+                            create_chart_container(
+                                "Where I Ride", "routes-graph", "500px"
+                            ),
+                            className="max-w-7xl mx-auto mt-3",
                         ),
                     ],
                 ),
+                # Footer
                 html.Div(
-                    className="flex justify-center gap-4 flex-wrap",
+                    id="footer-container",
+                    className=f"max-w-7xl mx-auto px-2 py-4 text-center {THEME_CLASSES['text_secondary']} text-xs mt-6 transition-colors duration-300",
                     children=[
-                        html.Div(
-                            dcc.Dropdown(
-                                AVAILABLE_YEARS,
-                                CURRENT_YEAR,
-                                id="year-dropdown",
-                                className="w-32",
-                                placeholder="Year",
-                            ),
-                        ),
-                        html.Div(
-                            dcc.Dropdown(
-                                ["Ride", "Run", "Hike"],
-                                "Ride",
-                                id="type-dropdown",
-                                className="w-32",
-                                placeholder="Type",
-                                disabled=True,
-                            ),
-                        ),
+                        html.P("Powered by Strava API"),
                     ],
                 ),
             ],
         ),
-        # Main content
-        html.Div(id="main-container"),
-        # Footer
-        html.Div(
-            id="footer-container",
-            className="max-w-7xl mx-auto px-2 py-4 text-center text-gray-600 text-xs mt-6",
-            children=[
-                html.P("Powered by Strava API"),
-            ],
-        ),
-    ],
-)
+    )
+
+
+_app: Optional[Dash] = None
+_app_lock = threading.Lock()
+
+
+def create_app(warm: bool = False) -> Dash:
+    """Returns the Dash app, creating it on the first call.
+
+    Creating it only sets up the server, the figure modules and the data are
+    loaded on first use. With ``warm`` they are loaded up front and the
+    default view is rendered, so started with gunicorn's ``--preload`` the
+    master does it once and the forked workers share its memory instead of
+    each loading their own copy.
+    """
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = Dash(external_scripts=["https://unpkg.com/@tailwindcss/browser@4"])
+            _app.title = "Strava Stats 🚲"
+            _app.index_string = INDEX_STRING
+            _app.layout = serve_layout
+            instrument_server(_app.server)
+    if warm:
+        warm_app(_app)
+    return _app
+
+
+def warm_app(app: Dash) -> None:
+    """Loads the figure modules and the default dataset, and renders the
+    page and the default view."""
+    start = time.perf_counter()
+    # Dash sets up the callbacks on the first request, which isn't safe when
+    # the first requests of a threaded worker arrive at once
+    app.server.test_client().get("/")
+    update_app(current_year(), "Ride")
+    logger.info(f"warmed the app in {time.perf_counter() - start:.2f}s")
+
+
+def __getattr__(name: str):
+    # the app is created on first access, so ``strava_stats.main:app`` keeps
+    # working as the WSGI entry point
+    if name == "app":
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", debug=True, use_reloader=True)
+    create_app().run(host="0.0.0.0", debug=True, use_reloader=True)
@@ -0,0 +1,277 @@
+import collections
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from flask import Flask, Response, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INTERVAL_MS = float(os.getenv("STRAVA_STATS_PROFILE_INTERVAL_MS", "10"))
+PROFILE_MAX_DEPTH = 64
+
+# (phase, milliseconds) timed during the current request, for Server-Timing
+_request_timings: contextvars.ContextVar[Optional[list[tuple[str, float]]]] = (
+    contextvars.ContextVar("request_timings", default=None)
+)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metrics:
+    """Thread safe registry of counters, summaries and gauges, rendered in
+    the Prometheus text format.
+
+    Summaries track the count, sum and maximum of observations, which is
+    enough for rates and averages without keeping every sample.
+    """
+
+    def __init__(self, namespace: str = "strava_stats"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._help: dict[str, tuple[str, str]] = {}
+        self._counters: dict[str, dict[tuple, float]] = collections.defaultdict(dict)
+        self._summaries: dict[str, dict[tuple, list[float]]] = collections.defaultdict(
+            dict
+        )
+        self._gauges: dict[str, Callable[[], float]] = {}
+
+    def _name(self, name: str, kind: str, help: str) -> str:
+        name = f"{self.namespace}_{name}"
+        self._help.setdefault(name, (kind, help))
+        return name
+
+    def increment(
+        self, name: str, amount: float = 1.0, help: str = "", **labels: str
+    ) -> None:
+        """Adds to a counter."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counter = self._counters[self._name(name, "counter", help)]
+            counter[key] = counter.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, help: str = "", **labels: str) -> None:
+        """Records an observation of a summary."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            summary = self._summaries[self._name(name, "summary", help)]
+            if key not in summary:
+                summary[key] = [0, 0.0, value]
+            stats = summary[key]
+            stats[0] += 1
+            stats[1] += value
+            stats[2] = max(stats[2], value)
+
+    def gauge(self, name: str, read: Callable[[], float], help: str = "") -> None:
+        """Registers a gauge read when the metrics are rendered."""
+        with self._lock:
+            self._gauges[self._name(name, "gauge", help)] = read
+
+    @contextmanager
+    def timer(self, phase: str) -> Iterator[None]:
+        """Times a phase of the current request into the phase summary and
+        the request's Server-Timing header."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(
+                "phase_seconds",
+                elapsed,
+                help="Time spent per dashboard phase",
+                phase=phase,
+            )
+            timings = _request_timings.get()
+            if timings is not None:
+                timings.append((phase, elapsed * 1000))
+
+    def summary(self, name: str, **labels: str) -> tuple[int, float]:
+        """Returns the count and sum of a summary."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            stats = self._summaries.get(f"{self.namespace}_{name}", {}).get(key)
+            return (int(stats[0]), stats[1]) if stats else (0, 0.0)
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            summaries = {
+                name: {key: list(stats) for key, stats in values.items()}
+                for name, values in self._summaries.items()
+            }
+            gauges = dict(self._gauges)
+            descriptions = dict(self._help)
+
+        lines = []
+        for name in sorted(descriptions):
+            kind, help = descriptions[name]
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for labels, value in sorted(counters.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            elif kind == "summary":
+                values = sorted(summaries.get(name, {}).items())
+                for labels, (count, total, _) in values:
+                    formatted = _format_labels(labels)
+                    lines.append(f"{name}_count{formatted} {count}")
+                    lines.append(f"{name}_sum{formatted} {total}")
+                # a summary has no max sample, so it is a gauge of its own
+                if help:
+                    lines.append(f"# HELP {name}_max {help} (maximum)")
+                lines.append(f"# TYPE {name}_max gauge")
+                for labels, (_, _, maximum) in values:
+                    lines.append(f"{name}_max{_format_labels(labels)} {maximum}")
+            elif kind == "gauge":
+                try:
+                    lines.append(f"{name} {float(gauges[name]())}")
+                except Exception:
+                    logger.warning(f"failed to read gauge {name}", exc_info=True)
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread at a fixed interval from a daemon
+    thread and counts them in the folded format flame graph tools read.
+
+    The sampling thread doesn't survive a fork, so a process forked from one
+    that started it starts over with ``ensure_started``.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = 0
+        self._stacks: collections.Counter[str] = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        # the lock may have been held by the sampling thread of the parent
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"sampling profiler started ({self.interval * 1000:.0f}ms)")
+
+    def ensure_started(self) -> None:
+        """Starts sampling unless this process already does."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def folded(self, reset: bool = False) -> str:
+        """Returns the sampled stacks as 'frame;frame;... count' lines."""
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+profiler: Optional[SamplingProfiler] = None
+
+
+def instrument_server(server: Flask) -> None:
+    """Adds the /metrics route and Server-Timing headers to a Flask server,
+    and the /debug/profile route when STRAVA_STATS_PROFILE is set."""
+
+    @server.before_request
+    def start_request_timing():
+        request.environ["strava_stats.start"] = time.perf_counter()
+        _request_timings.set([])
+        if profiler is not None:
+            # in each process serving requests, e.g. every forked worker
+            profiler.ensure_started()
+
+    @server.after_request
+    def add_server_timing(response: Response) -> Response:
+        timings = _request_timings.get() or []
+        start = request.environ.get("strava_stats.start")
+        if start is not None:
+            timings = [*timings, ("total", (time.perf_counter() - start) * 1000)]
+        if timings:
+            response.headers["Server-Timing"] = ", ".join(
+                f"{phase};dur={duration:.1f}" for phase, duration in timings
+            )
+
+        if request.path == "/_dash-update-component":
+            if response.content_length is not None:
+                metrics.observe(
+                    "payload_bytes",
+                    response.content_length,
+                    help="Size of the dashboard callback responses",
+                )
+            if start is not None:
+                metrics.observe(
+                    "callback_seconds",
+                    time.perf_counter() - start,
+                    help="Time spent per dashboard callback request",
+                )
+        return response
+
+    @server.route("/metrics")
+    def render_metrics():
+        return Response(
+            metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    if os.getenv("STRAVA_STATS_PROFILE"):
+        global profiler
+        profiler = SamplingProfiler()
+
+        @server.route("/debug/profile")
+        def render_profile():
+            reset = request.args.get("reset") is not None
+            return Response(profiler.folded(reset=reset), mimetype="text/plain")
@@ -1,43 +1,85 @@
 import numpy as np
+import pandas as pd
 import plotly.express as px
 
+from strava_stats.activity_table import ActivityTable
+from strava_stats.best_efforts import EFFORT_DISTANCE_LABELS, POWER_DURATION_LABELS
 from strava_stats.strava_stats import (
+    MONTHS,
+    calendar_years,
+    generate_km_per_day_by_year_heatmap_data,
     generate_km_per_day_heatmap_data,
     generate_monthly_distance_binned_data,
+    generate_monthly_distance_by_year_data,
     generate_ride_length_binned_data,
 )
 
+# The x axis of the stacked multi-year heatmap spans the days of a leap year,
+# given as a start and step rather than 366 serialized dates
+CALENDAR_START = "2000-01-01"
+DAY_MS = 24 * 60 * 60 * 1000
 
-def generate_km_per_day_over_year_heatmap(activities: list[dict], color="reds"):
-    data = generate_km_per_day_heatmap_data(activities)
 
+def compact_heatmap_data(data: np.ndarray) -> np.ndarray:
+    """Returns heatmap values as float32.
+
+    Figures serialize numpy arrays as base64 typed arrays, and float32 halves
+    their size.
+    """
+    return data.astype(np.float32)
+
+
+def heatmap_labels(data: np.ndarray) -> np.ndarray:
+    """Returns the text of heatmap cells, the distance rounded to two
+    decimals and an empty string for days without any, which the browser
+    leaves unlabeled instead of formatting."""
+    labels = np.round(data, 2).astype(object)
+    labels[~(data > 0)] = ""
+    return labels
+
+
+def compact_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """Returns a frame with float columns as float32, to halve the size of
+    their serialized typed arrays."""
+    return data.astype(
+        {column: np.float32 for column in data.select_dtypes("float64").columns}
+    )
+
+
+def sequential_colors(count: int) -> list[str]:
+    """Returns reds from light to dark, so the latest of a series of years is
+    the darkest."""
+    return px.colors.sample_colorscale(
+        "Reds", np.linspace(0.3, 1.0, count) if count > 1 else [1.0]
+    )
+
+
+def generate_km_per_day_over_year_heatmap(
+    activities: list[dict] | ActivityTable, color="reds", year=None, template=None
+):
+    data = generate_km_per_day_heatmap_data(activities, year)
+    return plot_km_per_day_heatmap(data, color=color, template=template)
+
+
+def plot_km_per_day_heatmap(data: np.ndarray, color="reds", template=None):
     fig = px.imshow(
-        data,
+        compact_heatmap_data(data),
         labels={"x": "Day", "y": "Month", "color": "Kilometers"},
         x=list(range(1, 32)),
-        y=[
-            "Jan",
-            "Feb",
-            "Mar",
-            "Apr",
-            "May",
-            "Jun",
-            "Jul",
-            "Aug",
-            "Sep",
-            "Oct",
-            "Nov",
-            "Dec",
-        ],
+        y=MONTHS,
+        zmin=0,
         text_auto=False,
         aspect="auto",
         color_continuous_scale=color,
+        template=template,
     )
 
-    zero_entry_text = np.where(
-        np.logical_or(data == 0, np.isnan(data)), "", np.round(data, 2).astype(str)
+    # labels are formatted in the browser, empty days have no value to format
+    fig.update_traces(
+        text=heatmap_labels(data),
+        texttemplate="%{text:.2~f}",
+        hovertemplate="%{y} %{x}: %{z:.2f} km<extra></extra>",
     )
-    fig.update_traces(text=zero_entry_text, texttemplate="%{text}")
     fig.update_xaxes(side="top", type="category", showgrid=False)
     fig.update_yaxes(showgrid=False)
     fig.update_coloraxes(showscale=False)
@@ -51,15 +93,68 @@ def generate_km_per_day_over_year_heatmap(activities: list[dict], color="reds"):
     return fig
 
 
-def generate_ride_length_binned_plot(activities: list[dict]):
+def generate_km_per_day_by_year_heatmap(
+    activities: list[dict] | ActivityTable,
+    color="reds",
+    years: range | None = None,
+    template=None,
+):
+    years = calendar_years(activities, years)
+    data = generate_km_per_day_by_year_heatmap_data(activities, years)
+    return plot_km_per_day_by_year_heatmap(years, data, color=color, template=template)
+
+
+def plot_km_per_day_by_year_heatmap(
+    years: range, data: np.ndarray, color="reds", template=None
+):
+    fig = px.imshow(
+        compact_heatmap_data(data),
+        labels={"x": "Date", "y": "Year", "color": "Kilometers"},
+        y=[str(year) for year in years],
+        zmin=0,
+        aspect="auto",
+        color_continuous_scale=color,
+        template=template,
+    )
+
+    fig.update_traces(
+        x0=CALENDAR_START,
+        dx=DAY_MS,
+        hovertemplate="%{x|%b %d} %{y}: %{z:.2f} km<extra></extra>",
+        xgap=1,
+        ygap=1,
+    )
+    fig.update_xaxes(
+        side="top", type="date", tickformat="%b", dtick="M1", showgrid=False
+    )
+    fig.update_yaxes(type="category", autorange="reversed", showgrid=False)
+    fig.update_coloraxes(showscale=False)
+    fig.update_layout(
+        xaxis_title=None,
+        yaxis_title=None,
+        height=max(250, 28 * len(years) + 60),
+        margin_pad=5,
+        margin=dict(l=10, r=10, t=10, b=10),
+    )
+
+    return fig
+
+
+def generate_ride_length_binned_plot(
+    activities: list[dict] | ActivityTable, template=None
+):
     data = generate_ride_length_binned_data(activities)
+    return plot_ride_length_binned(data, template=template)
 
+
+def plot_ride_length_binned(data: pd.DataFrame, template=None):
     fig = px.bar(
-        data,
+        compact_frame(data),
         x="Count",
         y="Distance Bin",
         orientation="h",
         labels={"Count": "Number of Rides", "Distance Bin": "Distance (km)"},
+        template=template,
     )
 
     fig.update_layout(
@@ -71,14 +166,20 @@ def generate_ride_length_binned_plot(activities: list[dict]):
     return fig
 
 
-def generate_monthly_distance_binned_plot(activities: list[dict]):
+def generate_monthly_distance_binned_plot(
+    activities: list[dict] | ActivityTable, template=None
+):
     data = generate_monthly_distance_binned_data(activities)
+    return plot_monthly_distance_binned(data, template=template)
+
 
+def plot_monthly_distance_binned(data: pd.DataFrame, template=None):
     fig = px.bar(
-        data,
+        compact_frame(data),
         x="Months",
         y="Distance Bin",
         labels={"Months": "Months", "Distance Bin": "Distance (km)"},
+        template=template,
     )
 
     fig.update_layout(
@@ -89,3 +190,191 @@ def generate_monthly_distance_binned_plot(activities: list[dict]):
     )
 
     return fig
+
+
+def generate_monthly_distance_by_year_plot(
+    activities: list[dict] | ActivityTable, years: range | None = None, template=None
+):
+    data = generate_monthly_distance_by_year_data(activities, years)
+    return plot_monthly_distance_by_year(data, template=template)
+
+
+def plot_monthly_distance_by_year(data: pd.DataFrame, template=None):
+    num_years = data["Year"].nunique()
+    fig = px.bar(
+        compact_frame(data),
+        x="Months",
+        y="Distance Bin",
+        color="Year",
+        barmode="group",
+        labels={"Months": "Months", "Distance Bin": "Distance (km)"},
+        # older years lighter, the latest year darkest
+        color_discrete_sequence=sequential_colors(num_years),
+        template=template,
+    )
+
+    fig.update_layout(
+        xaxis_title=None,
+        bargap=0.1,
+        legend=dict(title=None, orientation="h", y=-0.15),
+        margin=dict(l=5, r=5, t=5, b=5),
+    )
+
+    return fig
+
+
+def plot_cumulative_distance_by_year(data: pd.DataFrame, highlight: str, template=None):
+    """Plots the running distance of every year by day of the year, the
+    highlighted year drawn on top of the others."""
+    years = data["Year"].unique().tolist()
+    fig = px.line(
+        compact_frame(data),
+        x="Day",
+        y="Distance",
+        color="Year",
+        labels={"Distance": "Distance (km)"},
+        color_discrete_sequence=sequential_colors(len(years)),
+        template=template,
+    )
+
+    fig.update_traces(
+        x=None,
+        x0=CALENDAR_START,
+        dx=DAY_MS,
+        line_width=1.5,
+        opacity=0.6,
+        hovertemplate="%{y:.0f} km<extra>%{fullData.name}</extra>",
+    )
+    fig.update_traces(selector=dict(name=highlight), line_width=3.5, opacity=1.0)
+    # plotly draws later traces on top, the legend keeps the years in order
+    for rank, trace in enumerate(fig.data):
+        trace.legendrank = 1000 + rank
+    fig.data = sorted(fig.data, key=lambda trace: trace.name == highlight)
+    fig.update_xaxes(type="date", tickformat="%b", dtick="M1")
+    fig.update_layout(
+        xaxis_title=None,
+        xaxis_hoverformat="%b %d",
+        hovermode="x unified",
+        legend=dict(title=None, orientation="h", y=-0.15),
+        margin=dict(l=5, r=5, t=5, b=5),
+    )
+
+    return fig
+
+
+def plot_power_curve(data: pd.DataFrame, template=None):
+    fig = px.line(
+        compact_frame(data),
+        x="Duration",
+        y="Watts",
+        color="Curve",
+        markers=True,
+        labels={"Duration": "Duration", "Watts": "Watts"},
+        category_orders={"Duration": POWER_DURATION_LABELS},
+        color_discrete_sequence=sequential_colors(data["Curve"].nunique()),
+        template=template,
+    )
+
+    fig.update_traces(hovertemplate="%{x}: %{y:.0f} W<extra>%{fullData.name}</extra>")
+    fig.update_xaxes(type="category")
+    fig.update_layout(
+        xaxis_title=None,
+        legend=dict(title=None, orientation="h", y=-0.15),
+        margin=dict(l=5, r=5, t=5, b=5),
+    )
+
+    return fig
+
+
+def plot_best_efforts(data: pd.DataFrame, template=None):
+    fig = px.line(
+        compact_frame(data),
+        x="Distance",
+        y="Speed",
+        color="Curve",
+        markers=True,
+        labels={"Distance": "Distance", "Speed": "Average Speed (km/h)"},
+        category_orders={"Distance": EFFORT_DISTANCE_LABELS},
+        color_discrete_sequence=sequential_colors(data["Curve"].nunique()),
+        template=template,
+    )
+
+    fig.update_traces(
+        hovertemplate="%{x}: %{y:.1f} km/h<extra>%{fullData.name}</extra>"
+    )
+    fig.update_xaxes(type="category")
+    fig.update_layout(
+        xaxis_title=None,
+        legend=dict(title=None, orientation="h", y=-0.15),
+        margin=dict(l=5, r=5, t=5, b=5),
+    )
+
+    return fig
+
+
+def plot_route_density(data: pd.DataFrame, zoom: int, color="reds", template=None):
+    """Plots the visited cells of a tile grid at ``zoom`` as a density map,
+    shading by the log of the visits so rarely ridden roads still show."""
+    center = dict(lat=0.0, lon=0.0)
+    map_zoom = 0
+    if len(data):
+        center = dict(
+            lat=float(data["Latitude"].median()), lon=float(data["Longitude"].median())
+        )
+        # fit the central 98% of the cells in a roughly 600px wide map
+        lng_span = data["Longitude"].quantile(0.99) - data["Longitude"].quantile(0.01)
+        map_zoom = float(np.clip(np.log2(360 / max(lng_span, 1e-3) * 600 / 256), 0, 15))
+    fig = px.density_map(
+        compact_frame(data.assign(Density=np.log1p(data["Visits"]))),
+        lat="Latitude",
+        lon="Longitude",
+        z="Density",
+        hover_data={"Visits": True, "Density": False},
+        # a cell of the grid in pixels at the initial zoom
+        radius=int(np.clip(256 * 2 ** (map_zoom - zoom) * 2, 3, 30)),
+        center=center,
+        zoom=map_zoom,
+        map_style="carto-positron",
+        color_continuous_scale=color,
+        template=template,
+    )
+
+    fig.update_traces(
+        hovertemplate="%{customdata[0]} activities<extra></extra>",
+    )
+    fig.update_coloraxes(showscale=False)
+    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0))
+
+    return fig
+
+
+def plot_daily_series(
+    data: pd.DataFrame, start: str, step_days: int, yaxis_title: str, template=None
+):
+    """Plots (day, value, metric) series sampled every ``step_days`` from
+    ``start``, the dates given as a start and step rather than serialized."""
+    fig = px.line(
+        compact_frame(data),
+        x="Day",
+        y="Value",
+        color="Metric",
+        labels={"Value": yaxis_title},
+        color_discrete_sequence=px.colors.sample_colorscale("Reds", [1.0, 0.6, 0.35]),
+        template=template,
+    )
+
+    fig.update_traces(
+        x=None,
+        x0=start,
+        dx=step_days * DAY_MS,
+        hovertemplate="%{x|%b %d, %Y}: %{y:.1f}<extra>%{fullData.name}</extra>",
+    )
+    fig.update_xaxes(type="date")
+    fig.update_layout(
+        xaxis_title=None,
+        hovermode="x unified",
+        legend=dict(title=None, orientation="h", y=-0.15),
+        margin=dict(l=5, r=5, t=5, b=5),
+    )
+
+    return fig
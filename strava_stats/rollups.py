@@ -0,0 +1,301 @@
+import datetime
+import json
+import logging
+from typing import Optional
+
+import numpy as np
+
+from strava_stats.activity_store import FileStore
+from strava_stats.activity_table import ActivityTable
+from strava_stats.strava_api import write_json_atomic
+from strava_stats.strava_stats import (
+    ALL_YEARS,
+    CALENDAR_DAYS,
+    CALENDAR_MONTH_OFFSETS,
+    DISTANCE_BIN_EDGES,
+    DISTANCE_BIN_LABELS,
+    ActivitySummary,
+    mask_invalid_calendar_days,
+    mask_invalid_days,
+)
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FORMAT_VERSION = 3
+ALL_TYPES = ""
+# the chart data of a view, held as arrays once loaded
+VIEW_ARRAYS = dict(
+    heatmap=np.float64,
+    monthly=np.float64,
+    monthly_by_year=np.float64,
+    calendar=np.float64,
+    ride_length_bins=np.int64,
+)
+
+
+def rollup_key(year: int | str, activity_type: Optional[str]) -> str:
+    """Returns the key of a (year or ALL_YEARS, activity type) view in a rollup."""
+    return f"{year}|{activity_type or ALL_TYPES}"
+
+
+def _grouped_views(table: ActivityTable, group: np.ndarray, num_groups: int) -> dict:
+    """Aggregates every view quantity for all groups in one pass each."""
+    distance_km = table.distance / 1000
+
+    heatmaps = np.zeros((num_groups, 12, 31))
+    np.add.at(heatmaps, (group, table.month - 1, table.day_of_month - 1), distance_km)
+
+    # bins are closed on the left like the pd.cut in generate_ride_length_binned_data
+    bins = np.searchsorted(DISTANCE_BIN_EDGES[1:-1], distance_km, side="right")
+    bin_counts = np.zeros((num_groups, len(DISTANCE_BIN_LABELS)), dtype=np.int64)
+    np.add.at(bin_counts, (group, bins), 1)
+
+    biggest = np.zeros(num_groups)
+    np.maximum.at(biggest, group, table.distance)
+    longest = np.zeros(num_groups, dtype=np.int64)
+    np.maximum.at(longest, group, table.moving_time)
+
+    # unique (group, day) pairs, sorted by group then day
+    pairs = np.unique(np.stack([group, table.day], axis=1), axis=0)
+    pair_group, pair_day = pairs[:, 0], pairs[:, 1]
+    ride_days = np.bincount(pair_group, minlength=num_groups)
+    # run-length encode consecutive days within a group to find the latest run
+    run_start = np.ones(len(pairs), dtype=bool)
+    run_start[1:] = (np.diff(pair_day) != 1) | (np.diff(pair_group) != 0)
+    run_id = np.cumsum(run_start) - 1
+    run_lengths = np.bincount(run_id)
+    last_index = np.cumsum(ride_days) - 1
+    longest_run = np.zeros(num_groups, dtype=np.int64)
+    np.maximum.at(longest_run, pair_group[run_start], run_lengths)
+
+    return {
+        "heatmaps": heatmaps,
+        "monthly": heatmaps.sum(axis=2),
+        "bin_counts": bin_counts,
+        "distance": np.bincount(group, weights=distance_km, minlength=num_groups),
+        "moving_time": np.bincount(
+            group, weights=table.moving_time, minlength=num_groups
+        ),
+        "elevation": np.bincount(group, weights=table.elevation, minlength=num_groups),
+        "count": np.bincount(group, minlength=num_groups),
+        "ride_days": ride_days,
+        "biggest": biggest,
+        "longest": longest,
+        "last_day": pair_day[last_index.clip(min=0)],
+        "last_run": run_lengths[run_id[last_index.clip(min=0)]],
+        "longest_run": longest_run,
+    }
+
+
+def _grouped_calendars(
+    table: ActivityTable, group: np.ndarray, num_groups: int, years: range
+) -> np.ndarray:
+    """Aggregates the years x 366 calendar of every group in one pass."""
+    calendars = np.zeros((num_groups, len(years), CALENDAR_DAYS))
+    np.add.at(
+        calendars,
+        (
+            group,
+            table.year - years.start,
+            CALENDAR_MONTH_OFFSETS[table.month - 1] + table.day_of_month - 1,
+        ),
+        table.distance / 1000,
+    )
+    return calendars
+
+
+def _to_json_array(arr: np.ndarray) -> list:
+    return np.where(np.isnan(arr), None, arr).tolist()
+
+
+def build_rollup(table: ActivityTable) -> dict:
+    """Builds the compact rollup of every (year, activity type) view.
+
+    Holds the 12x31 heatmap, monthly totals, ride length histogram and stat
+    card totals per view, plus the latest and longest run of consecutive
+    days so streaks can be derived without the raw activities. The
+    ALL_YEARS views hold the multi-year calendar and per-year monthly
+    totals instead of the heatmap.
+    """
+    years, year_index = np.unique(table.year, return_inverse=True)
+    types, type_index = np.unique(table.type, return_inverse=True)
+    calendar_years = (
+        range(int(years.min()), int(years.max()) + 1) if len(years) else range(0)
+    )
+
+    groupings = [
+        # per (year, type)
+        (
+            year_index * len(types) + type_index,
+            [(int(y), str(t)) for y in years for t in types],
+        ),
+        # per year across all types
+        (year_index, [(int(y), ALL_TYPES) for y in years]),
+        # per type across all years
+        (type_index, [(ALL_YEARS, str(t)) for t in types]),
+        # across all years and types
+        (np.zeros(len(table), dtype=np.int64), [(ALL_YEARS, ALL_TYPES)]),
+    ]
+
+    views = {}
+    for group, keys in groupings:
+        if not len(table):
+            break
+        aggregates = _grouped_views(table, group, len(keys))
+        calendars = None
+        if keys[0][0] == ALL_YEARS:
+            calendars = _grouped_calendars(table, group, len(keys), calendar_years)
+        for i, (year, activity_type) in enumerate(keys):
+            if not aggregates["count"][i]:
+                continue
+            if calendars is None:
+                charts = {
+                    "heatmap": _to_json_array(
+                        mask_invalid_days(aggregates["heatmaps"][i], year)
+                    ),
+                    "monthly": aggregates["monthly"][i].tolist(),
+                }
+            else:
+                charts = {
+                    "monthly_by_year": np.add.reduceat(
+                        calendars[i], CALENDAR_MONTH_OFFSETS, axis=1
+                    ).tolist(),
+                    "calendar": _to_json_array(
+                        mask_invalid_calendar_days(calendars[i], calendar_years)
+                    ),
+                }
+            views[rollup_key(year, activity_type)] = {
+                **charts,
+                "ride_length_bins": aggregates["bin_counts"][i].tolist(),
+                "totals": {
+                    "total_distance": float(aggregates["distance"][i]),
+                    "moving_time": int(aggregates["moving_time"][i]),
+                    "elevation": float(aggregates["elevation"][i]),
+                    "num_rides": int(aggregates["count"][i]),
+                    "ride_days": int(aggregates["ride_days"][i]),
+                    "biggest_ride": float(aggregates["biggest"][i]),
+                    "longest_ride": int(aggregates["longest"][i]),
+                },
+                "latest_run": {
+                    "end": str(np.datetime64(int(aggregates["last_day"][i]), "D")),
+                    "length": int(aggregates["last_run"][i]),
+                },
+                "longest_run": int(aggregates["longest_run"][i]),
+            }
+
+    return {
+        "format": ROLLUP_FORMAT_VERSION,
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "years": years.tolist(),
+        "calendar_years": [calendar_years.start, calendar_years.stop],
+        "types": types.tolist(),
+        "views": views,
+        "longest_streaks": {
+            activity_type: table.day_index(activity_type).longest_streak()
+            for activity_type in [ALL_TYPES, *types.tolist()]
+        },
+    }
+
+
+def write_rollup(table: ActivityTable, path: str) -> dict:
+    """Builds the rollup for the activities and writes it atomically."""
+    rollup = build_rollup(table)
+    write_json_atomic(path, rollup)
+    logger.info(f"wrote rollup with {len(rollup['views'])} views to {path}")
+    return rollup
+
+
+def get_rollup_view(
+    rollup: dict, year: int, activity_type: Optional[str]
+) -> Optional[dict]:
+    """Returns the view for a year and activity type, None if it has no activities."""
+    return rollup["views"].get(rollup_key(year, activity_type))
+
+
+def rollup_view_summary(
+    view: Optional[dict], from_date: Optional[datetime.date] = None
+) -> ActivitySummary:
+    """Returns the stat card values of a rollup view."""
+    if view is None:
+        return ActivitySummary(0.0, 0, 0.0, 0, 0, 0.0, 0, 0)
+
+    if not from_date:
+        from_date = datetime.datetime.now().date()
+    latest_run = view["latest_run"]
+    ends_today = latest_run["end"] == from_date.isoformat()
+    return ActivitySummary(
+        **view["totals"],
+        current_streak=latest_run["length"] if ends_today else 0,
+        longest_streak=view["longest_run"],
+    )
+
+
+def rollup_longest_streak(rollup: dict, activity_type: Optional[str]) -> int:
+    """Returns the longest streak ever of an activity type."""
+    return rollup["longest_streaks"].get(activity_type or ALL_TYPES, 0)
+
+
+def rollup_view_heatmap(view: Optional[dict], year: int) -> np.ndarray:
+    """Returns the 12x31 heatmap of a rollup view."""
+    if view is None:
+        return mask_invalid_days(np.zeros((12, 31)), year)
+    return np.asarray(view["heatmap"], dtype=np.float64)
+
+
+def rollup_calendar_years(rollup: dict) -> range:
+    """Returns the years covered by the calendars of the ALL_YEARS views."""
+    return range(*rollup["calendar_years"])
+
+
+def rollup_view_calendar(view: Optional[dict], years: range) -> np.ndarray:
+    """Returns the years x 366 calendar of an ALL_YEARS rollup view."""
+    if view is None:
+        return mask_invalid_calendar_days(np.zeros((len(years), CALENDAR_DAYS)), years)
+    return np.asarray(view["calendar"], dtype=np.float64)
+
+
+def view_arrays(view: dict) -> dict:
+    """Returns a rollup view with its chart data as read-only arrays, the
+    missing days of the heatmaps and calendars as NaN.
+
+    A few contiguous buffers instead of lists of boxed floats keep the rollup
+    small, and don't get copied into every worker forked from a process that
+    loaded it, since reading them touches no reference counts.
+    """
+    view = dict(view)
+    for name, dtype in VIEW_ARRAYS.items():
+        if name in view:
+            values = np.array(view[name], dtype=dtype)
+            values.flags.writeable = False
+            view[name] = values
+    return view
+
+
+class RollupStore(FileStore):
+    """Keeps the rollup written by the sync in memory, reloading it when the
+    sync writes a new one."""
+
+    description = "rollup"
+
+    def __init__(self, path: str = "data/rollup.json", check_interval: float = 0):
+        super().__init__(path, check_interval)
+
+    def load(self) -> dict:
+        with open(self.file_path, "r") as f:
+            rollup = json.load(f)
+        if rollup.get("format") != ROLLUP_FORMAT_VERSION:
+            raise ValueError(f"unsupported rollup format in {self.path}")
+        rollup["views"] = {
+            key: view_arrays(view) for key, view in rollup["views"].items()
+        }
+        return rollup
+
+    def nbytes(self) -> int:
+        if not self.loaded:
+            return 0
+        return sum(
+            values.nbytes
+            for view in self._data["views"].values()
+            for name, values in view.items()
+            if name in VIEW_ARRAYS
+        )
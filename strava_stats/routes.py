@@ -0,0 +1,339 @@
+import logging
+import pathlib
+from typing import TYPE_CHECKING, Iterable, Optional
+
+import numpy as np
+
+from strava_stats.activity_store import FileStore
+from strava_stats.strava_api import write_npz_atomic
+from strava_stats.strava_stats import ALL_YEARS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ROUTE_TILES_FORMAT_VERSION = 1
+ROUTE_TILES_FILENAME = "route_tiles.npz"
+# zoom levels of the tile grids, a cell of the finest is a few hundred meters
+ROUTE_ZOOMS = (8, 10, 12, 14, 16)
+# the map shows the finest grid with at most this many visited cells
+MAX_ROUTE_CELLS = 4000
+# longer segments are GPS glitches and only their ends are counted
+MAX_SEGMENT_CELLS = 1024
+POLYLINE_PRECISION = 1e5
+
+
+def decode_polylines(
+    polylines: list[str],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Decodes encoded polylines in one batch and returns the latitudes and
+    longitudes of all their points and the number of points of each.
+
+    Every character holds 5 bits of a value, with a continuation bit set on
+    all but the last, so the values are summed per run of characters and the
+    deltas between points summed per polyline, without a loop over them.
+    """
+    lengths = np.array([len(polyline) for polyline in polylines], dtype=np.int64)
+    encoded = np.frombuffer("".join(polylines).encode("ascii"), dtype=np.uint8)
+    encoded = encoded.astype(np.int64) - 63
+    if not len(encoded):
+        empty = np.zeros(0)
+        return empty, empty, np.zeros(len(polylines), dtype=np.int64)
+
+    ends = (encoded & 0x20) == 0
+    value_id = np.cumsum(ends) - ends
+    value_start = np.flatnonzero(np.concatenate([[True], ends[:-1]]))
+    shift = 5 * (np.arange(len(encoded)) - value_start[value_id])
+    values = np.add.reduceat((encoded & 0x1F) << shift, value_start)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    # every polyline ends with a complete value, so no value spans two
+    polyline_of_byte = np.repeat(np.arange(len(polylines)), lengths)
+    points = np.bincount(polyline_of_byte[ends], minlength=len(polylines)) // 2
+    deltas = values.reshape(-1, 2) / POLYLINE_PRECISION
+    coordinates = np.cumsum(deltas, axis=0)
+    # restart the running sum at the first point of every polyline
+    first = np.cumsum(points) - points
+    offsets = np.vstack([np.zeros((1, 2)), coordinates])[first]
+    coordinates -= np.repeat(offsets, points, axis=0)
+    return coordinates[:, 0], coordinates[:, 1], points
+
+
+def is_valid_polyline(polyline: str) -> bool:
+    """Returns whether a polyline is non-empty, well-formed and holds whole
+    points, so it can't misalign the others decoded with it."""
+    if not polyline or not polyline.isascii():
+        return False
+    encoded = np.frombuffer(polyline.encode("ascii"), dtype=np.uint8).astype(np.int64)
+    if encoded.min() < 63 or encoded.max() > 126:
+        return False
+    ends = ((encoded - 63) & 0x20) == 0
+    return bool(ends[-1]) and ends.sum() % 2 == 0
+
+
+def mercator_tiles(lat: np.ndarray, lng: np.ndarray, zoom: int):
+    """Returns the fractional web mercator tile coordinates of points."""
+    scale = 2.0**zoom
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = (lng + 180.0) / 360.0 * scale
+    y = (1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * scale
+    return x, y
+
+
+def tile_centers(x: np.ndarray, y: np.ndarray, zoom: int):
+    """Returns the latitudes and longitudes of the centers of tiles."""
+    scale = 2.0**zoom
+    lng = (x + 0.5) / scale * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * (y + 0.5) / scale))))
+    return lat, lng
+
+
+def rasterize_polylines(
+    polylines: list[str],
+) -> dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Returns the (polyline, x, y) cells each polyline passes through at
+    every zoom of ROUTE_ZOOMS, each cell once per polyline.
+
+    Segments between points are sampled at least once per cell of the finest
+    grid, and the coarser grids are derived from it by shifting.
+    """
+    lat, lng, points = decode_polylines(polylines)
+    finest = max(ROUTE_ZOOMS)
+    x, y = mercator_tiles(lat, lng, finest)
+    polyline = np.repeat(np.arange(len(polylines)), points)
+
+    # segments join consecutive points of the same polyline
+    same = polyline[1:] == polyline[:-1]
+    x0, y0, dx, dy = x[:-1][same], y[:-1][same], np.diff(x)[same], np.diff(y)[same]
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64)
+    steps = np.where(steps > MAX_SEGMENT_CELLS, 1, np.maximum(steps, 1))
+    segment = np.repeat(np.arange(len(steps)), steps)
+    segment_start = np.repeat(np.cumsum(steps) - steps, steps)
+    t = (np.arange(steps.sum()) - segment_start) / steps[segment]
+    sample_polyline = np.concatenate([polyline[:-1][same][segment], polyline])
+    sample_x = np.concatenate([x0[segment] + t * dx[segment], x]).astype(np.int64)
+    sample_y = np.concatenate([y0[segment] + t * dy[segment], y]).astype(np.int64)
+    # a longitude of 180 projects onto the right edge, one past the last cell,
+    # which would spill into the polyline bits of the keys
+    sample_x = np.clip(sample_x, 0, (1 << finest) - 1)
+    sample_y = np.clip(sample_y, 0, (1 << finest) - 1)
+
+    cells = {}
+    for zoom in ROUTE_ZOOMS:
+        shift = finest - zoom
+        # one key per (polyline, x, y), unique so each polyline counts once
+        keys = np.unique(
+            (sample_polyline << 2 * finest)
+            | ((sample_x >> shift) << finest)
+            | (sample_y >> shift)
+        )
+        mask = (1 << finest) - 1
+        cells[zoom] = (keys >> 2 * finest, (keys >> finest) & mask, keys & mask)
+    return cells
+
+
+def aggregate_cells(
+    group: np.ndarray, x: np.ndarray, y: np.ndarray, counts: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Sums the counts of equal (group, x, y) cells."""
+    finest = max(ROUTE_ZOOMS)
+    keys, inverse = np.unique(
+        (group.astype(np.int64) << 2 * finest)
+        | (x.astype(np.int64) << finest)
+        | y.astype(np.int64),
+        return_inverse=True,
+    )
+    mask = (1 << finest) - 1
+    return (
+        keys >> 2 * finest,
+        (keys >> finest) & mask,
+        keys & mask,
+        np.bincount(inverse, weights=counts).astype(np.int64),
+    )
+
+
+def activity_polyline(activity: dict) -> Optional[str]:
+    return (activity.get("map") or {}).get("summary_polyline")
+
+
+def routes_changed(activities: Iterable[dict], previous: Iterable[dict]) -> bool:
+    """Returns whether any activity changed its route, year or type from its
+    previous version. Routes are only added incrementally, so such an edit
+    means rasterizing them all again."""
+    previous = {activity["id"]: activity for activity in previous}
+    return any(
+        activity["id"] in previous
+        and (
+            activity_polyline(activity) != activity_polyline(previous[activity["id"]])
+            or activity["start_date"][:4] != previous[activity["id"]]["start_date"][:4]
+            or activity["type"] != previous[activity["id"]]["type"]
+        )
+        for activity in activities
+    )
+
+
+def update_route_tiles(
+    activities: Iterable[dict], path: str, rebuild: bool = False
+) -> dict:
+    """Rasterizes the routes of the activities into visit counts per
+    (year, type) and tile of every zoom, and writes them.
+
+    Only activities not rasterized into the previous file are added to its
+    counts, unless ``rebuild`` is set or activities were deleted since.
+    """
+    activities = [activity for activity in activities if activity_polyline(activity)]
+    tiles = None
+    if not rebuild:
+        try:
+            tiles = load_route_tiles(path)
+        except (FileNotFoundError, ValueError):
+            pass
+    if tiles is not None:
+        activity_ids = {activity["id"] for activity in activities}
+        if not set(tiles["activity_ids"].tolist()) <= activity_ids:
+            logger.info("activities were deleted, rasterizing every route again")
+            tiles = None
+
+    if tiles is None:
+        tiles = empty_route_tiles()
+    rasterized = set(tiles["activity_ids"].tolist())
+    new = [
+        activity
+        for activity in activities
+        if activity["id"] not in rasterized
+        and is_valid_polyline(activity_polyline(activity))
+    ]
+
+    groups = list(zip(tiles["years"].tolist(), tiles["types"].tolist()))
+    group_index = {group: i for i, group in enumerate(groups)}
+    activity_group = []
+    for activity in new:
+        group = (int(activity["start_date"][:4]), activity["type"])
+        if group not in group_index:
+            group_index[group] = len(groups)
+            groups.append(group)
+        activity_group.append(group_index[group])
+    activity_group = np.array(activity_group, dtype=np.int64)
+
+    cells = rasterize_polylines([activity_polyline(activity) for activity in new])
+    updated = dict(
+        format=np.array(ROUTE_TILES_FORMAT_VERSION),
+        zooms=np.array(ROUTE_ZOOMS),
+        activity_ids=np.concatenate(
+            [
+                tiles["activity_ids"],
+                np.array([activity["id"] for activity in new], dtype=np.int64),
+            ]
+        ),
+        years=np.array([year for year, _ in groups], dtype=np.int64),
+        types=np.array([activity_type for _, activity_type in groups], dtype=str),
+    )
+    for zoom in ROUTE_ZOOMS:
+        polyline, x, y = cells[zoom]
+        group, x, y, counts = aggregate_cells(
+            np.concatenate([tiles[f"group{zoom}"], activity_group[polyline]]),
+            np.concatenate([tiles[f"x{zoom}"], x]),
+            np.concatenate([tiles[f"y{zoom}"], y]),
+            np.concatenate([tiles[f"count{zoom}"], np.ones(len(x), dtype=np.int64)]),
+        )
+        updated[f"group{zoom}"] = group.astype(np.int32)
+        updated[f"x{zoom}"] = x.astype(np.int32)
+        updated[f"y{zoom}"] = y.astype(np.int32)
+        updated[f"count{zoom}"] = counts.astype(np.int32)
+
+    write_npz_atomic(path, updated)
+    logger.info(
+        f"rasterized {len(new)} new routes into {path} "
+        f"({len(updated['activity_ids'])} in total)"
+    )
+    return updated
+
+
+def empty_route_tiles() -> dict:
+    tiles = dict(
+        activity_ids=np.zeros(0, dtype=np.int64),
+        years=np.zeros(0, dtype=np.int64),
+        types=np.zeros(0, dtype=str),
+    )
+    for zoom in ROUTE_ZOOMS:
+        for column in ("group", "x", "y", "count"):
+            tiles[f"{column}{zoom}"] = np.zeros(0, dtype=np.int64)
+    return tiles
+
+
+def load_route_tiles(path: str | pathlib.Path) -> dict:
+    """Loads the route tiles written by update_route_tiles."""
+    with np.load(path) as npz:
+        tiles = {name: npz[name] for name in npz.files}
+    if (
+        int(tiles.get("format", -1)) != ROUTE_TILES_FORMAT_VERSION
+        or tuple(tiles["zooms"].tolist()) != ROUTE_ZOOMS
+    ):
+        raise ValueError(f"unsupported route tiles format in {path}")
+    return tiles
+
+
+def route_density(
+    tiles: dict, year, activity_type: Optional[str]
+) -> tuple[int, "pd.DataFrame"]:
+    """Returns the zoom and the visited cells of a year, or ALL_YEARS, and
+    type at the finest zoom with at most MAX_ROUTE_CELLS of them, as a frame
+    of cell centers and the number of activities through each."""
+    selected = np.ones(len(tiles["years"]), dtype=bool)
+    if year != ALL_YEARS:
+        selected &= tiles["years"] == year
+    if activity_type:
+        selected &= tiles["types"] == activity_type
+
+    zoom, density = ROUTE_ZOOMS[0], (np.zeros(0), np.zeros(0), np.zeros(0))
+    for candidate in ROUTE_ZOOMS:
+        mask = selected[tiles[f"group{candidate}"]]
+        _, x, y, counts = aggregate_cells(
+            np.zeros(mask.sum(), dtype=np.int64),
+            tiles[f"x{candidate}"][mask],
+            tiles[f"y{candidate}"][mask],
+            tiles[f"count{candidate}"][mask],
+        )
+        if len(counts) > MAX_ROUTE_CELLS and candidate != ROUTE_ZOOMS[0]:
+            break
+        zoom, density = candidate, (x, y, counts)
+
+    return zoom, route_density_frame(*density, zoom=zoom)
+
+
+def route_density_frame(
+    x: Optional[np.ndarray] = None,
+    y: Optional[np.ndarray] = None,
+    visits: Optional[np.ndarray] = None,
+    zoom: int = ROUTE_ZOOMS[0],
+) -> "pd.DataFrame":
+    """Returns visited cells as a frame of their centers for plotting, no
+    cells by default."""
+    import pandas as pd
+
+    x = np.zeros(0) if x is None else x
+    y = np.zeros(0) if y is None else y
+    visits = np.zeros(0) if visits is None else visits
+    lat, lng = tile_centers(x, y, zoom)
+    return pd.DataFrame({"Latitude": lat, "Longitude": lng, "Visits": visits})
+
+
+class RouteTileStore(FileStore):
+    """Keeps the route tiles written by the sync in memory, reloading them
+    when the sync writes new ones."""
+
+    description = "route tiles"
+
+    def __init__(
+        self, path: str = f"data/{ROUTE_TILES_FILENAME}", check_interval: float = 0
+    ):
+        super().__init__(path, check_interval)
+
+    def load(self) -> dict:
+        return load_route_tiles(self.file_path)
+
+    def nbytes(self) -> int:
+        if not self.loaded:
+            return 0
+        return sum(column.nbytes for column in self._data.values())
@@ -0,0 +1,68 @@
+import argparse
+import logging
+import os
+import sys
+
+import requests
+
+from strava_stats.athletes import athlete_data_dir, save_athlete_token
+from strava_stats.strava_api import AUTH_ENDPOINT, StravaAPIError
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s", stream=sys.stdout, level=logging.INFO
+)
+
+
+def exchange_authorization_code(code: str) -> tuple[str, dict]:
+    """Exchanges the code from the Strava authorization redirect for the
+    athlete's id and tokens."""
+    client_id = os.getenv("STRAVA_CLIENT_ID")
+    client_secret = os.getenv("STRAVA_CLIENT_SECRET")
+    if not all([client_id, client_secret]):
+        raise StravaAPIError(
+            "missing required environment variables: STRAVA_CLIENT_ID "
+            "or STRAVA_CLIENT_SECRET"
+        )
+
+    response = requests.post(
+        AUTH_ENDPOINT,
+        data=dict(
+            client_id=client_id,
+            client_secret=client_secret,
+            code=code,
+            grant_type="authorization_code",
+        ),
+        timeout=30,
+    )
+    if response.status_code != 200:
+        raise StravaAPIError(
+            f"failed to exchange authorization code: {response.status_code} {response.text}"
+        )
+    token = response.json()
+    return str(token["athlete"]["id"]), token
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Register an athlete whose activities the sync should fetch"
+    )
+    parser.add_argument("--code", help="code from the Strava authorization redirect")
+    parser.add_argument("--athlete-id", help="id of an already authorized athlete")
+    parser.add_argument("--refresh-token", help="refresh token of that athlete")
+    args = parser.parse_args()
+
+    if args.code:
+        athlete_id, token = exchange_authorization_code(args.code)
+    elif args.athlete_id and args.refresh_token:
+        athlete_id, token = args.athlete_id, dict(refresh_token=args.refresh_token)
+    else:
+        parser.error("pass either --code, or --athlete-id and --refresh-token")
+
+    data_dir = athlete_data_dir(athlete_id)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    save_athlete_token(athlete_id, token)
+    logging.info(f"added athlete {athlete_id}, their data is stored in {data_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Fetches the streams of every synced activity into the stream store, and
+updates the power curves and best efforts computed from them.
+
+Activities whose streams are already stored are skipped, so an interrupted
+backfill, e.g. by the daily rate limit, resumes where it stopped::
+
+    python -m strava_stats.scripts.backfill_streams
+    python -m strava_stats.scripts.backfill_streams --athlete 12345 --limit 500
+"""
+
+import argparse
+import logging
+import sys
+
+from strava_stats.athletes import (
+    athlete_data_dir,
+    get_athlete_client,
+    publish_data_version,
+)
+from strava_stats.best_efforts import BEST_EFFORTS_FILENAME, update_best_efforts
+from strava_stats.strava_api import StravaAPIError, get_client, load_strava_activities
+from strava_stats.streams import StreamStore, backfill_streams
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s", stream=sys.stdout, level=logging.INFO
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--athlete", help="backfill a registered athlete")
+    parser.add_argument("--limit", type=int, help="fetch at most this many")
+    args = parser.parse_args()
+
+    if args.athlete:
+        data_dir = athlete_data_dir(args.athlete)
+        activities_path = str(data_dir / "activities.json")
+        store = StreamStore(str(data_dir / "streams"))
+        best_efforts_path = str(data_dir / BEST_EFFORTS_FILENAME)
+        client = get_athlete_client(args.athlete)
+    else:
+        activities_path = "data/activities.json"
+        store = StreamStore()
+        best_efforts_path = f"data/{BEST_EFFORTS_FILENAME}"
+        client = get_client()
+
+    # newest first, the activities most likely to be looked at
+    activities = load_strava_activities(activities_path)
+    activity_ids = [activity["id"] for activity in activities]
+    try:
+        backfill_streams(client, activity_ids, store, limit=args.limit)
+    except StravaAPIError:
+        logging.exception("backfill stopped, run it again to resume")
+        sys.exit(1)
+    finally:
+        update_best_efforts(store, activities, best_efforts_path)
+        publish_data_version(store.directory.parent)
+    logging.info(
+        f"{len(store.activity_ids())} of {len(activity_ids)} activities have "
+        f"streams, {store.nbytes() / 1024 / 1024:.1f} MB on disk"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Checks that concurrent dashboard requests never see each other's data.
+
+Requests every (athlete, year, type) view once to get a reference response, then
+fires the same views from many threads at once and compares every response
+with its reference. Without --url an in-process threaded server is started
+with the dashboard cache disabled, so every concurrent request renders its
+figures from scratch::
+
+    python -m strava_stats.scripts.check_concurrent_rendering
+    python -m strava_stats.scripts.check_concurrent_rendering --url http://127.0.0.1:8050
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s", stream=sys.stdout, level=logging.INFO
+)
+
+ACTIVITY_TYPES = ["Ride", "Run", "Hike"]
+OUTPUTS = [("stat-cards", "children"), ("dashboard-figures", "data")]
+
+
+def callback_payload(year, activity_type: str, pathname: str = "/") -> dict:
+    """Returns the body of the update_app callback request Dash sends."""
+    return {
+        "output": ".." + "...".join(f"{id}.{prop}" for id, prop in OUTPUTS) + "..",
+        "outputs": [{"id": id, "property": prop} for id, prop in OUTPUTS],
+        "inputs": [
+            {"id": "year-dropdown", "property": "value", "value": year},
+            {"id": "type-dropdown", "property": "value", "value": activity_type},
+            {"id": "url", "property": "pathname", "value": pathname},
+        ],
+        "changedPropIds": ["year-dropdown.value"],
+        "state": [],
+    }
+
+
+def render(
+    session: requests.Session, url: str, pathname: str, year, activity_type: str
+) -> str:
+    response = session.post(
+        f"{url}/_dash-update-component",
+        json=callback_payload(year, activity_type, pathname),
+        timeout=60,
+    )
+    response.raise_for_status()
+    # canonical form, so equal responses compare equal as strings
+    return json.dumps(response.json()["response"], sort_keys=True)
+
+
+def start_local_server() -> str:
+    """Serves the app from a threaded server in this process and returns
+    its URL."""
+    from werkzeug.serving import make_server
+
+    from strava_stats import main
+
+    main.default_dataset.dashboard_cache.maxsize = 0
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, main.create_app().server, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="running app, e.g. under gunicorn")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--years", type=int, nargs="+", help="years to request")
+    parser.add_argument(
+        "--athletes", nargs="+", default=[], help="athlete ids to request as well"
+    )
+    args = parser.parse_args()
+
+    url = args.url or start_local_server()
+    years = args.years
+    if years is None:
+        from strava_stats.main import get_available_years, get_dataset
+
+        years = get_available_years(get_dataset())[:4]
+    pathnames = ["/", *(f"/athletes/{athlete_id}" for athlete_id in args.athletes)]
+    views = list(itertools.product(pathnames, [*years, "all"], ACTIVITY_TYPES))
+
+    session = requests.Session()
+    references = {view: render(session, url, *view) for view in views}
+    logging.info(f"rendered {len(views)} reference views from {url}")
+
+    # more than the views, so the same view is also rendered concurrently
+    schedule = [random.choice(views) for _ in range(args.requests)]
+    local = threading.local()
+
+    def check(view) -> bool:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return render(local.session, url, *view) == references[view]
+
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(check, schedule))
+
+    mismatches = [view for view, ok in zip(schedule, results) if not ok]
+    logging.info(
+        f"{len(schedule)} concurrent requests on {args.threads} threads, "
+        f"{len(mismatches)} mismatches"
+    )
+    if mismatches:
+        for pathname, year, activity_type in sorted(set(mismatches), key=str):
+            logging.error(f"response for {pathname} {year} {activity_type} differed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""Exports the dashboard of every (year, type, theme) view as a static site.
+
+Each view is written to ``<theme>/<year>/<type>/`` as an ``index.html`` page
+with its stat cards and a ``data.json`` bundle with its figures, so the site
+can be served by any static file server after a sync::
+
+    python -m strava_stats.scripts.export_static_site --output site
+    python -m strava_stats.scripts.export_static_site --athlete 12345 --output site/12345
+
+A manifest records a digest of the rollup and derived data behind every
+view, and views whose digest is unchanged since the last export are skipped.
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import logging
+import os
+import pathlib
+import sys
+import time
+from dataclasses import asdict
+
+import numpy as np
+import plotly.offline
+from plotly.utils import PlotlyJSONEncoder
+
+from strava_stats.athletes import Dataset
+from strava_stats.figures import (
+    FIGURE_TEMPLATES,
+    apply_figure_theme,
+    build_dashboard_data_from_rollup,
+    build_derived_figures,
+    build_year_over_year,
+    get_figure_themes,
+    rollup_cumulative_distance,
+)
+from strava_stats.main import THEME_CLASSES, create_stat_cards
+from strava_stats.rollups import (
+    build_rollup,
+    get_rollup_view,
+    rollup_longest_streak,
+    rollup_view_summary,
+)
+from strava_stats.strava_api import write_json_atomic
+from strava_stats.strava_stats import ALL_YEARS, current_year, year_pace
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s", stream=sys.stdout, level=logging.INFO
+)
+
+# Bump when the pages or bundles change shape, so the next export rewrites them
+EXPORT_FORMAT_VERSION = 4
+ACTIVITY_TYPES = ["Ride", "Run", "Hike"]
+MANIFEST_FILENAME = "manifest.json"
+PLOTLY_JS_FILENAME = "plotly.min.js"
+FIGURE_IDS = {
+    "heatmap": "km-per-day-over-year-graph",
+    "ride_length": "ride-length-binned-over-year-graph",
+    "monthly_distance": "monthly-distance-graph-graph",
+    "cumulative_distance": "cumulative-distance-graph",
+    "power_curve": "power-curve-graph",
+    "best_efforts": "best-efforts-graph",
+    "training_load": "training-load-graph",
+    "rolling_distance": "rolling-distance-graph",
+    "routes": "routes-graph",
+}
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html class="{html_class}">
+    <head>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <title>Strava Stats 🚲 - {title}</title>
+        <script src="https://unpkg.com/@tailwindcss/browser@4"></script>
+        <style type="text/tailwindcss">
+            @custom-variant dark (&:where(.dark, .dark *));
+        </style>
+        <script src="{root}{plotly_js}"></script>
+    </head>
+    <body class="{bg_primary} min-h-screen">
+        <div class="max-w-7xl mx-auto px-2 py-4 mb-4 {bg_card} rounded-b {shadow} border-b border-x {border}">
+            <div class="flex justify-between items-center mb-3">
+                <div class="w-24"></div>
+                <h1 class="text-4xl font-bold {text_primary} text-center flex-1">Strava Stats 🚲</h1>
+                <a href="{theme_toggle_href}" class="px-3 py-1 rounded bg-red-500 hover:bg-red-600 text-white text-sm font-medium text-center w-24">Light/Dark Mode</a>
+            </div>
+            <div class="flex justify-center gap-4 flex-wrap">
+                <select class="w-32 p-1 rounded border {border} {bg_card} {text_primary}" onchange="location.href = this.value">{year_options}</select>
+                <select class="w-32 p-1 rounded border {border} {bg_card} {text_primary}" onchange="location.href = this.value">{type_options}</select>
+            </div>
+        </div>
+        <div class="max-w-7xl mx-auto px-2 mb-4 p-3 rounded {shadow} {bg_card} border {border}">
+            <h2 class="text-base font-bold text-center {text_accent} mb-2">Distance (KM) by Date</h2>
+            <div id="km-per-day-over-year-graph" style="height: 450px"></div>
+        </div>
+        <div class="grid grid-cols-1 lg:grid-cols-3 gap-3 max-w-7xl mx-auto">
+            <div class="grid grid-cols-2 gap-2">{stat_cards}</div>
+            <div class="p-3 {bg_card} rounded {shadow} border {border}">
+                <h2 class="text-base font-bold text-center {text_accent} mb-2">Ride Count By Length</h2>
+                <div id="ride-length-binned-over-year-graph" style="height: 300px"></div>
+            </div>
+            <div class="p-3 {bg_card} rounded {shadow} border {border}">
+                <h2 class="text-base font-bold text-center {text_accent} mb-2">Monthly Distance</h2>
+                <div id="monthly-distance-graph-graph" style="height: 300px"></div>
+            </div>
+        </div>
+        <div class="max-w-7xl mx-auto mt-3">
+            <div class="p-3 {bg_card} rounded {shadow} border {border}">
+                <h2 class="text-base font-bold text-center {text_accent} mb-2">Distance vs Previous Years</h2>
+                <div id="cumulative-distance-graph" style="height: 350px"></div>
+            </div>
+        </div>
+        <div class="grid grid-cols-1 lg:grid-cols-2 gap-3 max-w-7xl mx-auto mt-3">
+            <div class="p-3 {bg_card} rounded {shadow} border {border}">
+                <h2 class="text-base font-bold text-center {text_accent} mb-2">Power Curve</h2>
+                <div id="power-curve-graph" style="height: 300px"></div>
+            </div>
+            <div class="p-3 {bg_card} rounded {shadow} border {border}">
+                <h2 class="text-base font-bold text-center {text_accent} mb-2">Best Efforts</h2>
+                <div id="best-efforts-graph" style="height: 300px"></div>
+            </div>
+        </div>
+        <div class="grid grid-cols-1 lg:grid-cols-2 gap-3 max-w-7xl mx-auto mt-3">
+            <div class="p-3 {bg_card} rounded {shadow} border {border}">
+                <h2 class="text-base font-bold text-center {text_accent} mb-2">Training Load</h2>
+                <div id="training-load-graph" style="height: 300px"></div>
+            </div>
+            <div class="p-3 {bg_card} rounded {shadow} border {border}">
+                <h2 class="text-base font-bold text-center {text_accent} mb-2">Rolling Distance</h2>
+                <div id="rolling-distance-graph" style="height: 300px"></div>
+            </div>
+        </div>
+        <div class="max-w-7xl mx-auto mt-3">
+            <div class="p-3 {bg_card} rounded {shadow} border {border}">
+                <h2 class="text-base font-bold text-center {text_accent} mb-2">Where I Ride</h2>
+                <div id="routes-graph" style="height: 500px"></div>
+            </div>
+        </div>
+        <div class="max-w-7xl mx-auto px-2 py-4 text-center {text_secondary} text-xs mt-6">
+            <p>Powered by Strava API</p>
+        </div>
+        <script>
+            fetch("data.json")
+                .then((response) => response.json())
+                .then((bundle) => {{
+                    const ids = {figure_ids};
+                    for (const [name, id] of Object.entries(ids)) {{
+                        const figure = bundle.figures[name];
+                        Plotly.newPlot(id, figure.data, figure.layout, {{displayModeBar: false, responsive: true}});
+                    }}
+                }});
+        </script>
+    </body>
+</html>
+"""
+
+REDIRECT_TEMPLATE = """<!DOCTYPE html>
+<html>
+    <head>
+        <meta charset="utf-8">
+        <meta http-equiv="refresh" content="0; url={href}">
+        <title>Strava Stats 🚲</title>
+    </head>
+    <body><a href="{href}">Strava Stats</a></body>
+</html>
+"""
+
+
+def view_path(theme: str, year, activity_type: str) -> str:
+    """Returns the directory of a view, relative to the root of the site."""
+    return f"{theme}/{year}/{activity_type}/"
+
+
+def view_digest(
+    rollup: dict,
+    year,
+    activity_type: str,
+    theme_digest: str,
+    cumulative: tuple[range, np.ndarray],
+    derived_versions: tuple,
+) -> str:
+    """Returns a digest of everything a rendered view depends on, with the
+    versions of the files derived besides the rollup standing in for their
+    contents."""
+    view = get_rollup_view(rollup, year, activity_type)
+    years, cumulative_distance = cumulative
+    highlight = current_year() if year == ALL_YEARS else year
+    inputs = dict(
+        format_version=EXPORT_FORMAT_VERSION,
+        theme=theme_digest,
+        year=year,
+        activity_type=activity_type,
+        view=view,
+        # the current streak is relative to today, so compare the value
+        # rather than the date to avoid rewriting every view daily
+        summary=asdict(rollup_view_summary(view)),
+        longest_streak_ever=rollup_longest_streak(rollup, activity_type),
+        calendar_years=list(rollup["calendar_years"]) if year == ALL_YEARS else None,
+        # the year over year chart shows every year of the type, and the pace
+        # of the current year changes daily
+        cumulative_distance=hashlib.sha256(cumulative_distance.tobytes()).hexdigest(),
+        cumulative_years=[years.start, years.stop],
+        year_pace=asdict(year_pace(years, cumulative_distance, highlight)),
+        derived_versions=list(derived_versions),
+    )
+    encoded = json.dumps(inputs, sort_keys=True, cls=PlotlyJSONEncoder)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def render_component(component) -> str:
+    """Renders Dash html components, such as the stat cards, to HTML."""
+    if component is None:
+        return ""
+    if isinstance(component, (list, tuple)):
+        return "".join(render_component(child) for child in component)
+    if not hasattr(component, "children"):
+        return html.escape(str(component))
+    tag = type(component).__name__.lower()
+    class_name = getattr(component, "className", None)
+    attributes = f' class="{html.escape(class_name)}"' if class_name else ""
+    return f"<{tag}{attributes}>{render_component(component.children)}</{tag}>"
+
+
+def render_options(options: list[tuple[str, str]], selected: str) -> str:
+    return "".join(
+        f'<option value="{html.escape(href)}"'
+        f"{' selected' if label == selected else ''}>{html.escape(label)}</option>"
+        for label, href in options
+    )
+
+
+def render_page(
+    dashboard: dict, theme: str, year, activity_type: str, years: list
+) -> str:
+    """Renders the HTML page of a view, loading its figures from data.json."""
+    # pages are three directories deep, links are relative so the site can be
+    # served from any prefix
+    root = "../../../"
+    other_theme = "dark" if theme == "light" else "light"
+    year_options = [("All time" if y == ALL_YEARS else str(y), y) for y in years]
+    return PAGE_TEMPLATE.format(
+        html_class="dark" if theme == "dark" else "",
+        title=html.escape(
+            f"{'All time' if year == ALL_YEARS else year} {activity_type}"
+        ),
+        root=root,
+        plotly_js=PLOTLY_JS_FILENAME,
+        theme_toggle_href=root + view_path(other_theme, year, activity_type),
+        year_options=render_options(
+            [
+                (label, root + view_path(theme, y, activity_type))
+                for label, y in year_options
+            ],
+            "All time" if year == ALL_YEARS else str(year),
+        ),
+        type_options=render_options(
+            [(t, root + view_path(theme, year, t)) for t in ACTIVITY_TYPES],
+            activity_type,
+        ),
+        stat_cards=render_component(
+            create_stat_cards(
+                dashboard["summary"],
+                dashboard["longest_streak_ever"],
+                dashboard["year_pace"],
+            )
+        ),
+        figure_ids=json.dumps(FIGURE_IDS),
+        **THEME_CLASSES,
+    )
+
+
+def write_text_atomic(path: pathlib.Path, text: str) -> None:
+    """Writes text to a temporary file and renames it over the target, so the
+    web server never serves a partially written page."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def load_manifest(output: pathlib.Path) -> dict:
+    try:
+        with open(output / MANIFEST_FILENAME, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get("format_version") != EXPORT_FORMAT_VERSION:
+        return {}
+    return manifest.get("views", {})
+
+
+def remove_view(output: pathlib.Path, path: str) -> None:
+    """Removes the files of a view that is no longer exported."""
+    view_dir = output / path
+    for filename in ("index.html", "data.json"):
+        (view_dir / filename).unlink(missing_ok=True)
+    # prune the directories left empty, up to the theme directory
+    for directory in (view_dir, view_dir.parent, view_dir.parent.parent):
+        try:
+            directory.rmdir()
+        except OSError:
+            break
+
+
+def export_static_site(
+    dataset: Dataset, output: pathlib.Path, force: bool = False
+) -> dict:
+    """Renders every view of a dataset whose data changed since the last
+    export and returns the counts of rendered, unchanged and removed views."""
+    rollup = dataset.get_rollup()
+    if rollup is None:
+        # no rollup synced yet, aggregate the activities once in memory
+        rollup = build_rollup(dataset.activity_store.get_table())
+
+    previous = {} if force else load_manifest(output)
+    years = [ALL_YEARS, *sorted(rollup["years"], reverse=True)]
+    theme_digests = {
+        theme: hashlib.sha256(
+            json.dumps(themes, sort_keys=True, cls=PlotlyJSONEncoder).encode()
+        ).hexdigest()
+        for theme, themes in get_figure_themes().items()
+    }
+    # the year list is part of every page, through the year dropdown
+    years_digest = hashlib.sha256(json.dumps(years).encode()).hexdigest()
+
+    plotly_js = output / PLOTLY_JS_FILENAME
+    if force or not plotly_js.exists():
+        write_text_atomic(plotly_js, plotly.offline.get_plotlyjs())
+
+    # the best efforts, route tiles and training load the sync derived, if any
+    derived = [dataset.get_published(store) for store in dataset.derived_stores()]
+    derived_versions = tuple(store.version for store in dataset.derived_stores())
+
+    # the year over year chart of a type is the same for all its views
+    cumulative = {
+        activity_type: rollup_cumulative_distance(rollup, activity_type)
+        for activity_type in ACTIVITY_TYPES
+    }
+
+    views = {}
+    counts = dict(rendered=0, unchanged=0, removed=0)
+    for year in years:
+        for activity_type in ACTIVITY_TYPES:
+            # both themes share the aggregates, so build them at most once
+            dashboard = None
+            for theme in FIGURE_TEMPLATES:
+                path = view_path(theme, year, activity_type)
+                digest = view_digest(
+                    rollup,
+                    year,
+                    activity_type,
+                    theme_digests[theme] + years_digest,
+                    cumulative[activity_type],
+                    derived_versions,
+                )
+                views[path] = digest
+                if previous.get(path) == digest and (output / path).is_dir():
+                    counts["unchanged"] += 1
+                    continue
+
+                if dashboard is None:
+                    dashboard = {
+                        **build_dashboard_data_from_rollup(rollup, year, activity_type),
+                        **build_year_over_year(*cumulative[activity_type], year),
+                        **build_derived_figures(*derived, year, activity_type),
+                    }
+                figures = {
+                    name: apply_figure_theme(dashboard[name], theme)
+                    for name in FIGURE_IDS
+                }
+                bundle = dict(
+                    summary=asdict(dashboard["summary"]),
+                    longest_streak_ever=dashboard["longest_streak_ever"],
+                    year_pace=asdict(dashboard["year_pace"]),
+                    figures=figures,
+                )
+                write_text_atomic(
+                    output / path / "data.json",
+                    json.dumps(bundle, cls=PlotlyJSONEncoder),
+                )
+                write_text_atomic(
+                    output / path / "index.html",
+                    render_page(dashboard, theme, year, activity_type, years),
+                )
+                counts["rendered"] += 1
+
+    for path in set(previous) - set(views):
+        remove_view(output, path)
+        counts["removed"] += 1
+
+    # the current year, else the latest with activities, else All time
+    if current_year() in rollup["years"]:
+        default_year = current_year()
+    else:
+        default_year = years[1] if len(years) > 1 else ALL_YEARS
+    write_text_atomic(
+        output / "index.html",
+        REDIRECT_TEMPLATE.format(href=view_path("light", default_year, "Ride")),
+    )
+    # written last, so an interrupted export re-renders what it didn't finish
+    write_json_atomic(
+        output / MANIFEST_FILENAME,
+        dict(format_version=EXPORT_FORMAT_VERSION, views=views),
+    )
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="site", help="directory of the site")
+    parser.add_argument("--athlete", help="export a registered athlete")
+    parser.add_argument(
+        "--force", action="store_true", help="render every view, even unchanged ones"
+    )
+    args = parser.parse_args()
+
+    dataset = Dataset.for_athlete(args.athlete) if args.athlete else Dataset()
+    start = time.perf_counter()
+    counts = export_static_site(dataset, pathlib.Path(args.output), force=args.force)
+    logging.info(
+        f"rendered {counts['rendered']} views, {counts['unchanged']} unchanged, "
+        f"{counts['removed']} removed in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import argparse
+import logging
+import sys
+
+from strava_stats.storage import import_json_activities
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s", stream=sys.stdout, level=logging.INFO
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import an existing activities JSON file into the SQLite store"
+    )
+    parser.add_argument("--json-path", default="strava_stats/data/activities.json")
+    parser.add_argument("--db-path", default="strava_stats/data/activities.db")
+    args = parser.parse_args()
+
+    database = import_json_activities(args.json_path, args.db_path)
+    logging.info(f"database now holds {database.count()} activities")
+
+
+if __name__ == "__main__":
+    main()
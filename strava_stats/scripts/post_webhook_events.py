@@ -0,0 +1,166 @@
+"""Posts synthetic Strava webhook events to a running sync and checks that
+they are applied.
+
+Creates, edits and deletes an activity in the local Strava stub, posts the
+matching events to the webhook receiver of a sync pointed at the stub, and
+waits until the sync saved and published every change::
+
+    python -m strava_stats.scripts.stub_strava_server --activities activities.json
+    STRAVA_BASE_URL=http://127.0.0.1:8765 STRAVA_WEBHOOK_VERIFY_TOKEN=test \\
+        python -m strava_stats.scripts.sync_strava_activities
+    python -m strava_stats.scripts.post_webhook_events --verify-token test
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import pathlib
+import sys
+import time
+import uuid
+
+import requests
+
+from strava_stats.athletes import DATA_VERSION_FILENAME
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s", stream=sys.stdout, level=logging.INFO
+)
+
+
+def event(aspect_type: str, activity_id: int, args, updates=None) -> dict:
+    """Returns a push notification as Strava posts it."""
+    return {
+        "aspect_type": aspect_type,
+        "event_time": int(time.time()),
+        "object_id": activity_id,
+        "object_type": "activity",
+        "owner_id": args.owner_id,
+        "subscription_id": args.subscription_id,
+        "updates": updates or {},
+    }
+
+
+def load_activities(path: str) -> dict[int, dict]:
+    try:
+        with open(path, "r") as f:
+            return {activity["id"]: activity for activity in json.load(f)}
+    except (FileNotFoundError, ValueError):
+        # replaced concurrently, or not synced yet
+        return {}
+
+
+def published(path: str) -> bool:
+    """Returns whether the sync published the data since it last wrote the
+    activities, it publishes once everything derived from them is written."""
+    activities_path = pathlib.Path(path)
+    version_path = activities_path.with_name(DATA_VERSION_FILENAME)
+    try:
+        return version_path.stat().st_mtime_ns >= activities_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def check_validation(session: requests.Session, args) -> bool:
+    """Checks the receiver echoes the challenge for the right verify token
+    only."""
+    challenge = uuid.uuid4().hex
+    params = {"hub.mode": "subscribe", "hub.challenge": challenge}
+    accepted = session.get(
+        args.webhook_url, params={**params, "hub.verify_token": args.verify_token}
+    )
+    rejected = session.get(
+        args.webhook_url, params={**params, "hub.verify_token": "wrong"}
+    )
+    return (
+        accepted.status_code == 200
+        and accepted.json().get("hub.challenge") == challenge
+        and rejected.status_code == 403
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8766/webhook")
+    parser.add_argument("--stub-url", default="http://127.0.0.1:8765")
+    parser.add_argument("--verify-token", required=True)
+    parser.add_argument(
+        "--activities",
+        default="strava_stats/data/activities.json",
+        help="activities JSON file the sync writes",
+    )
+    parser.add_argument("--owner-id", type=int, default=1)
+    parser.add_argument("--subscription-id", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds")
+    args = parser.parse_args()
+
+    session = requests.Session()
+    if not check_validation(session, args):
+        logging.error("subscription validation failed")
+        sys.exit(1)
+    logging.info("subscription validation answered")
+
+    activities = sorted(
+        load_activities(args.activities).values(),
+        key=lambda activity: activity["start_date"],
+        reverse=True,
+    )
+    if len(activities) < 2:
+        logging.error(f"sync at least two activities into {args.activities} first")
+        sys.exit(1)
+    edited, deleted = activities[0], activities[1]
+    created = {
+        **edited,
+        "id": max(activity["id"] for activity in activities) + 1,
+        "start_date": datetime.datetime.now(datetime.timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        ),
+    }
+    edited = {**edited, "distance": edited["distance"] + 1000.0}
+
+    # change the stub first, the sync fetches the activities from it
+    for activity in (created, edited):
+        session.put(
+            f"{args.stub_url}/stub/activities/{activity['id']}", json=activity
+        ).raise_for_status()
+    session.delete(
+        f"{args.stub_url}/stub/activities/{deleted['id']}"
+    ).raise_for_status()
+
+    start = time.perf_counter()
+    for posted in (
+        event("create", created["id"], args),
+        event("update", edited["id"], args, {"title": "Edited"}),
+        event("delete", deleted["id"], args),
+    ):
+        response = session.post(args.webhook_url, json=posted, timeout=2)
+        response.raise_for_status()
+    logging.info(f"posted 3 events in {time.perf_counter() - start:.3f}s")
+
+    checks = {
+        "created": lambda saved: created["id"] in saved,
+        "edited": lambda saved: (
+            saved.get(edited["id"], {}).get("distance") == edited["distance"]
+        ),
+        "deleted": lambda saved: deleted["id"] not in saved,
+    }
+    while time.perf_counter() - start < args.timeout:
+        saved = load_activities(args.activities)
+        failed = [name for name, check in checks.items() if not check(saved)]
+        if not failed and published(args.activities):
+            logging.info(
+                f"every event applied and published after "
+                f"{time.perf_counter() - start:.2f}s"
+            )
+            return
+        time.sleep(0.1)
+
+    logging.error(
+        f"events not applied within {args.timeout}s: {', '.join(failed) or 'unpublished'}"
+    )
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Reports the peak RSS of loading the activities with each loader.
+
+Every loader runs in a fresh process so the measurements don't share heap::
+
+    python -m strava_stats.scripts.report_loader_memory strava_stats/data/activities.json
+"""
+
+import argparse
+import multiprocessing
+import pathlib
+import queue as queue_module
+import resource
+import time
+
+LOADERS = ["baseline", "json", "json_table", "streaming_table"]
+
+
+def _measure(loader: str, path: str, queue) -> None:
+    from strava_stats.activity_table import ActivityTable
+    from strava_stats.strava_api import load_activity_table, load_strava_activities
+
+    start = time.perf_counter()
+    data = None
+    if loader == "json":
+        data = load_strava_activities(path)
+    elif loader == "json_table":
+        data = ActivityTable.from_activities(load_strava_activities(path))
+    elif loader == "streaming_table":
+        data = load_activity_table(path)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((loader, peak_rss, elapsed, 0 if data is None else len(data)))
+
+
+def wait_for_result(process, queue) -> tuple:
+    """Returns what the process put on the queue, raising if it exited
+    without, e.g. on a missing file."""
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except queue_module.Empty:
+            if process.exitcode is not None:
+                raise RuntimeError(f"loader process exited with {process.exitcode}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="activities JSON file")
+    args = parser.parse_args()
+    # the loaders resolve relative paths against the package directory
+    path = str(pathlib.Path(args.path).resolve())
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    print(f"{'loader':<16} {'peak RSS':>10} {'load time':>10} {'activities':>11}")
+    for loader in LOADERS:
+        process = context.Process(target=_measure, args=(loader, path, queue))
+        process.start()
+        try:
+            name, peak_rss, elapsed, count = wait_for_result(process, queue)
+        finally:
+            process.join()
+        print(f"{name:<16} {peak_rss / 1024:>7.1f} MB {elapsed:>9.2f}s {count:>11}")
+
+
+if __name__ == "__main__":
+    main()
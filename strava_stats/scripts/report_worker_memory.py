@@ -0,0 +1,191 @@
+"""Reports the startup time of the app and the memory of its gunicorn workers.
+
+Times importing the app and creating it with the data loaded in fresh
+processes, then starts gunicorn with and without preloading, requests every
+view from each worker and reports the RSS of the master and every worker
+with the part of it shared with the other processes. Run it from the
+repository root, next to gunicorn.conf.py::
+
+    python -m strava_stats.scripts.report_worker_memory --workers 4
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+APP = "strava_stats.main:create_app(warm=True)"
+HEAVY_MODULES = ["pandas", "plotly.express", "strava_stats.figures"]
+
+
+def _measure_startup(queue) -> None:
+    start = time.perf_counter()
+    from strava_stats import main
+
+    imported = time.perf_counter() - start
+    loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+    start = time.perf_counter()
+    main.create_app(warm=True)
+    queue.put((imported, time.perf_counter() - start, loaded))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def child_pids(pid: int) -> list[int]:
+    """Returns the ids of the processes whose parent is ``pid``."""
+    children = []
+    for stat_path in pathlib.Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = stat_path.read_text()
+        except OSError:
+            continue
+        # the fields after the parenthesized command start with state, ppid
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            children.append(int(stat_path.parent.name))
+    return sorted(children)
+
+
+def memory(pid: int) -> dict[str, int]:
+    """Returns the RSS, PSS, shared and private memory of a process in kB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0])
+    return dict(
+        rss=fields["Rss"],
+        pss=fields["Pss"],
+        shared=fields["Shared_Clean"] + fields["Shared_Dirty"],
+        private=fields["Private_Clean"] + fields["Private_Dirty"],
+    )
+
+
+def serve(preload: bool, workers: int, port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        GUNICORN_PRELOAD="1" if preload else "0",
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        WEB_CONCURRENCY=str(workers),
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", APP],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_for_workers(
+    server: subprocess.Popen, url: str, workers: int, timeout: float
+) -> None:
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}")
+        try:
+            if len(child_pids(server.pid)) == workers:
+                requests.get(url, timeout=5).raise_for_status()
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"gunicorn didn't start {workers} workers in {timeout}s")
+
+
+def request_views(url: str, views: list, rounds: int, threads: int) -> None:
+    """Requests every view several times from concurrent connections, so
+    every worker renders them."""
+    import requests
+
+    from strava_stats.scripts.check_concurrent_rendering import render
+
+    def request(view) -> None:
+        with requests.Session() as session:
+            render(session, url, "/", *view)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(request, views * rounds))
+
+
+def report_workers(args, preload: bool, views: list) -> int:
+    """Prints the memory of the master and workers, returns the total PSS."""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = serve(preload, args.workers, port)
+    try:
+        wait_for_workers(server, url, args.workers, args.timeout)
+        request_views(url, views, args.rounds, args.workers * 4)
+        processes = [("master", server.pid)] + [
+            (f"worker {i + 1}", pid) for i, pid in enumerate(child_pids(server.pid))
+        ]
+        mode = "preload" if preload else "no preload"
+        total_pss = 0
+        for name, pid in processes:
+            usage = memory(pid)
+            total_pss += usage["pss"]
+            print(
+                f"{mode:<11} {name:<9} {usage['rss'] / 1024:>7.1f} MB "
+                f"{usage['pss'] / 1024:>7.1f} MB {usage['shared'] / 1024:>7.1f} MB "
+                f"{usage['private'] / 1024:>7.1f} MB"
+            )
+        print(f"{mode:<11} {'total':<9} {'':>10} {total_pss / 1024:>7.1f} MB")
+        return total_pss
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3, help="startup samples")
+    parser.add_argument("--rounds", type=int, default=4, help="requests per view")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds")
+    args = parser.parse_args()
+
+    # the fastest of a few fresh processes, with the files in the page cache
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    samples = []
+    for _ in range(args.repeat):
+        process = context.Process(target=_measure_startup, args=(queue,))
+        process.start()
+        samples.append(queue.get())
+        process.join()
+    imported, created, loaded = min(samples)
+    print(f"import strava_stats.main       {imported * 1000:>7.0f} ms")
+    print(f"create_app(warm=True)          {created * 1000:>7.0f} ms")
+    print(f"heavy modules it imports       {', '.join(loaded) or 'none'}")
+    print()
+
+    from strava_stats.main import get_available_years, get_dataset
+
+    years = get_available_years(get_dataset())
+    views = list(itertools.product([*years, "all"], ["Ride", "Run"]))
+    print(
+        f"{'mode':<11} {'process':<9} {'RSS':>10} {'PSS':>10} {'shared':>10} {'private':>10}"
+    )
+    totals = {
+        preload: report_workers(args, preload, views) for preload in (False, True)
+    }
+    print(
+        f"\npreloading saves {(totals[False] - totals[True]) / 1024:.1f} MB "
+        f"of PSS across {args.workers} workers"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Local stand-in for the Strava API, for exercising and benchmarking the sync.
+
+Serves activities from a JSON file with Strava's paging, ``after`` filtering
+and rate limit headers, single activities and synthetic streams for each of
+them, and can inject latency and 429/5xx failures. Activities can be created,
+replaced and deleted through ``PUT`` and ``DELETE /stub/activities/<id>``, to
+go with synthetic webhook events::
+
+    python -m strava_stats.scripts.stub_strava_server --activities data.json
+    STRAVA_BASE_URL=http://127.0.0.1:8765 python -m strava_stats.scripts.sync_strava_activities --full
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+logging.basicConfig(
+    format="%(asctime)s %(message)s", stream=sys.stdout, level=logging.INFO
+)
+
+STREAMS_PATH = re.compile(r"/api/v3/activities/(\d+)/streams")
+ACTIVITY_PATH = re.compile(r"/api/v3/activities/(\d+)")
+STUB_ACTIVITY_PATH = re.compile(r"/stub/activities/(\d+)")
+# samples of the synthetic streams are spaced so no activity exceeds this
+MAX_STREAM_SAMPLES = 3600
+POWER_TYPES = {"Ride", "VirtualRide"}
+
+
+def generate_streams(activity: dict) -> dict:
+    """Generates plausible streams for an activity, the same on every call."""
+    rng = random.Random(activity["id"])
+    moving_time = max(int(activity.get("moving_time") or 0), 1)
+    step = max(1, math.ceil(moving_time / MAX_STREAM_SAMPLES))
+    times = list(range(0, moving_time, step))
+    count = len(times)
+    total_distance = float(activity.get("distance") or 0.0)
+    lat, lng = activity.get("start_latlng") or (55.6761, 12.5683)
+    heading = rng.uniform(0, 2 * math.pi)
+
+    distance, altitude, heartrate, watts, cadence, latlng = [], [], [], [], [], []
+    elevation = rng.uniform(0, 500)
+    for i in range(count):
+        distance.append(round(total_distance * i / max(count - 1, 1), 1))
+        elevation += rng.gauss(0, 0.5)
+        altitude.append(round(elevation, 1))
+        heartrate.append(int(rng.gauss(145, 12)))
+        watts.append(max(0, int(rng.gauss(200, 60))))
+        cadence.append(max(0, int(rng.gauss(85, 8))))
+        heading += rng.gauss(0, 0.05)
+        # roughly 1e-5 degrees per meter
+        meters = total_distance / max(count, 1)
+        lat += math.cos(heading) * meters * 1e-5
+        lng += math.sin(heading) * meters * 1e-5
+        latlng.append([round(lat, 6), round(lng, 6)])
+
+    streams = {
+        "time": times,
+        "distance": distance,
+        "altitude": altitude,
+        "heartrate": heartrate,
+        "cadence": cadence,
+        "latlng": latlng,
+    }
+    if activity.get("type") in POWER_TYPES:
+        streams["watts"] = watts
+    return {
+        key: {
+            "data": data,
+            "series_type": "distance",
+            "original_size": count,
+            "resolution": "high",
+        }
+        for key, data in streams.items()
+    }
+
+
+class StubStravaServer(ThreadingHTTPServer):
+    def __init__(
+        self,
+        address: tuple[str, int],
+        activities: list[dict],
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        short_limit: int = 200,
+        daily_limit: int = 2000,
+    ):
+        super().__init__(address, StubStravaHandler)
+        self.activities = sorted(
+            activities, key=lambda a: a["start_date"], reverse=True
+        )
+        self.activities_by_id = {activity["id"]: activity for activity in activities}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.requests: list[str] = []
+        self.lock = threading.Lock()
+
+    def set_activity(self, activity_id: int, activity: Optional[dict]) -> None:
+        """Creates or replaces an activity, or deletes it with None."""
+        with self.lock:
+            self.activities_by_id.pop(activity_id, None)
+            if activity is not None:
+                self.activities_by_id[activity_id] = {**activity, "id": activity_id}
+            self.activities = sorted(
+                self.activities_by_id.values(),
+                key=lambda a: a["start_date"],
+                reverse=True,
+            )
+
+    def start(self) -> threading.Thread:
+        """Serves requests from a background thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class StubStravaHandler(BaseHTTPRequestHandler):
+    server: StubStravaServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data) -> None:
+        body = json.dumps(data).encode()
+        with self.server.lock:
+            usage = len(self.server.requests)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header(
+            "X-RateLimit-Limit", f"{self.server.short_limit},{self.server.daily_limit}"
+        )
+        self.send_header("X-RateLimit-Usage", f"{usage},{usage}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _begin(self) -> bool:
+        """Records the request and returns False if a failure was injected."""
+        with self.server.lock:
+            self.server.requests.append(f"{self.command} {self.path}")
+        time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            self._send_json(random.choice([429, 503]), {"message": "injected"})
+            return False
+        return True
+
+    def do_PUT(self):
+        match = STUB_ACTIVITY_PATH.fullmatch(urlparse(self.path).path)
+        if not match:
+            self._send_json(404, {"message": "Record Not Found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        activity = json.loads(self.rfile.read(length))
+        self.server.set_activity(int(match.group(1)), activity)
+        self._send_json(200, activity)
+
+    def do_DELETE(self):
+        match = STUB_ACTIVITY_PATH.fullmatch(urlparse(self.path).path)
+        if not match:
+            self._send_json(404, {"message": "Record Not Found"})
+            return
+        self.server.set_activity(int(match.group(1)), None)
+        self._send_json(200, {})
+
+    def do_POST(self):
+        if not self._begin():
+            return
+        expires_at = int(time.time()) + 6 * 60 * 60
+        self._send_json(
+            200,
+            {
+                "access_token": "stub-access-token",
+                "refresh_token": "stub-refresh-token",
+                "expires_at": expires_at,
+            },
+        )
+
+    def do_GET(self):
+        if not self._begin():
+            return
+        url = urlparse(self.path)
+        streams_match = STREAMS_PATH.fullmatch(url.path)
+        if streams_match:
+            self._send_streams(int(streams_match.group(1)), parse_qs(url.query))
+            return
+        activity_match = ACTIVITY_PATH.fullmatch(url.path)
+        if activity_match:
+            self._send_activity(int(activity_match.group(1)))
+            return
+        if url.path != "/api/v3/athlete/activities":
+            self._send_json(404, {"message": "Record Not Found"})
+            return
+
+        query = parse_qs(url.query)
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["30"])[0])
+        activities = self.server.activities
+        if "after" in query:
+            after = int(query["after"][0])
+            # Strava returns activities oldest first when filtering by after
+            activities = [
+                activity
+                for activity in reversed(activities)
+                if datetime.datetime.fromisoformat(activity["start_date"]).timestamp()
+                > after
+            ]
+        self._send_json(200, activities[(page - 1) * per_page : page * per_page])
+
+    def _send_activity(self, activity_id: int) -> None:
+        activity = self.server.activities_by_id.get(activity_id)
+        if activity is None:
+            self._send_json(404, {"message": "Record Not Found"})
+            return
+        # a detailed activity, with fields the summary activities lack
+        self._send_json(
+            200, {**activity, "resource_state": 3, "segment_efforts": [], "laps": []}
+        )
+
+    def _send_streams(self, activity_id: int, query: dict) -> None:
+        activity = self.server.activities_by_id.get(activity_id)
+        # manually entered activities have no streams
+        if activity is None or activity.get("manual"):
+            self._send_json(404, {"message": "Record Not Found"})
+            return
+        streams = generate_streams(activity)
+        keys = query.get("keys", [""])[0].split(",")
+        self._send_json(
+            200, {key: stream for key, stream in streams.items() if key in keys}
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Strava API stub")
+    parser.add_argument("--activities", required=True, help="activities JSON file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--short-limit", type=int, default=200)
+    parser.add_argument("--daily-limit", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(args.activities, "r") as f:
+        activities = json.load(f)
+
+    server = StubStravaServer(
+        (args.host, args.port),
+        activities,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        short_limit=args.short_limit,
+        daily_limit=args.daily_limit,
+    )
+    logging.info(
+        f"serving {len(activities)} activities on http://{args.host}:{args.port}"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,360 @@
+import argparse
 import logging
+import os
+import pathlib
+import queue
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 import schedule
 
-from strava_stats.strava_api import StravaAPIError, save_strava_activities
+from strava_stats.activity_table import ActivityTable
+from strava_stats.athletes import (
+    athlete_data_dir,
+    get_athlete_client,
+    list_athletes,
+    publish_data_version,
+)
+from strava_stats.best_efforts import BEST_EFFORTS_FILENAME, update_best_efforts
+from strava_stats.metrics import metrics
+from strava_stats.rollups import write_rollup
+from strava_stats.routes import (
+    ROUTE_TILES_FILENAME,
+    routes_changed,
+    update_route_tiles,
+)
+from strava_stats.storage import DATABASE_FILENAME, ActivityDatabase
+from strava_stats.strava_api import (
+    StravaAPIError,
+    apply_strava_activity_changes,
+    get_client,
+    save_strava_activities,
+)
+from strava_stats.strava_client import RateLimiter, StravaClient
+from strava_stats.streams import StreamStore, backfill_streams
+from strava_stats.training_load import TRAINING_LOAD_FILENAME, update_training_load
+from strava_stats.webhooks import WebhookServer, drain_events, pending_changes
 
 logging.basicConfig(
     format="%(asctime)s %(message)s", stream=sys.stdout, level=logging.INFO
 )
 
+ACTIVITIES_PATH = "strava_stats/data/activities.json"
+DATABASE_PATH = f"strava_stats/data/{DATABASE_FILENAME}"
+ROLLUP_PATH = "strava_stats/data/rollup.json"
+
+# Incremental syncs only fetch new activities, a full reconciliation also
+# picks up edits and deletions of older ones
+SYNC_INTERVAL_HOURS = 3
+FULL_SYNC_INTERVAL_DAYS = 7
+
+# Athletes synced at the same time, each fetching up to STRAVA_MAX_WORKERS pages
+ATHLETE_SYNC_CONCURRENCY = int(os.getenv("STRAVA_ATHLETE_CONCURRENCY", "4"))
+
+# Also fetch the streams of new activities after each sync
+SYNC_STREAMS = bool(os.getenv("STRAVA_SYNC_STREAMS"))
+
+# With a verify token the sync also receives webhook events and applies each
+# changed activity right away, polling only as a daily safety net
+WEBHOOK_VERIFY_TOKEN = os.getenv("STRAVA_WEBHOOK_VERIFY_TOKEN")
+WEBHOOK_HOST = os.getenv("STRAVA_WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("STRAVA_WEBHOOK_PORT", "8766"))
+WEBHOOK_SUBSCRIPTION_ID = os.getenv("STRAVA_WEBHOOK_SUBSCRIPTION_ID")
+WEBHOOK_SYNC_INTERVAL_HOURS = 24
+
+# Strava rate limits are per application, so every athlete's client shares one
+rate_limiter = RateLimiter()
+
+
+def sync_dataset(
+    activities_path: str,
+    database_path: str,
+    rollup_path: str,
+    full: bool = False,
+    projection: bool = False,
+    client: Optional[StravaClient] = None,
+) -> list[dict]:
+    """Fetches activities into a JSON file, mirrors them into the database,
+    rollup, route tiles and training load next to it, and then publishes the
+    new data to the web workers."""
+    activities = save_strava_activities(
+        activities_path, incremental=not full, projection=projection, client=client
+    )
+    # mirror into the indexed database in a single transaction, writing only
+    # the activities the sync added or changed
+    database = ActivityDatabase(database_path)
+    previous_version = database.version()
+    changed_since, replaced = database.update_activities(activities)
+    # the overlap window refetches recent activities, which may have been edited
+    publish_dataset(
+        activities,
+        rollup_path,
+        rebuild_routes=full or routes_changed(activities, replaced),
+        changed_since=changed_since[:10] if changed_since else None,
+        database_versions=(previous_version, database.version()),
+    )
+    if SYNC_STREAMS:
+        sync_streams(activities, pathlib.Path(activities_path).parent, client)
+    return activities
+
+
+def publish_dataset(
+    activities: list[dict],
+    rollup_path: str,
+    rebuild_routes: bool = False,
+    changed_since: Optional[str] = None,
+    database_versions: Optional[tuple[int, int]] = None,
+) -> None:
+    """Derives the rollup, route tiles and training load from the activities
+    and publishes them to the web workers. ``changed_since`` is the first day
+    with activities added, changed or deleted between the database versions
+    before and after the change, if known."""
+    # precompute every dashboard view so the app never aggregates
+    write_rollup(ActivityTable.from_activities(activities), rollup_path)
+    update_route_tiles(
+        activities,
+        str(pathlib.Path(rollup_path).with_name(ROUTE_TILES_FILENAME)),
+        rebuild=rebuild_routes,
+    )
+    update_training_load(
+        activities,
+        str(pathlib.Path(rollup_path).with_name(TRAINING_LOAD_FILENAME)),
+        changed_since=changed_since,
+        database_versions=database_versions,
+    )
+    publish_data_version(pathlib.Path(rollup_path).parent)
+
+
+def apply_activity_changes(
+    activities_path: str,
+    database_path: str,
+    rollup_path: str,
+    fetch_ids: set[int],
+    delete_ids: set[int],
+    projection: bool = False,
+    client: Optional[StravaClient] = None,
+) -> list[dict]:
+    """Fetches the activities a webhook reported as created or updated one by
+    one, applies them and the deleted ones to the JSON file and the database,
+    and publishes the data derived from them."""
+    client = client or get_client()
+    fetched = []
+    for activity_id in sorted(fetch_ids):
+        activity = client.get_activity(activity_id)
+        if activity is None:
+            # deleted before the event was applied, or no longer visible
+            delete_ids = delete_ids | {activity_id}
+        else:
+            fetched.append(activity)
+
+    activities, replaced = apply_strava_activity_changes(
+        activities_path, fetched, delete_ids, projection=projection
+    )
+    fetched_ids = {activity["id"] for activity in fetched}
+    updated = [activity for activity in activities if activity["id"] in fetched_ids]
+    database = ActivityDatabase(database_path)
+    previous_version = database.version()
+    if updated:
+        database.upsert_activities(updated)
+    if delete_ids:
+        database.delete_activities(delete_ids)
+
+    changed_since = min(
+        (activity["start_date"][:10] for activity in [*updated, *replaced]),
+        default=None,
+    )
+    publish_dataset(
+        activities,
+        rollup_path,
+        rebuild_routes=routes_changed(updated, replaced),
+        changed_since=changed_since,
+        database_versions=(previous_version, database.version()),
+    )
+    if SYNC_STREAMS:
+        sync_streams(activities, pathlib.Path(activities_path).parent, client)
+    return activities
+
+
+def sync_streams(
+    activities: list[dict], data_dir: pathlib.Path, client: Optional[StravaClient]
+) -> None:
+    """Fetches the streams of the activities that don't have them yet, and
+    publishes the curves computed from them."""
+    data_dir = data_dir.resolve()
+    store = StreamStore(str(data_dir / "streams"))
+    try:
+        backfill_streams(
+            client or get_client(), [activity["id"] for activity in activities], store
+        )
+    except StravaAPIError:
+        # the next sync resumes where this one stopped
+        logging.warning("stopped fetching streams", exc_info=True)
+    # with whatever was fetched, the rest follows with the next sync
+    update_best_efforts(store, activities, str(data_dir / BEST_EFFORTS_FILENAME))
+    publish_data_version(data_dir)
+
+
+def log_api_usage() -> None:
+    # cumulative over the lifetime of the sync process
+    requests, latency = metrics.summary("strava_api_request_seconds")
+    average_ms = latency / requests * 1000 if requests else 0.0
+    logging.info(f"{requests} Strava API requests, {average_ms:.0f}ms on average")
+
 
-def sync_strava_activities():
-    logging.info("syncing strava activities")
+def sync_strava_activities(full: bool = False, projection: bool = False):
+    logging.info(f"syncing strava activities ({'full' if full else 'incremental'})")
     try:
-        activities = save_strava_activities("strava_stats/data/activities.json")
+        activities = sync_dataset(
+            ACTIVITIES_PATH, DATABASE_PATH, ROLLUP_PATH, full, projection
+        )
         logging.info(f"synced {len(activities)} activities")
     except StravaAPIError:
         logging.exception("error syncing strava activities")
+    finally:
+        log_api_usage()
+
+
+def sync_athlete(athlete_id: str, full: bool = False, projection: bool = False):
+    """Syncs the data partition of one athlete with their own tokens."""
+    data_dir = athlete_data_dir(athlete_id)
+    try:
+        activities = sync_dataset(
+            str(data_dir / "activities.json"),
+            str(data_dir / DATABASE_FILENAME),
+            str(data_dir / "rollup.json"),
+            full,
+            projection,
+            client=get_athlete_client(athlete_id, rate_limiter),
+        )
+        logging.info(f"synced {len(activities)} activities of athlete {athlete_id}")
+    except Exception:
+        # one athlete's revoked token or bad data shouldn't stop the others
+        logging.exception(f"error syncing activities of athlete {athlete_id}")
+
+
+def sync_athletes(full: bool = False, projection: bool = False):
+    """Syncs every registered athlete, a few at a time."""
+    athletes = list_athletes()
+    logging.info(
+        f"syncing {len(athletes)} athletes ({'full' if full else 'incremental'}), "
+        f"{ATHLETE_SYNC_CONCURRENCY} at a time"
+    )
+    with ThreadPoolExecutor(max_workers=ATHLETE_SYNC_CONCURRENCY) as executor:
+        for athlete_id in athletes:
+            executor.submit(sync_athlete, athlete_id, full, projection)
+    log_api_usage()
+
+
+def apply_webhook_events(events: list[dict], projection: bool = False):
+    """Applies a batch of webhook events, each athlete's changes at once.
+
+    Events that fail are only logged, the next poll picks up their changes.
+    """
+    athletes = list_athletes()
+    for owner_id, (fetch_ids, delete_ids) in pending_changes(events).items():
+        logging.info(
+            f"applying {len(fetch_ids)} changed and {len(delete_ids)} deleted "
+            f"activities of athlete {owner_id}"
+        )
+        try:
+            if not athletes:
+                apply_activity_changes(
+                    ACTIVITIES_PATH,
+                    DATABASE_PATH,
+                    ROLLUP_PATH,
+                    fetch_ids,
+                    delete_ids,
+                    projection,
+                )
+            elif owner_id in athletes:
+                data_dir = athlete_data_dir(owner_id)
+                apply_activity_changes(
+                    str(data_dir / "activities.json"),
+                    str(data_dir / DATABASE_FILENAME),
+                    str(data_dir / "rollup.json"),
+                    fetch_ids,
+                    delete_ids,
+                    projection,
+                    client=get_athlete_client(owner_id, rate_limiter),
+                )
+            else:
+                logging.warning(f"ignoring events of unregistered athlete {owner_id}")
+        except Exception:
+            logging.exception(f"error applying events of athlete {owner_id}")
+
+
+def start_webhook_receiver() -> queue.Queue:
+    """Starts receiving webhook events in the background and returns the
+    queue they arrive on."""
+    server = WebhookServer(
+        (WEBHOOK_HOST, WEBHOOK_PORT),
+        WEBHOOK_VERIFY_TOKEN,
+        subscription_id=int(WEBHOOK_SUBSCRIPTION_ID)
+        if WEBHOOK_SUBSCRIPTION_ID
+        else None,
+    )
+    server.start()
+    return server.events
+
+
+def sync(full: bool = False, projection: bool = False):
+    """Syncs the registered athletes, or the single athlete configured through
+    the environment when there are none."""
+    if list_athletes():
+        sync_athletes(full=full, projection=projection)
+    else:
+        sync_strava_activities(full=full, projection=projection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync Strava activities")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="run a single full reconciliation and exit",
+    )
+    parser.add_argument(
+        "--projection",
+        action="store_true",
+        help="only store the activity fields the stats use",
+    )
+    args = parser.parse_args()
+
+    if args.full:
+        sync(full=True, projection=args.projection)
+        return
+
+    # receive events before the initial sync, so none are missed while it runs
+    events = start_webhook_receiver() if WEBHOOK_VERIFY_TOKEN else None
+
+    # Run initially
+    sync(projection=args.projection)
 
+    # And then incrementally every few hours, or daily as a safety net for
+    # missed webhook events, with a periodic full reconciliation
+    interval = (
+        WEBHOOK_SYNC_INTERVAL_HOURS if events is not None else SYNC_INTERVAL_HOURS
+    )
+    schedule.every(interval).hours.do(sync, projection=args.projection)
+    schedule.every(FULL_SYNC_INTERVAL_DAYS).days.do(
+        sync, full=True, projection=args.projection
+    )
+    while True:
+        schedule.run_pending()
+        # sleep until the next sync is due or an event arrives, syncs and
+        # events are applied one after the other by this thread only
+        timeout = max(schedule.idle_seconds() or 0, 0)
+        if events is None:
+            time.sleep(timeout)
+            continue
+        try:
+            event = events.get(timeout=timeout)
+        except queue.Empty:
+            continue
+        apply_webhook_events(drain_events(events, event), args.projection)
 
-# Run initially
-sync_strava_activities()
 
-# And then every 3 hours
-schedule.every(3).hours.do(sync_strava_activities)
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+if __name__ == "__main__":
+    main()
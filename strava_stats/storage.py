@@ -0,0 +1,257 @@
+import json
+import logging
+import pathlib
+import sqlite3
+from contextlib import closing
+from typing import Iterable, Optional
+
+import numpy as np
+
+from strava_stats.activity_table import ActivityTable
+
+logger = logging.getLogger(__name__)
+
+DATABASE_FILENAME = "activities.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    start_date TEXT NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activities_start_date ON activities (start_date);
+CREATE INDEX IF NOT EXISTS idx_activities_type_start_date
+    ON activities (type, start_date);
+"""
+
+
+class ActivityDatabase:
+    """SQLite store of Strava activities indexed on start_date and type.
+
+    The database runs in WAL mode and every write is a single transaction,
+    so the sync process can write while the app reads a consistent snapshot.
+    ``PRAGMA user_version`` is bumped on each write and doubles as the
+    dataset version readers can poll cheaply. Readers open it with
+    ``create=False``, which leaves the file alone and raises
+    FileNotFoundError until the sync created it.
+    """
+
+    def __init__(self, path: str | pathlib.Path, create: bool = True):
+        self.path = pathlib.Path(path)
+        if not create:
+            if not self.path.exists():
+                raise FileNotFoundError(f"activity database not found at {path}")
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections are cheap, open one per call so the store is thread safe
+        return sqlite3.connect(self.path, timeout=30)
+
+    def version(self) -> int:
+        """Returns a counter that changes whenever activities are written."""
+        with closing(self._connect()) as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _write(self, statements) -> None:
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if statements(conn) is False:
+                    # nothing changed, so readers keep their cached views
+                    return
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+
+    def upsert_activities(self, activities: Iterable[dict]) -> None:
+        """Inserts activities, replacing existing ones with the same id."""
+        rows = [_to_row(activity) for activity in activities]
+
+        def statements(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO activities (id, start_date, type, data) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+        self._write(statements)
+        logger.info(f"upserted {len(rows)} activities into {self.path}")
+
+    def replace_activities(self, activities: Iterable[dict]) -> None:
+        """Replaces every stored activity in one transaction."""
+        rows = [_to_row(activity) for activity in activities]
+
+        def statements(conn):
+            conn.execute("DELETE FROM activities")
+            conn.executemany(
+                "INSERT INTO activities (id, start_date, type, data) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+        self._write(statements)
+        logger.info(f"replaced activities in {self.path} with {len(rows)} activities")
+
+    def update_activities(
+        self, activities: Iterable[dict]
+    ) -> tuple[Optional[str], list[dict]]:
+        """Makes the stored activities match the given ones in one
+        transaction, writing only the rows that were added or changed and
+        deleting the ones that are gone. Returns the earliest start date of
+        the activities added, changed or deleted, before and after the
+        change, None if none were, and the stored versions of the changed
+        activities."""
+        rows = {row[0]: row for row in map(_to_row, activities)}
+        changed: list[tuple] = []
+        deleted: list[tuple] = []
+        replaced: list[dict] = []
+        start_dates: list[str] = []
+
+        def statements(conn):
+            stored = {
+                activity_id: (start_date, data)
+                for activity_id, start_date, data in conn.execute(
+                    "SELECT id, start_date, data FROM activities"
+                )
+            }
+            for activity_id, row in rows.items():
+                start_date, data = stored.get(activity_id, (row[1], None))
+                if data != row[3]:
+                    changed.append(row)
+                    start_dates.extend([start_date, row[1]])
+                    if data is not None:
+                        replaced.append(json.loads(data))
+            for activity_id in stored.keys() - rows.keys():
+                deleted.append((activity_id,))
+                start_dates.append(stored[activity_id][0])
+            conn.executemany(
+                "INSERT OR REPLACE INTO activities (id, start_date, type, data) "
+                "VALUES (?, ?, ?, ?)",
+                changed,
+            )
+            conn.executemany("DELETE FROM activities WHERE id = ?", deleted)
+            return bool(changed or deleted)
+
+        self._write(statements)
+        logger.info(
+            f"upserted {len(changed)} and deleted {len(deleted)} activities "
+            f"in {self.path}"
+        )
+        return min(start_dates, default=None), replaced
+
+    def delete_activities(self, activity_ids: Iterable[int]) -> None:
+        """Deletes activities by id."""
+        ids = [(activity_id,) for activity_id in activity_ids]
+
+        def statements(conn):
+            conn.executemany("DELETE FROM activities WHERE id = ?", ids)
+
+        self._write(statements)
+
+    def query_activities(
+        self, activity_type: Optional[str] = None, year: Optional[int] = None
+    ) -> list[dict]:
+        """Returns the activities of a type and year, newest first, reading
+        only the matching rows through the indexes."""
+        clauses = []
+        params: list = []
+        if activity_type:
+            clauses.append("type = ?")
+            params.append(activity_type)
+        if year is not None:
+            # ISO dates sort lexicographically, so a year is an index range
+            clauses.append("start_date >= ? AND start_date < ?")
+            params.extend([f"{year:04d}", f"{year + 1:04d}"])
+
+        query = "SELECT data FROM activities"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY start_date DESC, id DESC"
+
+        with closing(self._connect()) as conn:
+            return [json.loads(data) for (data,) in conn.execute(query, params)]
+
+    def query_table(
+        self, activity_type: Optional[str] = None, year: Optional[int] = None
+    ) -> ActivityTable:
+        """Returns the activities of a type and year as a columnar table."""
+        return ActivityTable.from_activities(self.query_activities(activity_type, year))
+
+    def get_activity_days(self, activity_type: Optional[str] = None) -> np.ndarray:
+        """Returns the distinct days with activities of a type as days since
+        1970-01-01, read from the index without decoding any activity."""
+        query = "SELECT DISTINCT substr(start_date, 1, 10) FROM activities"
+        params: list = []
+        if activity_type:
+            query += " WHERE type = ?"
+            params.append(activity_type)
+        with closing(self._connect()) as conn:
+            days = [day for (day,) in conn.execute(query, params)]
+        return np.array(days, dtype="datetime64[D]").astype(np.int64)
+
+    def query_daily_distance(
+        self, activity_type: Optional[str] = None
+    ) -> ActivityTable:
+        """Returns a table with one row per day holding the summed distance
+        of the activities of a type, for the calendar aggregates. Only the
+        distance is extracted from the stored activities."""
+        query = (
+            "SELECT substr(start_date, 1, 10), "
+            "SUM(json_extract(data, '$.distance')) FROM activities"
+        )
+        params: list = []
+        if activity_type:
+            query += " WHERE type = ?"
+            params.append(activity_type)
+        query += " GROUP BY 1"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+        days = np.array([day for day, _ in rows], dtype="datetime64[D]")
+        return ActivityTable.from_columns(
+            distance=np.array([distance for _, distance in rows], dtype=np.float64),
+            moving_time=np.zeros(len(rows), dtype=np.int64),
+            elevation=np.zeros(len(rows)),
+            type=np.full(len(rows), activity_type or "", dtype=str),
+            days=days,
+        )
+
+    def get_years(self) -> list[int]:
+        """Returns the distinct years with activities."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT CAST(substr(start_date, 1, 4) AS INTEGER) "
+                "FROM activities"
+            )
+            return sorted(year for (year,) in rows)
+
+    def count(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+
+def _to_row(activity: dict) -> tuple:
+    return (
+        activity["id"],
+        activity["start_date"],
+        activity["type"],
+        json.dumps(activity),
+    )
+
+
+def import_json_activities(
+    json_path: str | pathlib.Path, db_path: str | pathlib.Path
+) -> ActivityDatabase:
+    """One-time import of an existing activities JSON file into the database."""
+    with open(json_path, "r") as f:
+        activities = json.load(f)
+
+    database = ActivityDatabase(db_path)
+    database.replace_activities(activities)
+    logger.info(
+        f"imported {len(activities)} activities from {json_path} into {db_path}"
+    )
+    return database
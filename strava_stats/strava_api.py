@@ -1,31 +1,75 @@
+import datetime
 import json
 import logging
 import os
 import pathlib
+from typing import Iterable, Iterator, Optional
 
-import requests
+import numpy as np
 from dotenv import load_dotenv
 
-AUTH_ENDPOINT: str = "https://www.strava.com/oauth/token"
-ACTIVITIES_ENDPOINT: str = "https://www.strava.com/api/v3/athlete/activities"
+from strava_stats.activity_table import ActivityTable
+from strava_stats.strava_client import (  # noqa: F401
+    MAX_PAGES,
+    PER_PAGE,
+    StravaAPIError,
+    StravaClient,
+)
 
 load_dotenv()
 
+# Overridable so the sync can be pointed at a local mock of the API
+STRAVA_BASE_URL: str = os.getenv("STRAVA_BASE_URL", "https://www.strava.com")
+AUTH_ENDPOINT: str = f"{STRAVA_BASE_URL}/oauth/token"
+API_ENDPOINT: str = f"{STRAVA_BASE_URL}/api/v3"
+ACTIVITIES_ENDPOINT: str = f"{API_ENDPOINT}/athlete/activities"
+
 logger = logging.getLogger(__name__)
 
 # Constants
-MAX_PAGES = 100  # Reasonable limit to prevent infinite loops
-PER_PAGE = 200  # Max allowed by Strava API
+# Re-request activities from slightly before the newest stored one, so late
+# uploads with an earlier start time are still picked up by incremental syncs
+SYNC_OVERLAP_SECONDS = 24 * 60 * 60
 
+# The summary activity fields the stats use, everything else (nested athlete
+# and gear objects, ...) can be dropped when loading or storing
+PROJECTED_FIELDS = (
+    "id",
+    "type",
+    "start_date",
+    "distance",
+    "moving_time",
+    "total_elevation_gain",
+)
+# the map with the summary polyline and the suffer score are only needed by
+# the sync, to rasterize routes and derive the training load, so they are
+# stored but not loaded
+STORED_FIELDS = (*PROJECTED_FIELDS, "map", "suffer_score")
+# The fields a single detailed activity has on top of the summary activities
+# of the activity list, dropped so it is stored like the others
+DETAILED_FIELDS = (
+    "segment_efforts",
+    "splits_metric",
+    "splits_standard",
+    "laps",
+    "best_efforts",
+    "photos",
+    "similar_activities",
+    "embed_token",
+    "available_zones",
+)
+STREAM_CHUNK_SIZE = 1 << 16
 
-class StravaAPIError(Exception):
-    """Custom exception for Strava API errors"""
+_client: Optional[StravaClient] = None
 
-    pass
 
+def get_client() -> StravaClient:
+    """Returns the process wide Strava client, so the connection pool and the
+    access token are reused across syncs"""
+    global _client
+    if _client is not None:
+        return _client
 
-def get_access_token() -> str:
-    """Gets an access token from the Strava API using refresh token"""
     client_id = os.getenv("STRAVA_CLIENT_ID")
     client_secret = os.getenv("STRAVA_CLIENT_SECRET")
     refresh_token = os.getenv("STRAVA_REFRESH_TOKEN")
@@ -37,83 +81,208 @@ def get_access_token() -> str:
             "STRAVA_CLIENT_SECRET, or STRAVA_REFRESH_TOKEN"
         )
 
-    payload = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "refresh_token": refresh_token,
-        "grant_type": "refresh_token",
-    }
+    _client = StravaClient(
+        client_id=client_id,
+        client_secret=client_secret,
+        refresh_token=refresh_token,
+        auth_endpoint=AUTH_ENDPOINT,
+        api_endpoint=API_ENDPOINT,
+        max_workers=int(os.getenv("STRAVA_MAX_WORKERS", "4")),
+    )
+    return _client
 
-    try:
-        response = requests.post(AUTH_ENDPOINT, data=payload)
-        response.raise_for_status()
-        json_response = response.json()
-        access_token = json_response["access_token"]
-        return access_token
-    except requests.exceptions.RequestException as e:
-        logger.exception("failed to get access token")
-        raise StravaAPIError("failed to authenticate with Strava") from e
-    except KeyError:
-        logger.exception("access token not found in response")
-        raise StravaAPIError("invalid response from Strava API - no access token")
-
-
-def get_activities(access_token: str, page: int = 1) -> list[dict]:
-    """Gets a page of activities from the Strava API"""
-    headers = {"Authorization": f"Bearer {access_token}"}
 
-    try:
-        response = requests.get(
-            ACTIVITIES_ENDPOINT,
-            headers=headers,
-            params={"page": page, "per_page": PER_PAGE},
-        )
-        response.raise_for_status()
-        json_response = response.json()
-        logger.info(f"retrieved {len(json_response)} activities from page {page}")
-        return json_response
-    except requests.exceptions.RequestException as e:
-        logger.exception(f"failed to get activities (page {page})")
-        raise StravaAPIError("failed to fetch activities") from e
+def get_access_token() -> str:
+    """Gets an access token from the Strava API using refresh token"""
+    return get_client().get_access_token()
 
 
-def save_strava_activities(path: str = "data/activities.json") -> list[dict]:
-    """Saves Strava activities to a JSON file and return the activities."""
-    logger.info("fetching strava activities...")
-    access_token = get_access_token()
-    activities_list = []
+def get_activities(page: int = 1, after: Optional[int] = None) -> list[dict]:
+    """Gets a page of activities from the Strava API, optionally only those
+    started after an epoch timestamp"""
+    return get_client().get_activities(page=page, after=after)
+
+
+def fetch_strava_activities(
+    after: Optional[int] = None, client: Optional[StravaClient] = None
+) -> list[dict]:
+    """Fetches all pages of activities, optionally only those started after
+    an epoch timestamp, with the given client or the env configured one"""
+    return (client or get_client()).fetch_activities(after=after)
 
-    # Fetch all pages of activities
-    for page in range(1, MAX_PAGES + 1):
-        activities = get_activities(access_token, page=page)
 
-        if not activities:
-            logger.info(f"no more activities found at page {page}")
-            break
+def get_latest_start_timestamp(activities: list[dict]) -> Optional[int]:
+    """Returns the epoch timestamp of the most recently started activity."""
+    if not activities:
+        return None
+    latest = max(activity["start_date"] for activity in activities)
+    return int(datetime.datetime.fromisoformat(latest).timestamp())
+
 
-        activities_list.extend(activities)
-        logger.info(f"fetched page {page}: {len(activities)} activities")
+def merge_strava_activities(
+    activities: list[dict], new_activities: list[dict]
+) -> list[dict]:
+    """Merges new activities into existing ones by id, newest first.
 
-        # If we got fewer than PER_PAGE results, we're on the last page
-        if len(activities) < PER_PAGE:
-            logger.info("reached last page of activities")
-            break
+    Activities already present are replaced by their newer version.
+    """
+    merged = {activity["id"]: activity for activity in activities}
+    for activity in new_activities:
+        merged[activity["id"]] = activity
+    return sorted(merged.values(), key=lambda a: a["start_date"], reverse=True)
 
+
+def write_json_atomic(
+    path: str | pathlib.Path, data, mode: Optional[int] = None
+) -> None:
+    """Writes JSON to a temporary file and renames it over the target, so
+    concurrent readers see either the old or the new file, never a torn one.
+    ``mode`` sets the file permissions before it becomes visible."""
+    file_path = pathlib.Path(path)
     # Ensure directory exists
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, file_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def write_npz_atomic(path: str | pathlib.Path, arrays: dict) -> None:
+    """Writes arrays to a compressed .npz file, replacing it atomically like
+    write_json_atomic."""
     file_path = pathlib.Path(path)
     file_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # Save to file using context manager
-    with open(file_path, "w") as f:
-        json.dump(activities_list, f)
+    tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def project_activity(activity: dict, fields=PROJECTED_FIELDS) -> dict:
+    """Returns only the given fields of an activity."""
+    return {field: activity[field] for field in fields if field in activity}
+
+
+def save_strava_activities(
+    path: str = "data/activities.json",
+    incremental: bool = False,
+    projection: bool = False,
+    client: Optional[StravaClient] = None,
+) -> list[dict]:
+    """Saves Strava activities to a JSON file and return the activities.
+
+    With ``incremental``, only activities started after the newest stored one
+    are fetched and merged into the file by id. Otherwise every activity is
+    refetched and the file is replaced, which also drops deleted activities.
+    With ``projection``, only the STORED_FIELDS of each activity are stored.
+    Activities are fetched with ``client``, the env configured one by default.
+    """
+    logger.info("fetching strava activities...")
+    file_path = pathlib.Path(path)
+
+    existing_activities = []
+    if incremental and file_path.exists():
+        with open(file_path, "r") as f:
+            existing_activities = json.load(f)
+
+    latest_timestamp = get_latest_start_timestamp(existing_activities)
+    if latest_timestamp is None:
+        logger.info("running full sync")
+        activities_list = fetch_strava_activities(client=client)
+    else:
+        after = latest_timestamp - SYNC_OVERLAP_SECONDS
+        logger.info(f"running incremental sync for activities after {after}")
+        new_activities = fetch_strava_activities(after=after, client=client)
+        activities_list = merge_strava_activities(existing_activities, new_activities)
+        logger.info(
+            f"merged {len(new_activities)} fetched activities, "
+            f"{len(activities_list) - len(existing_activities)} new"
+        )
+
+    if projection:
+        activities_list = [project_activity(a, STORED_FIELDS) for a in activities_list]
+
+    write_json_atomic(file_path, activities_list)
 
     logger.info(f"saved {len(activities_list)} activities to {path}")
     return activities_list
 
 
+def summary_activity(activity: dict) -> dict:
+    """Returns a detailed activity without the fields summary activities lack."""
+    summary = {
+        field: value
+        for field, value in activity.items()
+        if field not in DETAILED_FIELDS
+    }
+    if "map" in summary:
+        # the full resolution polyline, the summary polyline is kept
+        summary["map"] = {
+            key: value for key, value in summary["map"].items() if key != "polyline"
+        }
+    return summary
+
+
+def apply_strava_activity_changes(
+    path: str,
+    updated: list[dict],
+    deleted_ids: Iterable[int] = (),
+    projection: bool = False,
+) -> tuple[list[dict], list[dict]]:
+    """Applies single activity changes to the saved activities, e.g. pushed
+    by a webhook, and returns the activities and the replaced versions.
+
+    Updated activities are detailed activities fetched one by one, they are
+    stored as summary activities, or only their STORED_FIELDS with
+    ``projection``, and replace the saved versions with the same id.
+    """
+    file_path = pathlib.Path(path)
+    activities = []
+    if file_path.exists():
+        with open(file_path, "r") as f:
+            activities = json.load(f)
+
+    updated = [summary_activity(activity) for activity in updated]
+    if projection:
+        updated = [project_activity(a, STORED_FIELDS) for a in updated]
+    deleted_ids = set(deleted_ids)
+    removed_ids = deleted_ids | {activity["id"] for activity in updated}
+    replaced = [activity for activity in activities if activity["id"] in removed_ids]
+    activities = merge_strava_activities(
+        [activity for activity in activities if activity["id"] not in removed_ids],
+        updated,
+    )
+
+    write_json_atomic(file_path, activities)
+    logger.info(
+        f"applied {len(updated)} updated and {len(deleted_ids)} deleted "
+        f"activities to {path}"
+    )
+    return activities, replaced
+
+
+def resolve_activities_path(path: str = "data/activities.json") -> pathlib.Path:
+    """Resolves an activities path relative to the package directory."""
+    return pathlib.Path(__file__).parent / path
+
+
 def load_strava_activities(path: str = "data/activities.json") -> list[dict]:
     """Loads saved Strava activities from a JSON file."""
-    file_path = pathlib.Path(__file__).parent / path
+    file_path = resolve_activities_path(path)
 
     if not file_path.exists():
         raise FileNotFoundError(f"activities file not found at {file_path}")
@@ -127,3 +296,69 @@ def load_strava_activities(path: str = "data/activities.json") -> list[dict]:
 
     logger.info(f"loaded {len(activities)} activities from {path}")
     return activities
+
+
+def iter_strava_activities(
+    path: str | pathlib.Path, fields=PROJECTED_FIELDS
+) -> Iterator[dict]:
+    """Streams the activities of a JSON array file one at a time.
+
+    The file is parsed incrementally in chunks and each activity is reduced
+    to the projected ``fields`` (all fields if None) before the next is read,
+    so only one full activity is ever held in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buffer = f.read(STREAM_CHUNK_SIZE).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"expected a JSON array of activities in {path}")
+        position = 1
+        eof = False
+
+        while True:
+            # skip whitespace and separators between activities
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+
+            if position >= len(buffer):
+                raise ValueError(f"unterminated JSON array in {path}")
+            if buffer[position] == "]":
+                return
+
+            try:
+                activity, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # the activity spans the chunk boundary, read more
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+
+            yield activity if fields is None else project_activity(activity, fields)
+            position = end
+
+
+def load_activity_table(path: str = "data/activities.json") -> ActivityTable:
+    """Streams saved Strava activities from a JSON file into a compact
+    columnar table, without materializing them as dicts."""
+    file_path = resolve_activities_path(path)
+
+    if not file_path.exists():
+        raise FileNotFoundError(f"activities file not found at {file_path}")
+
+    table = ActivityTable.from_activities(iter_strava_activities(file_path))
+
+    if not len(table):
+        logger.warning(f"no activities found in {file_path}")
+        raise ValueError(f"no activities found in the JSON file at {path}")
+
+    logger.info(f"loaded {len(table)} activities from {path}")
+    return table
@@ -0,0 +1,393 @@
+import datetime
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from strava_stats.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MAX_PAGES = 100  # Reasonable limit to prevent infinite loops
+PER_PAGE = 200  # Max allowed by Strava API
+RATE_LIMIT_WINDOW_SECONDS = 15 * 60  # Strava's short limit resets every 15 minutes
+RATE_LIMIT_DAY_SECONDS = 24 * 60 * 60  # and the daily one at midnight UTC
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+
+
+class StravaAPIError(Exception):
+    """Custom exception for Strava API errors"""
+
+    pass
+
+
+class RateLimiter:
+    """Paces requests using the rate limit headers Strava sends with every
+    response.
+
+    Strava reports a 15 minute and a daily limit as ``X-RateLimit-Limit:
+    200,2000`` with the matching ``X-RateLimit-Usage``, and stricter read
+    limits as ``X-ReadRateLimit-*``. The short window resets at every quarter
+    hour and the daily one at midnight UTC. When the short window is nearly
+    used up requests block until it resets, when a response reported the
+    daily budget spent they fail until midnight.
+    """
+
+    HEADERS = (
+        ("X-RateLimit-Limit", "X-RateLimit-Usage"),
+        ("X-ReadRateLimit-Limit", "X-ReadRateLimit-Usage"),
+    )
+
+    def __init__(self, reserve: int = 2, clock=time.time, sleep=time.sleep):
+        self.reserve = reserve
+        self.clock = clock
+        self.sleep = sleep
+        self.waits = 0
+        # (short limit, daily limit, short usage, daily usage) per header pair
+        self._budgets: dict[str, list[int]] = {}
+        # headers whose usage is as reported, without requests counted since
+        self._reported: set[str] = set()
+        self._window_start = self._current_window()
+        self._day_start = self._current_day()
+        self._lock = threading.Lock()
+
+    def _current_window(self) -> float:
+        now = self.clock()
+        return now - now % RATE_LIMIT_WINDOW_SECONDS
+
+    def _current_day(self) -> float:
+        now = self.clock()
+        return now - now % RATE_LIMIT_DAY_SECONDS
+
+    def _reset_elapsed(self) -> None:
+        """Zeroes the usage of the windows that reset since the last call."""
+        window = self._current_window()
+        if window != self._window_start:
+            self._window_start = window
+            for budget in self._budgets.values():
+                budget[2] = 0
+        day = self._current_day()
+        if day != self._day_start:
+            self._day_start = day
+            for budget in self._budgets.values():
+                budget[3] = 0
+            self._reported.clear()
+
+    def update(self, headers) -> None:
+        """Records the limits and usage reported in a response."""
+        with self._lock:
+            self._reset_elapsed()
+            for limit_header, usage_header in self.HEADERS:
+                if limit_header not in headers or usage_header not in headers:
+                    continue
+                try:
+                    short_limit, daily_limit = map(
+                        int, headers[limit_header].split(",")
+                    )
+                    short_usage, daily_usage = map(
+                        int, headers[usage_header].split(",")
+                    )
+                except ValueError:
+                    logger.warning(f"unparseable {limit_header} header")
+                    continue
+                self._budgets[limit_header] = [
+                    short_limit,
+                    daily_limit,
+                    short_usage,
+                    daily_usage,
+                ]
+                self._reported.add(limit_header)
+
+    def _window_delay(self) -> Optional[float]:
+        """Returns the seconds until a request fits in the short windows,
+        None if it fits now, raising StravaAPIError when a response reported
+        the daily budget spent."""
+        self._reset_elapsed()
+        for limit_header, budget in self._budgets.items():
+            short_limit, daily_limit, short_usage, daily_usage = budget
+            if daily_usage >= daily_limit - self.reserve:
+                if limit_header in self._reported:
+                    raise StravaAPIError(
+                        f"daily Strava rate limit reached ({limit_header})"
+                    )
+                # the count includes requests whose responses never came, so
+                # let this one through to refresh it
+                logger.info(
+                    f"daily rate limit count is stale ({limit_header}), refreshing it"
+                )
+                continue
+            if short_usage >= short_limit - self.reserve:
+                delay = self._window_start + RATE_LIMIT_WINDOW_SECONDS - self.clock()
+                logger.info(
+                    f"rate limit window used up ({limit_header}), waiting {delay:.0f}s"
+                )
+                return max(delay, 0)
+        return None
+
+    def acquire(self) -> None:
+        """Blocks until a request fits in every rate limit window."""
+        with self._lock:
+            # every budget is checked again after waiting, responses recorded
+            # meanwhile may have used up the daily one
+            while (delay := self._window_delay()) is not None:
+                self.waits += 1
+                # wait without the lock, so other workers can record responses
+                self._lock.release()
+                try:
+                    self.sleep(delay)
+                finally:
+                    self._lock.acquire()
+
+            # count the request up front so concurrent workers don't overshoot
+            for budget in self._budgets.values():
+                budget[2] += 1
+                budget[3] += 1
+            self._reported.clear()
+
+
+class StravaClient:
+    """Strava API client with a pooled session, timeouts, retries with
+    exponential backoff on 429/5xx, rate limit pacing, a cached access token
+    and concurrent page fetching."""
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        refresh_token: str,
+        auth_endpoint: str,
+        api_endpoint: str,
+        max_workers: int = 4,
+        timeout: tuple[float, float] = (5, 30),
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        rate_limiter: Optional[RateLimiter] = None,
+        access_token: Optional[str] = None,
+        expires_at: int = 0,
+        on_token_refresh: Optional[Callable[[dict], None]] = None,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_token = refresh_token
+        self.auth_endpoint = auth_endpoint
+        self.api_endpoint = api_endpoint
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # called with the new tokens after every refresh, so they can be persisted
+        self.on_token_refresh = on_token_refresh
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._access_token = access_token
+        self._expires_at = expires_at
+        self._token_lock = threading.Lock()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> None:
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+            delay *= random.uniform(0.5, 1.0)
+        logger.info(f"retrying in {delay:.1f}s (attempt {attempt + 1})")
+        time.sleep(delay)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request, retrying connection errors, 429s and 5xx responses."""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, url, timeout=self.timeout, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.increment(
+                    "strava_api_requests_total",
+                    help="Strava API requests by response status",
+                    status="error",
+                )
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"{method} {url} failed", exc_info=True)
+                self._backoff(attempt)
+                continue
+
+            metrics.observe(
+                "strava_api_request_seconds",
+                time.perf_counter() - start,
+                help="Latency of Strava API requests",
+            )
+            metrics.increment(
+                "strava_api_requests_total",
+                help="Strava API requests by response status",
+                status=str(response.status_code),
+            )
+            self.rate_limiter.update(response.headers)
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if retryable and attempt < self.max_retries:
+                logger.warning(f"{method} {url} returned {response.status_code}")
+                self._backoff(attempt, response.headers.get("Retry-After"))
+                continue
+
+            response.raise_for_status()
+            return response
+
+        raise AssertionError("unreachable")
+
+    def get_access_token(self) -> str:
+        """Returns the cached access token, refreshing it once it expires."""
+        with self._token_lock:
+            if (
+                self._access_token
+                and self._expires_at - TOKEN_EXPIRY_MARGIN_SECONDS > time.time()
+            ):
+                return self._access_token
+
+            payload = {
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "refresh_token": self.refresh_token,
+                "grant_type": "refresh_token",
+            }
+
+            try:
+                response = self.request("POST", self.auth_endpoint, data=payload)
+                json_response = response.json()
+                access_token = json_response["access_token"]
+            except requests.exceptions.RequestException as e:
+                logger.exception("failed to get access token")
+                raise StravaAPIError("failed to authenticate with Strava") from e
+            except KeyError:
+                logger.exception("access token not found in response")
+                raise StravaAPIError(
+                    "invalid response from Strava API - no access token"
+                )
+
+            self._access_token = access_token
+            self._expires_at = json_response.get("expires_at", 0)
+            # Strava may rotate the refresh token
+            self.refresh_token = json_response.get("refresh_token", self.refresh_token)
+            expires = datetime.datetime.fromtimestamp(self._expires_at)
+            logger.info(f"refreshed access token, valid until {expires}")
+            if self.on_token_refresh is not None:
+                self.on_token_refresh(
+                    {
+                        "access_token": access_token,
+                        "refresh_token": self.refresh_token,
+                        "expires_at": self._expires_at,
+                    }
+                )
+            return access_token
+
+    def get(self, path: str, params: Optional[dict] = None):
+        """Gets an authenticated API resource and returns the parsed JSON."""
+        headers = {"Authorization": f"Bearer {self.get_access_token()}"}
+        response = self.request(
+            "GET", f"{self.api_endpoint}{path}", headers=headers, params=params
+        )
+        return response.json()
+
+    def get_activities(self, page: int = 1, after: Optional[int] = None) -> list[dict]:
+        """Gets a page of activities, optionally only those started after an
+        epoch timestamp"""
+        params = {"page": page, "per_page": PER_PAGE}
+        if after is not None:
+            params["after"] = after
+
+        try:
+            json_response = self.get("/athlete/activities", params=params)
+            logger.info(f"retrieved {len(json_response)} activities from page {page}")
+            return json_response
+        except requests.exceptions.RequestException as e:
+            logger.exception(f"failed to get activities (page {page})")
+            raise StravaAPIError("failed to fetch activities") from e
+
+    def get_activity(self, activity_id: int) -> Optional[dict]:
+        """Gets a single activity, None if it doesn't exist (anymore)"""
+        try:
+            return self.get(f"/activities/{activity_id}")
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            logger.exception(f"failed to get activity {activity_id}")
+            raise StravaAPIError("failed to fetch activity") from e
+        except requests.exceptions.RequestException as e:
+            logger.exception(f"failed to get activity {activity_id}")
+            raise StravaAPIError("failed to fetch activity") from e
+
+    def get_activity_streams(self, activity_id: int, keys: list[str]) -> Optional[dict]:
+        """Gets the streams of an activity keyed by type, None if it has none,
+        e.g. because it was entered manually"""
+        try:
+            return self.get(
+                f"/activities/{activity_id}/streams",
+                params={"keys": ",".join(keys), "key_by_type": "true"},
+            )
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            logger.exception(f"failed to get streams of activity {activity_id}")
+            raise StravaAPIError("failed to fetch activity streams") from e
+        except requests.exceptions.RequestException as e:
+            logger.exception(f"failed to get streams of activity {activity_id}")
+            raise StravaAPIError("failed to fetch activity streams") from e
+
+    def fetch_activities(self, after: Optional[int] = None) -> list[dict]:
+        """Fetches all pages of activities with up to max_workers pages in
+        flight, stopping at the first page shorter than PER_PAGE."""
+        pages: dict[int, list[dict]] = {}
+        last_page: Optional[int] = None
+        next_page = 1
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            while True:
+                # fetch the first page alone, most incremental syncs fit in it
+                in_flight = self.max_workers if pages else 1
+                while (
+                    len(futures) < in_flight
+                    and next_page <= MAX_PAGES
+                    and last_page is None
+                ):
+                    future = executor.submit(self.get_activities, next_page, after)
+                    futures[future] = next_page
+                    next_page += 1
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = futures.pop(future)
+                    activities = future.result()
+                    pages[page] = activities
+                    metrics.increment(
+                        "strava_pages_fetched_total",
+                        help="Pages of activities fetched from Strava",
+                    )
+                    logger.info(f"fetched page {page}: {len(activities)} activities")
+                    # If we got fewer than PER_PAGE results, we're on the last page
+                    if len(activities) < PER_PAGE:
+                        last_page = page if last_page is None else min(last_page, page)
+
+        if last_page is not None:
+            logger.info(f"reached last page of activities at page {last_page}")
+        return [
+            activity
+            for page in sorted(pages)
+            if last_page is None or page <= last_page
+            for activity in pages[page]
+        ]
@@ -1,33 +1,105 @@
 import calendar
 import datetime
-from collections import defaultdict
-from typing import Optional
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
 
 import numpy as np
-import pandas as pd
 
+from strava_stats.activity_table import ActivityTable, as_activity_table
+
+# pandas is imported by the functions building plot data, it's only
+# needed once a figure is rendered and slow to import
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+MONTHS = [
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+]
+
+# Ride length bins: 0-10, 10-20, ..., 90-100, 100+
+DISTANCE_BIN_EDGES = list(range(0, 101, 10)) + [float("inf")]
+DISTANCE_BIN_LABELS = [f"{i}-{i + 10}" for i in range(0, 100, 10)] + ["100+"]
+
+# Year selection value for the lifetime view across all years
+ALL_YEARS = "all"
+
+# First column of every month in a 366 day calendar, so the same day of
+# different years lines up in the stacked multi-year heatmap
+CALENDAR_MONTH_OFFSETS = np.cumsum(
+    [0] + [calendar.monthrange(2000, m)[1] for m in range(1, 12)]
+)
+CALENDAR_DAYS = 366
+CALENDAR_FEB_29 = CALENDAR_MONTH_OFFSETS[1] + 28
+
+
+@dataclass(frozen=True)
+class ActivitySummary:
+    """Every stat card value for a set of activities."""
+
+    total_distance: float  # kilometers
+    moving_time: int  # seconds
+    elevation: float  # meters
+    num_rides: int
+    ride_days: int
+    biggest_ride: float  # meters
+    longest_ride: int  # seconds
+    current_streak: int  # days
+    longest_streak: int = 0  # days
 
-def get_strava_activities_years(activities: list[dict]) -> list[int]:
-    years = set()
-    for activity in activities:
-        date = activity["start_date"].split("T")[0]
-        parsed_year = int(date.split("-")[0])
-        years.add(parsed_year)
 
-    return list(years)
+@dataclass(frozen=True)
+class YearPace:
+    """The distance of a year against the year before, up to the same day."""
+
+    year: int
+    distance: float  # kilometers
+    previous_distance: float  # kilometers of the year before
+    projected_distance: float  # kilometers at the end of the year at this pace
+
+
+def current_year() -> int:
+    return datetime.date.today().year
+
+
+def get_strava_activities_years(activities: list[dict] | ActivityTable) -> list[int]:
+    table = as_activity_table(activities)
+    return np.unique(table.year).tolist()
 
 
 def filter_strava_activities(
-    activities: list[dict], activity_type: Optional[str], year: Optional[int] = None
-) -> list[dict]:
-    if not year:
+    activities: list[dict] | ActivityTable,
+    activity_type: Optional[str],
+    year: Optional[int | range | str] = None,
+) -> list[dict] | ActivityTable:
+    """Filters activities by type and by a year, a range of years or
+    ALL_YEARS. Defaults to the current year."""
+    if year == ALL_YEARS:
+        year = None
+    elif not year:
         year = datetime.datetime.now().year
+    if year is not None and not isinstance(year, range):
+        year = range(year, year + 1)
+
+    if isinstance(activities, ActivityTable):
+        return activities.filter(activity_type=activity_type, year=year)
 
     filtered_activities = []
     for activity in activities:
         date = activity["start_date"].split("T")[0]
         parsed_year = int(date.split("-")[0])
-        if parsed_year != year:
+        if year is not None and parsed_year not in year:
             continue
         if activity_type and activity_type != activity["type"]:
             continue
@@ -36,139 +108,209 @@ def filter_strava_activities(
     return filtered_activities
 
 
-def generate_km_per_day_heatmap_data(activities: list[dict]):
-    """Generates heatmap data for kilometers per day."""
+def summarize_activities(
+    activities: list[dict] | ActivityTable, from_date: Optional[datetime.date] = None
+) -> ActivitySummary:
+    """Calculates every stat card value in a single vectorized pass."""
+    table = as_activity_table(activities)
+    if not len(table):
+        return ActivitySummary(0.0, 0, 0.0, 0, 0, 0.0, 0, 0)
+
+    day_index = table.day_index()
+    return ActivitySummary(
+        total_distance=float(table.distance.sum() / 1000),
+        moving_time=int(table.moving_time.sum()),
+        elevation=float(table.elevation.sum()),
+        num_rides=len(table),
+        ride_days=len(day_index),
+        biggest_ride=float(table.distance.max()),
+        longest_ride=int(table.moving_time.max()),
+        current_streak=day_index.current_streak(from_date),
+        longest_streak=day_index.longest_streak(),
+    )
 
-    heatmap_arr = np.zeros((12, 31))
-    year = None
-    for activity in activities:
-        date = activity["start_date"].split("T")[0]
 
-        parsed_distance = activity["distance"] / 1000
-        parsed_month = int(date.split("-")[1]) - 1
-        parsed_day = int(date.split("-")[2])
-        # set year initially
-        if not year:
-            parsed_year = int(date.split("-")[0]) - 1
-            year = parsed_year
-        heatmap_arr[parsed_month, parsed_day - 1] += parsed_distance
+def generate_km_per_day_heatmap_data(
+    activities: list[dict] | ActivityTable, year: Optional[int] = None
+):
+    """Generates heatmap data for kilometers per day of a year, defaulting
+    to the year of the first activity."""
+    table = as_activity_table(activities)
+
+    heatmap_arr = np.zeros((12, 31))
+    np.add.at(
+        heatmap_arr, (table.month - 1, table.day_of_month - 1), table.distance / 1000
+    )
 
+    if year is None and len(table):
+        year = int(table.year[0])
     # Mask invalid days with NaN for the year
-    if year:
-        for month in range(12):
-            days_in_month = calendar.monthrange(year, month + 1)[1]
-            heatmap_arr[month, days_in_month:] = np.nan
+    if year is not None:
+        mask_invalid_days(heatmap_arr, year)
 
     return heatmap_arr
 
 
-def calculate_total_distance(activities: list[dict]):
+def calendar_years(
+    activities: list[dict] | ActivityTable, years: Optional[range] = None
+) -> range:
+    """Returns the given range of years, or every year from the first to the
+    last activity."""
+    if years is not None:
+        return years
+    table = as_activity_table(activities)
+    if not len(table):
+        return range(datetime.datetime.now().year, datetime.datetime.now().year + 1)
+    return range(int(table.year.min()), int(table.year.max()) + 1)
+
+
+def generate_km_per_day_by_year_heatmap_data(
+    activities: list[dict] | ActivityTable, years: Optional[range] = None
+) -> np.ndarray:
+    """Generates a years x 366 calendar of kilometers per day in one grouped
+    pass, with Feb 29 masked in non-leap years."""
+    table = as_activity_table(activities)
+    years = calendar_years(table, years)
+
+    calendar_arr = np.zeros((len(years), CALENDAR_DAYS))
+    in_range = (table.year >= years.start) & (table.year < years.stop)
+    np.add.at(
+        calendar_arr,
+        (
+            table.year[in_range] - years.start,
+            CALENDAR_MONTH_OFFSETS[table.month[in_range] - 1]
+            + table.day_of_month[in_range]
+            - 1,
+        ),
+        table.distance[in_range] / 1000,
+    )
+
+    return mask_invalid_calendar_days(calendar_arr, years)
+
+
+def mask_invalid_calendar_days(calendar_arr: np.ndarray, years: range) -> np.ndarray:
+    """Masks Feb 29 with NaN in the rows of non-leap years of a calendar."""
+    leap = np.array([calendar.isleap(year) for year in years], dtype=bool)
+    calendar_arr[~leap, CALENDAR_FEB_29] = np.nan
+    return calendar_arr
+
+
+def calendar_day(day: datetime.date) -> int:
+    """Returns the column of a date in a 366 day calendar."""
+    return int(CALENDAR_MONTH_OFFSETS[day.month - 1]) + day.day - 1
+
+
+def cumulative_distance_by_year(calendar_arr: np.ndarray) -> np.ndarray:
+    """Returns the running distance of every year of a years x 366 calendar
+    by day of the year, one cumulative sum over all years. Feb 29 of
+    non-leap years carries the distance of Feb 28."""
+    return np.nancumsum(calendar_arr, axis=1)
+
+
+def year_pace(
+    years: range,
+    cumulative: np.ndarray,
+    year: int,
+    from_date: Optional[datetime.date] = None,
+) -> YearPace:
+    """Compares the distance of a year up to today, or the whole year for
+    past years, with the year before up to the same day."""
+    if not from_date:
+        from_date = datetime.datetime.now().date()
+    day = calendar_day(from_date) if year == from_date.year else CALENDAR_DAYS - 1
+
+    def distance_until(year: int) -> float:
+        return float(cumulative[year - years.start, day]) if year in years else 0.0
+
+    distance = distance_until(year)
+    projected_distance = distance
+    if year == from_date.year:
+        days_in_year = 366 if calendar.isleap(year) else 365
+        projected_distance = distance / from_date.timetuple().tm_yday * days_in_year
+    return YearPace(year, distance, distance_until(year - 1), projected_distance)
+
+
+def mask_invalid_days(heatmap_arr: np.ndarray, year: int) -> np.ndarray:
+    """Masks the days that don't exist in a year with NaN in a 12x31 heatmap."""
+    for month in range(12):
+        days_in_month = calendar.monthrange(year, month + 1)[1]
+        heatmap_arr[month, days_in_month:] = np.nan
+    return heatmap_arr
+
+
+def calculate_total_distance(activities: list[dict] | ActivityTable):
     """Calculates total distance in kilometers."""
-    distance_sum = 0
-    for activity in activities:
-        parsed_distance = activity["distance"] / 1000
-        distance_sum += parsed_distance
-    return distance_sum
+    return float(as_activity_table(activities).distance.sum() / 1000)
 
 
 def calculate_streak_from_date(
-    activities: list[dict], from_date: Optional[datetime.date] = None
+    activities: list[dict] | ActivityTable, from_date: Optional[datetime.date] = None
 ):
     """Calculates the streak of consecutive days with activities from a given date."""
-    if not from_date:
-        from_date = datetime.datetime.now().date()
+    return as_activity_table(activities).day_index().current_streak(from_date)
 
-    streak = 0
-    parsed_dates_dict = defaultdict(bool)
 
-    for activity in activities:
-        date = activity["start_date"].split("T")[0]
-        parsed_date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
-        if parsed_date > from_date:
-            continue
-        parsed_dates_dict[date] = True
+def calculate_longest_streak(activities: list[dict] | ActivityTable):
+    """Calculates the longest streak of consecutive days with activities."""
+    return as_activity_table(activities).day_index().longest_streak()
+
 
-    while True:
-        if parsed_dates_dict[from_date.strftime("%Y-%m-%d")]:
-            streak += 1
-        else:
-            break
-        from_date -= datetime.timedelta(days=1)
-    return streak
+def calculate_longest_streak_per_year(activities: list[dict] | ActivityTable):
+    """Calculates the longest streak of every year."""
+    return as_activity_table(activities).day_index().longest_streak_per_year()
 
 
-def calculate_num_rides(activities: list[dict]):
+def calculate_streak_history(activities: list[dict] | ActivityTable):
+    """Calculates the first day and length of every streak, oldest first."""
+    starts, lengths = as_activity_table(activities).day_index().runs()
+    return [
+        (np.datetime64(int(start), "D").astype(datetime.date), int(length))
+        for start, length in zip(starts, lengths)
+    ]
+
+
+def calculate_num_rides(activities: list[dict] | ActivityTable):
     """Calculates the number of rides."""
     return len(activities)
 
 
-def calculate_biggest_ride(activities: list[dict]):
+def calculate_biggest_ride(activities: list[dict] | ActivityTable):
     """Calculates the biggest ride"""
-
-    biggest_ride_distance = 0
-    for activity in activities:
-        biggest_ride_distance = max(biggest_ride_distance, activity["distance"])
-
-    return biggest_ride_distance
+    return float(as_activity_table(activities).distance.max(initial=0))
 
 
-def calculate_longest_ride(activities: list[dict]):
+def calculate_longest_ride(activities: list[dict] | ActivityTable):
     """Calculates the longest ride."""
-    longest_ride = 0
-    for activity in activities:
-        longest_ride = max(longest_ride, activity["moving_time"])
-    return longest_ride
+    return int(as_activity_table(activities).moving_time.max(initial=0))
 
 
-def calculate_moving_time(activities: list[dict]):
+def calculate_moving_time(activities: list[dict] | ActivityTable):
     """Calculates the moving time."""
+    return int(as_activity_table(activities).moving_time.sum())
 
-    moving_time = 0
-    for activity in activities:
-        parsed_moving_time = activity["moving_time"]
-        moving_time += parsed_moving_time
-    return moving_time
-
-
-def calculate_elevation(activities: list[dict]):
-    elevation = 0
-    for activity in activities:
-        parsed_elevation = activity["total_elevation_gain"]
-        elevation += parsed_elevation
-    return elevation
 
+def calculate_elevation(activities: list[dict] | ActivityTable):
+    return float(as_activity_table(activities).elevation.sum())
 
-def calculate_ride_days(activities: list[dict]):
-    parsed_dates_dict = {}
 
-    for activity in activities:
-        date = activity["start_date"].split("T")[0]
-        parsed_dates_dict[date] = True
-    return len(parsed_dates_dict.keys())
+def calculate_ride_days(activities: list[dict] | ActivityTable):
+    return len(as_activity_table(activities).day_index())
 
 
-def generate_ride_length_binned_data(activities: list[dict]):
+def generate_ride_length_binned_data(activities: list[dict] | ActivityTable):
     """Generates binned ride length counts for bar plotting."""
+    import pandas as pd
 
     # Extract distances in km for the specified year
-    distance_list = []
-    for activity in activities:
-        distance_km = activity["distance"] / 1000
-        distance_list.append(distance_km)
-
-    # Create bins: 0-10, 10-20, ..., 90-100, 100+
-    bins_edges = list(range(0, 101, 10)) + [float("inf")]
-    bin_labels = [f"{i}-{i + 10}" for i in range(0, 100, 10)] + ["100+"]
+    distance_list = as_activity_table(activities).distance / 1000
 
-    if not distance_list:
-        return pd.DataFrame(
-            {"Distance Bin": bin_labels, "Count": [0] * len(bin_labels)}
-        )
+    if not len(distance_list):
+        return ride_length_binned_frame([0] * len(DISTANCE_BIN_LABELS))
 
     binned = pd.cut(
         distance_list,
-        bins=bins_edges,
-        labels=bin_labels,
+        bins=DISTANCE_BIN_EDGES,
+        labels=DISTANCE_BIN_LABELS,
         right=False,
         include_lowest=True,
     )
@@ -179,33 +321,78 @@ def generate_ride_length_binned_data(activities: list[dict]):
     return df
 
 
-def generate_monthly_distance_binned_data(activities: list[dict]):
+def ride_length_binned_frame(counts) -> "pd.DataFrame":
+    """Builds the ride length plot data from precomputed bin counts."""
+    import pandas as pd
+
+    return pd.DataFrame({"Distance Bin": DISTANCE_BIN_LABELS, "Count": counts})
+
+
+def generate_monthly_distance_binned_data(activities: list[dict] | ActivityTable):
     """Generates binned montly distance counts for bar plotting."""
+    table = as_activity_table(activities)
 
-    distance_bins = [0] * 12
-    for activity in activities:
-        date = activity["start_date"].split("T")[0]
-        parsed_month = int(date.split("-")[1])
-        distance_bins[parsed_month - 1] += activity["distance"] / 1000
+    distance_bins = np.bincount(
+        table.month - 1, weights=table.distance / 1000, minlength=12
+    )
+
+    return monthly_distance_frame(distance_bins)
+
+
+def monthly_distance_frame(distance_bins) -> "pd.DataFrame":
+    """Builds the monthly distance plot data from precomputed monthly totals."""
+    import pandas as pd
+
+    return pd.DataFrame({"Distance Bin": distance_bins, "Months": MONTHS})
+
+
+def generate_monthly_distance_by_year_data(
+    activities: list[dict] | ActivityTable, years: Optional[range] = None
+):
+    """Generates the monthly distance of every year in one grouped pass."""
+    table = as_activity_table(activities)
+    years = calendar_years(table, years)
+
+    in_range = (table.year >= years.start) & (table.year < years.stop)
+    distance_bins = np.bincount(
+        (table.year[in_range] - years.start) * 12 + table.month[in_range] - 1,
+        weights=table.distance[in_range] / 1000,
+        minlength=len(years) * 12,
+    )
 
-    df = pd.DataFrame(
+    return monthly_distance_by_year_frame(years, distance_bins.reshape(-1, 12))
+
+
+def monthly_distance_by_year_frame(years: range, distance_bins) -> "pd.DataFrame":
+    """Builds the per-year monthly distance plot data from a years x 12
+    array of monthly totals."""
+    import pandas as pd
+
+    return pd.DataFrame(
         {
-            "Distance Bin": distance_bins,
-            "Months": [
-                "Jan",
-                "Feb",
-                "Mar",
-                "Apr",
-                "May",
-                "Jun",
-                "Jul",
-                "Aug",
-                "Sep",
-                "Oct",
-                "Nov",
-                "Dec",
-            ],
+            "Year": np.repeat([str(year) for year in years], 12),
+            "Months": MONTHS * len(years),
+            "Distance Bin": np.asarray(distance_bins, dtype=np.float64).ravel(),
         }
     )
 
-    return df
+
+def cumulative_distance_frame(
+    years: range, cumulative: np.ndarray, from_date: Optional[datetime.date] = None
+) -> "pd.DataFrame":
+    """Builds the cumulative distance plot data of a years x 366 array, one
+    line per year ending today."""
+    import pandas as pd
+
+    if not from_date:
+        from_date = datetime.datetime.now().date()
+    cumulative = np.array(cumulative, dtype=np.float64)
+    if from_date.year in years:
+        cumulative[from_date.year - years.start, calendar_day(from_date) + 1 :] = np.nan
+    return pd.DataFrame(
+        {
+            "Day": np.tile(np.arange(CALENDAR_DAYS), len(years)),
+            "Distance": cumulative.ravel(),
+            "Year": np.repeat([str(year) for year in years], CALENDAR_DAYS),
+        }
+    )
@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import pathlib
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from strava_stats.metrics import metrics
+from strava_stats.strava_api import resolve_activities_path
+from strava_stats.strava_client import StravaClient
+
+logger = logging.getLogger(__name__)
+
+STREAMS_FORMAT_VERSION = 1
+# dtype and per-sample shape of every stored channel, missing float channels
+# are stored as NaN so all channels of an activity share one offset and length
+STREAM_CHANNELS: dict[str, tuple[np.dtype, tuple[int, ...]]] = {
+    "time": (np.dtype("<i4"), ()),
+    "distance": (np.dtype("<f4"), ()),
+    "altitude": (np.dtype("<f4"), ()),
+    "heartrate": (np.dtype("<f4"), ()),
+    "watts": (np.dtype("<f4"), ()),
+    "cadence": (np.dtype("<f4"), ()),
+    "latlng": (np.dtype("<f8"), (2,)),
+}
+# where each activity's samples start in the channel files, activities
+# without streams are recorded with length 0 so they aren't fetched again
+INDEX_DTYPE = np.dtype([("activity_id", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+INDEX_FILENAME = "index.bin"
+META_FILENAME = "meta.json"
+# activities fetched between fsyncs, the most a crash can make us refetch
+CHECKPOINT_EVERY = 50
+
+
+def streams_to_arrays(streams: Optional[dict]) -> dict[str, np.ndarray]:
+    """Converts a key_by_type streams response to one array per channel, all
+    of the same length."""
+    streams = streams or {}
+    length = max((len(stream["data"]) for stream in streams.values()), default=0)
+    arrays = {}
+    for channel, (dtype, shape) in STREAM_CHANNELS.items():
+        data = streams.get(channel, {}).get("data")
+        if data is not None and len(data) == length:
+            # numpy turns the nulls of dropped samples into NaN
+            arrays[channel] = np.asarray(
+                data, dtype=np.float64 if dtype.kind == "i" else dtype
+            ).astype(dtype)
+        elif channel == "time":
+            # streams are sampled every second when Strava doesn't say
+            arrays[channel] = np.arange(length, dtype=dtype)
+        else:
+            arrays[channel] = np.full((length, *shape), np.nan, dtype=dtype)
+    return arrays
+
+
+class StreamStore:
+    """Activity streams stored column-wise on disk, one contiguous file per
+    channel and an index of where each activity's samples start.
+
+    Reads memory-map the files, so any subset of activities and channels can
+    be analyzed without loading the rest. Appends come from a single writer
+    and become visible to readers once their index entry is written, so an
+    interrupted write is rolled back by ``recover``.
+    """
+
+    def __init__(self, path: str = "data/streams"):
+        self.path = path
+        self.directory = resolve_activities_path(path)
+
+        self._lock = threading.Lock()
+        self._index: Optional[np.ndarray] = None
+        self._positions: Optional[dict[int, int]] = None
+        self._maps: dict[str, np.ndarray] = {}
+        self._files: dict[str, object] = {}
+        self._unsynced = 0
+
+    def _channel_path(self, channel: str) -> pathlib.Path:
+        return self.directory / f"{channel}.bin"
+
+    def _read_index(self) -> np.ndarray:
+        index_path = self.directory / INDEX_FILENAME
+        if not index_path.exists():
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        data = index_path.read_bytes()
+        # a torn trailing entry is ignored, recover() truncates it
+        complete = len(data) - len(data) % INDEX_DTYPE.itemsize
+        return np.frombuffer(data[:complete], dtype=INDEX_DTYPE).copy()
+
+    def refresh(self) -> None:
+        """Re-reads the index, to see streams appended by another process."""
+        with self._lock:
+            self._index = None
+            self._positions = None
+            self._maps.clear()
+
+    @property
+    def index(self) -> np.ndarray:
+        with self._lock:
+            if self._index is None:
+                self._index = self._read_index()
+                self._positions = None
+            return self._index
+
+    def _get_positions(self) -> dict[int, int]:
+        index = self.index
+        with self._lock:
+            if self._positions is None:
+                self._positions = {
+                    int(activity_id): i
+                    for i, activity_id in enumerate(index["activity_id"])
+                }
+            return self._positions
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, activity_id: int) -> bool:
+        return int(activity_id) in self._get_positions()
+
+    def activity_ids(self) -> np.ndarray:
+        """Returns the ids of the activities with stored streams."""
+        index = self.index
+        return index["activity_id"][index["length"] > 0]
+
+    def channel(self, name: str) -> np.ndarray:
+        """Returns the samples of a channel for every activity, memory-mapped."""
+        dtype, shape = STREAM_CHANNELS[name]
+        index = self.index
+        end = int((index["offset"] + index["length"]).max()) if len(index) else 0
+        with self._lock:
+            mapped = self._maps.get(name)
+            if mapped is None or len(mapped) < end:
+                if end == 0:
+                    mapped = np.zeros((0, *shape), dtype=dtype)
+                else:
+                    mapped = np.memmap(
+                        self._channel_path(name),
+                        dtype=dtype,
+                        mode="r",
+                        shape=(end, *shape),
+                    )
+                self._maps[name] = mapped
+            return mapped[:end]
+
+    def get(
+        self, activity_id: int, channels: Optional[Iterable[str]] = None
+    ) -> Optional[dict[str, np.ndarray]]:
+        """Returns views of the stored channels of an activity, None if its
+        streams weren't fetched yet. Activities without streams have empty
+        channels."""
+        position = self._get_positions().get(int(activity_id))
+        if position is None:
+            return None
+        entry = self.index[position]
+        start, stop = int(entry["offset"]), int(entry["offset"] + entry["length"])
+        return {
+            channel: self.channel(channel)[start:stop]
+            for channel in (channels or STREAM_CHANNELS)
+        }
+
+    def iter_activities(
+        self,
+        activity_ids: Optional[Iterable[int]] = None,
+        channels: Optional[Iterable[str]] = None,
+    ) -> Iterator[tuple[int, dict[str, np.ndarray]]]:
+        """Yields (activity id, channels) for the given or all activities with
+        streams, reading only the requested channels."""
+        channels = list(channels or STREAM_CHANNELS)
+        if activity_ids is None:
+            activity_ids = self.activity_ids()
+        for activity_id in activity_ids:
+            streams = self.get(activity_id, channels)
+            if streams is not None and len(streams[channels[0]]):
+                yield int(activity_id), streams
+
+    def _open_for_append(self) -> None:
+        if self._files:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta_path = self.directory / META_FILENAME
+        if meta_path.exists():
+            with open(meta_path, "r") as f:
+                if json.load(f).get("format") != STREAMS_FORMAT_VERSION:
+                    raise ValueError(f"unsupported streams format in {self.path}")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump(
+                    {
+                        "format": STREAMS_FORMAT_VERSION,
+                        "channels": {
+                            channel: [dtype.str, list(shape)]
+                            for channel, (dtype, shape) in STREAM_CHANNELS.items()
+                        },
+                    },
+                    f,
+                )
+        self.recover()
+        for channel in STREAM_CHANNELS:
+            self._files[channel] = open(self._channel_path(channel), "ab")
+        self._files[INDEX_FILENAME] = open(self.directory / INDEX_FILENAME, "ab")
+
+    def recover(self) -> None:
+        """Rolls back a write interrupted by a crash, truncating every file to
+        the last complete index entry whose samples were all written."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index_path = self.directory / INDEX_FILENAME
+        index = self._read_index()
+        channel_samples = {}
+        for channel, (dtype, shape) in STREAM_CHANNELS.items():
+            path = self._channel_path(channel)
+            size = path.stat().st_size if path.exists() else 0
+            channel_samples[channel] = size // (dtype.itemsize * int(np.prod(shape)))
+
+        ends = index["offset"] + index["length"]
+        complete = len(index)
+        while complete and ends[complete - 1] > min(channel_samples.values()):
+            complete -= 1
+        end = int(ends[complete - 1]) if complete else 0
+
+        if (
+            index_path.exists()
+            and index_path.stat().st_size != complete * INDEX_DTYPE.itemsize
+        ):
+            logger.warning(
+                f"rolling back {len(index) - complete} incomplete stream entries in {self.path}"
+            )
+            os.truncate(index_path, complete * INDEX_DTYPE.itemsize)
+        for channel, (dtype, shape) in STREAM_CHANNELS.items():
+            path = self._channel_path(channel)
+            size = end * dtype.itemsize * int(np.prod(shape))
+            if path.exists() and path.stat().st_size != size:
+                os.truncate(path, size)
+        self.refresh()
+
+    def append(self, activity_id: int, streams: Optional[dict]) -> None:
+        """Appends the streams response of an activity, None for activities
+        without streams."""
+        arrays = streams_to_arrays(streams)
+        self._open_for_append()
+        index = self.index
+        offset = int((index["offset"] + index["length"]).max()) if len(index) else 0
+        length = len(arrays["time"])
+        for channel, array in arrays.items():
+            self._files[channel].write(np.ascontiguousarray(array).tobytes())
+            self._files[channel].flush()
+        # the index entry is written last, it commits the samples above
+        entry = np.array([(activity_id, offset, length)], dtype=INDEX_DTYPE)
+        self._files[INDEX_FILENAME].write(entry.tobytes())
+        self._files[INDEX_FILENAME].flush()
+
+        with self._lock:
+            self._index = np.concatenate([index, entry])
+            if self._positions is not None:
+                self._positions[int(activity_id)] = len(self._index) - 1
+        self._unsynced += 1
+        if self._unsynced >= CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """Flushes the appended streams to disk, so a crash can't lose them."""
+        for name, f in self._files.items():
+            if name != INDEX_FILENAME:
+                os.fsync(f.fileno())
+        if INDEX_FILENAME in self._files:
+            os.fsync(self._files[INDEX_FILENAME].fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        if self._files:
+            self.checkpoint()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def nbytes(self) -> int:
+        """Returns the size of the stored streams on disk."""
+        return sum(path.stat().st_size for path in self.directory.glob("*.bin"))
+
+
+def backfill_streams(
+    client: StravaClient,
+    activity_ids: Iterable[int],
+    store: StreamStore,
+    max_workers: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> int:
+    """Fetches the streams of the activities not in the store yet, with up to
+    max_workers requests in flight (by default as many as the client pools
+    connections for), and returns how many were stored.
+
+    The client paces the requests with its rate limiter. Each stored activity
+    is flushed to the OS, so a backfill that is interrupted or crashes
+    resumes after the last one it stored. The files are only fsynced every
+    CHECKPOINT_EVERY activities, so a power loss can roll back up to that
+    many, which ``recover`` truncates to and the next backfill fetches again.
+    """
+    pending = [activity_id for activity_id in activity_ids if activity_id not in store]
+    if limit is not None:
+        pending = pending[:limit]
+    logger.info(f"fetching streams of {len(pending)} activities")
+
+    keys = list(STREAM_CHANNELS)
+    max_workers = max_workers or client.max_workers
+    stored = 0
+    remaining = iter(pending)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            while True:
+                while len(futures) < max_workers:
+                    activity_id = next(remaining, None)
+                    if activity_id is None:
+                        break
+                    future = executor.submit(
+                        client.get_activity_streams, activity_id, keys
+                    )
+                    futures[future] = activity_id
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    activity_id = futures.pop(future)
+                    try:
+                        streams = future.result()
+                    except Exception:
+                        # stop submitting, what's stored so far is kept
+                        for other in futures:
+                            other.cancel()
+                        raise
+                    store.append(activity_id, streams)
+                    stored += 1
+                    metrics.increment(
+                        "strava_streams_fetched_total",
+                        help="Activity streams fetched from Strava",
+                    )
+                    if stored % CHECKPOINT_EVERY == 0:
+                        logger.info(
+                            f"stored streams of {stored}/{len(pending)} activities"
+                        )
+    finally:
+        store.close()
+    logger.info(f"stored streams of {stored} activities in {store.path}")
+    return stored
@@ -1,9 +1,14 @@
 import plotly.express as px
+import plotly.graph_objects as go
 import plotly.io as pio
 
+# The templates are built from copies of the built-in ones and passed to each
+# figure, never registered as pio.templates.default, so concurrent requests
+# can't affect each other's figures
 
-def load_reds_template():
-    reds_template = pio.templates["plotly_white"]
+
+def load_reds_template() -> go.layout.Template:
+    reds_template = go.layout.Template(pio.templates["plotly_white"])
     reds_template.layout.colorway = px.colors.sequential.Reds[
         2:
     ]  # Skip lightest shades
@@ -19,8 +24,8 @@ def load_reds_template():
     return reds_template
 
 
-def load_reds_dark_template():
-    reds_dark_template = pio.templates["plotly_dark"]
+def load_reds_dark_template() -> go.layout.Template:
+    reds_dark_template = go.layout.Template(pio.templates["plotly_dark"])
     reds_dark_template.layout.colorway = px.colors.sequential.Reds[
         2:
     ]  # Skip darkest shades
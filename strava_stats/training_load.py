@@ -0,0 +1,419 @@
+import datetime
+import logging
+from typing import TYPE_CHECKING, Iterable, Optional
+
+import numpy as np
+
+from strava_stats.activity_store import FileStore
+from strava_stats.strava_api import write_npz_atomic
+from strava_stats.strava_stats import ALL_YEARS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TRAINING_LOAD_FORMAT_VERSION = 2
+TRAINING_LOAD_FILENAME = "training_load.npz"
+ALL_TYPES = ""
+# time constants in days of the fitness (chronic) and fatigue (acute) load
+CTL_DAYS = 42
+ATL_DAYS = 7
+# the daily totals the metrics are derived from, distance in km, moving time
+# in hours and load in suffer score, or moving minutes without suffer scores
+DAILY_SERIES = ("distance", "moving_time", "load")
+DERIVED_SERIES = (
+    "distance_7",
+    "distance_28",
+    "moving_time_7",
+    "moving_time_28",
+    "distance_change",
+    "ctl",
+    "atl",
+    "tsb",
+)
+
+
+def days_between(start: np.datetime64, end: np.datetime64) -> int:
+    return int((end - start) // np.timedelta64(1, "D"))
+
+
+def daily_totals(
+    activities: list[dict],
+    start: np.datetime64,
+    num_days: int,
+    source: Optional[str] = None,
+) -> tuple[str, dict[str, dict[str, np.ndarray]]]:
+    """Returns the load source and the dense daily totals per activity type,
+    and of all types under ALL_TYPES, from day ``start`` on. Without a
+    ``source``, the load is the suffer score unless no activity has one."""
+    day = (
+        np.array([a["start_date"][:10] for a in activities], dtype="datetime64[D]")
+        - start
+    ).astype(np.int64)
+    types = np.array([a["type"] for a in activities], dtype=str)
+    distance = np.array([a["distance"] for a in activities], dtype=np.float64) / 1000
+    moving_time = (
+        np.array([a["moving_time"] for a in activities], dtype=np.float64) / 3600
+    )
+    # numpy turns the None of activities without heart rate into NaN
+    suffer_score = np.array(
+        [a.get("suffer_score") for a in activities], dtype=np.float64
+    )
+    if source is None:
+        source = "moving_time" if np.isnan(suffer_score).all() else "suffer_score"
+    if source == "moving_time":
+        load = moving_time * 60
+    else:
+        load = np.nan_to_num(suffer_score)
+
+    totals = {}
+    for activity_type in [ALL_TYPES, *np.unique(types).tolist()]:
+        mask = types == activity_type if activity_type else slice(None)
+        totals[activity_type] = {
+            name: np.bincount(day[mask], weights=values[mask], minlength=num_days)
+            for name, values in zip(DAILY_SERIES, (distance, moving_time, load))
+        }
+    return source, totals
+
+
+def rolling_sum(values: np.ndarray, window: int, first: int) -> np.ndarray:
+    """Returns the sums over the trailing window of the days from ``first`` on,
+    as differences of a cumulative sum."""
+    lead = max(first - window + 1, 0)
+    cumulative = np.concatenate([[0.0], np.cumsum(values[lead:])])
+    days = np.arange(first, len(values)) - lead
+    return cumulative[days + 1] - cumulative[np.maximum(days - window + 1, 0)]
+
+
+def exponential_average(
+    values: np.ndarray, days: int, first: int, seed: float
+) -> np.ndarray:
+    """Returns the exponentially weighted average with a time constant of
+    ``days`` from day ``first`` on, continuing from ``seed`` the day before."""
+    import pandas as pd
+
+    series = pd.Series(np.concatenate([[seed], values[first:]]))
+    return series.ewm(alpha=1 / days, adjust=False).mean().to_numpy()[1:]
+
+
+def derive_series(
+    totals: dict[str, np.ndarray],
+    previous: Optional[dict[str, np.ndarray]] = None,
+    first: int = 0,
+) -> dict[str, np.ndarray]:
+    """Derives the rolling and exponentially weighted metrics of the daily
+    totals, only for the days from ``first`` on, keeping the earlier days of
+    ``previous`` and continuing their averages."""
+    if previous is None or first == 0:
+        previous, first = {name: np.zeros(0) for name in DERIVED_SERIES}, 0
+    kept = {name: previous[name][:first] for name in DERIVED_SERIES}
+    ctl_seed = kept["ctl"][-1] if first else 0.0
+    atl_seed = kept["atl"][-1] if first else 0.0
+
+    derived = {
+        "distance_7": rolling_sum(totals["distance"], 7, first),
+        "distance_28": rolling_sum(totals["distance"], 28, first),
+        "moving_time_7": rolling_sum(totals["moving_time"], 7, first),
+        "moving_time_28": rolling_sum(totals["moving_time"], 28, first),
+        "ctl": exponential_average(totals["load"], CTL_DAYS, first, ctl_seed),
+        "atl": exponential_average(totals["load"], ATL_DAYS, first, atl_seed),
+    }
+    # form is the fitness of the day before minus its fatigue
+    derived["tsb"] = np.concatenate(
+        [[ctl_seed - atl_seed], (derived["ctl"] - derived["atl"])[:-1]]
+    )[: len(derived["ctl"])]
+    # the last 7 days against the 7 days before
+    distance_7 = np.concatenate(
+        [np.zeros(7), kept["distance_7"], derived["distance_7"]]
+    )
+    derived["distance_change"] = distance_7[first + 7 :] - distance_7[first:-7]
+    return {
+        name: np.concatenate([kept[name], derived[name]]) for name in DERIVED_SERIES
+    }
+
+
+def first_changed_day(
+    totals: dict[str, np.ndarray], previous: Optional[dict[str, np.ndarray]]
+) -> int:
+    """Returns the first day whose totals differ from the previous ones, the
+    number of previous days if only days were appended. The totals are
+    compared at the float32 precision they are stored with."""
+    if previous is None:
+        return 0
+    first = len(previous[DAILY_SERIES[0]])
+    for name in DAILY_SERIES:
+        overlap = min(len(totals[name]), len(previous[name]))
+        changed = np.flatnonzero(
+            totals[name][:overlap].astype(np.float32)
+            != previous[name][:overlap].astype(np.float32)
+        )
+        if len(changed):
+            first = min(first, int(changed[0]))
+    return min(first, len(totals[DAILY_SERIES[0]]))
+
+
+def splice_daily_totals(
+    activities: list[dict],
+    previous: dict,
+    changed_since: str,
+    today: datetime.date,
+) -> Optional[tuple[np.datetime64, int, dict[str, dict[str, np.ndarray]]]]:
+    """Returns the first day, the number of days and the daily totals per
+    type, computed only from the activities on or after ``changed_since``
+    and spliced after the earlier days of the previous totals. None when
+    the previous totals can't be reused, e.g. for a change before them."""
+    start = np.datetime64(previous["start"], "D")
+    since = days_between(start, np.datetime64(changed_since, "D"))
+    if since <= 0:
+        # the first day may have moved, so every day is computed again
+        return None
+    recent = [
+        activity
+        for activity in activities
+        if activity["start_date"][:10] >= changed_since
+    ]
+    previous_days = len(previous["series"][ALL_TYPES][DAILY_SERIES[0]])
+    end = max(
+        start + previous_days - 1,
+        *(np.datetime64(activity["start_date"][:10], "D") for activity in recent),
+        np.datetime64(today, "D"),
+    )
+    num_days = days_between(start, end) + 1
+    source, recent_totals = daily_totals(
+        recent,
+        start + since,
+        num_days - since,
+        None if previous["source"] == "moving_time" else previous["source"],
+    )
+    if source != previous["source"]:
+        # the first suffer scores turn the load of every day into them
+        return None
+
+    totals = {}
+    # sorted like daily_totals does, all types first
+    for activity_type in sorted({*previous["series"], *recent_totals}):
+        type_previous = previous["series"].get(activity_type)
+        type_recent = recent_totals.get(activity_type)
+        kept = {}
+        for name in DAILY_SERIES:
+            values = np.zeros(since)
+            if type_previous is not None:
+                earlier = type_previous[name][:since]
+                values[: len(earlier)] = earlier
+            kept[name] = values
+        if type_recent is None and not any(values.any() for values in kept.values()):
+            # every activity of the type was deleted
+            continue
+        totals[activity_type] = {
+            name: np.concatenate(
+                [
+                    kept[name],
+                    type_recent[name]
+                    if type_recent is not None
+                    else np.zeros(num_days - since),
+                ]
+            )
+            for name in DAILY_SERIES
+        }
+    return start, num_days, totals
+
+
+def update_training_load(
+    activities: Iterable[dict],
+    path: str,
+    today: Optional[datetime.date] = None,
+    changed_since: Optional[str] = None,
+    database_versions: Optional[tuple[int, int]] = None,
+) -> Optional[dict]:
+    """Builds the daily training load series of every activity type up to
+    today and writes them.
+
+    With ``changed_since``, the ISO date of the earliest activity added,
+    changed or deleted in the activity database going from the first to the
+    second of ``database_versions``, only the daily totals from that day on
+    are computed again, provided the previous file was derived from the
+    first version. The file records the second one. Only the days after the
+    first one whose totals changed, usually just the days since the last
+    sync, are derived again, the averages continuing from the day before.
+    """
+    activities = list(activities)
+    if not activities:
+        logger.info("no activities to derive the training load from")
+        return None
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+
+    previous = None
+    try:
+        previous = load_training_load(path)
+    except (FileNotFoundError, ValueError):
+        pass
+
+    spliced = None
+    if (
+        previous is not None
+        and changed_since is not None
+        and database_versions is not None
+        and previous["database_version"] == database_versions[0]
+    ):
+        spliced = splice_daily_totals(activities, previous, changed_since, today)
+    elif previous is not None and changed_since is not None:
+        # changes the file missed, e.g. of a sync that failed to write it,
+        # may lie before changed_since
+        logger.info("training load is of another database version, rebuilding it")
+    if spliced is not None:
+        start, num_days, totals = spliced
+        source = previous["source"]
+    else:
+        days = [activity["start_date"][:10] for activity in activities]
+        start = np.datetime64(min(days), "D")
+        end = max(np.datetime64(max(days), "D"), np.datetime64(today, "D"))
+        num_days = days_between(start, end) + 1
+        source, totals = daily_totals(activities, start, num_days)
+        if previous is not None and (
+            previous["start"] != str(start) or previous["source"] != source
+        ):
+            previous = None
+
+    arrays = dict(
+        format=np.array(TRAINING_LOAD_FORMAT_VERSION),
+        start=np.array(str(start)),
+        source=np.array(source),
+        types=np.array(list(totals), dtype=str),
+        # -1 when not derived from a known database version
+        database_version=np.array(database_versions[1] if database_versions else -1),
+    )
+    recomputed = 0
+    for activity_type, type_totals in totals.items():
+        type_previous = previous["series"].get(activity_type) if previous else None
+        first = first_changed_day(type_totals, type_previous)
+        recomputed += num_days - first
+        series = {
+            **type_totals,
+            **derive_series(type_totals, type_previous, first),
+        }
+        for name, values in series.items():
+            arrays[f"{activity_type}|{name}"] = values.astype(np.float32)
+
+    write_npz_atomic(path, arrays)
+    logger.info(
+        f"wrote {num_days} days of training load to {path} "
+        f"({recomputed} days derived across {len(totals)} types)"
+    )
+    return arrays
+
+
+def load_training_load(path) -> dict:
+    """Loads the series written by update_training_load."""
+    with np.load(path) as npz:
+        if int(npz["format"]) != TRAINING_LOAD_FORMAT_VERSION:
+            raise ValueError(f"unsupported training load format in {path}")
+        series = {activity_type: {} for activity_type in npz["types"].tolist()}
+        for name in npz.files:
+            if "|" in name:
+                activity_type, series_name = name.split("|")
+                series[activity_type][series_name] = npz[name].astype(np.float64)
+        return dict(
+            start=str(npz["start"]),
+            source=str(npz["source"]),
+            database_version=int(npz["database_version"]),
+            series=series,
+        )
+
+
+def training_load_view(
+    training_load: dict, year, activity_type: Optional[str]
+) -> Optional[tuple[np.datetime64, int, dict[str, np.ndarray]]]:
+    """Returns the first day, the days between samples and the series of a
+    year, or of every week for ALL_YEARS, None without activities of the
+    type."""
+    series = training_load["series"].get(activity_type or ALL_TYPES)
+    if series is None:
+        return None
+    start = np.datetime64(training_load["start"], "D")
+    num_days = len(series["ctl"])
+    if year == ALL_YEARS:
+        # weekly samples ending on the last day keep the payload small
+        step = 7
+        first = (num_days - 1) % step
+        return (
+            start + first,
+            step,
+            {name: values[first::step] for name, values in series.items()},
+        )
+
+    first = days_between(start, np.datetime64(f"{year}-01-01", "D"))
+    last = days_between(start, np.datetime64(f"{year}-12-31", "D"))
+    first, last = max(first, 0), min(last, num_days - 1)
+    if first > last:
+        return None
+    return (
+        start + first,
+        1,
+        {name: values[first : last + 1] for name, values in series.items()},
+    )
+
+
+TRAINING_LOAD_METRICS = {
+    "ctl": "Fitness",
+    "atl": "Fatigue",
+    "tsb": "Form",
+}
+ROLLING_DISTANCE_METRICS = {
+    "distance_7": "7 days",
+    "distance_28": "28 days",
+    "distance_change": "Week over week",
+}
+
+
+def training_load_frame(series: dict[str, np.ndarray]) -> "pd.DataFrame":
+    """Returns the fitness, fatigue and form series as a long frame of
+    (day, value, metric) for plotting."""
+    return series_frame(series, TRAINING_LOAD_METRICS)
+
+
+def rolling_distance_frame(series: dict[str, np.ndarray]) -> "pd.DataFrame":
+    """Returns the rolling distances and their change from the week before
+    as a long frame of (day, value, metric) for plotting."""
+    return series_frame(series, ROLLING_DISTANCE_METRICS)
+
+
+def series_frame(
+    series: dict[str, np.ndarray], metrics: dict[str, str]
+) -> "pd.DataFrame":
+    import pandas as pd
+
+    num_days = len(series["ctl"]) if series else 0
+    return pd.DataFrame(
+        {
+            "Day": np.tile(np.arange(num_days), len(metrics)),
+            "Value": np.concatenate([series[name] for name in metrics])
+            if series
+            else np.zeros(0),
+            "Metric": np.repeat(list(metrics.values()), num_days),
+        }
+    )
+
+
+class TrainingLoadStore(FileStore):
+    """Keeps the training load series written by the sync in memory,
+    reloading them when the sync writes new ones."""
+
+    description = "training load"
+
+    def __init__(
+        self, path: str = f"data/{TRAINING_LOAD_FILENAME}", check_interval: float = 0
+    ):
+        super().__init__(path, check_interval)
+
+    def load(self) -> dict:
+        return load_training_load(self.file_path)
+
+    def nbytes(self) -> int:
+        if not self.loaded:
+            return 0
+        return sum(
+            values.nbytes
+            for series in self._data["series"].values()
+            for values in series.values()
+        )
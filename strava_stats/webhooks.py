@@ -0,0 +1,164 @@
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from strava_stats.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/webhook"
+ASPECT_TYPES = ("create", "update", "delete")
+MAX_EVENT_BYTES = 64 * 1024
+
+
+def parse_webhook_event(body: bytes) -> Optional[dict]:
+    """Returns the activity event of a push notification, None for events
+    about anything else such as an athlete revoking access. Raises
+    ValueError for malformed events."""
+    try:
+        event = json.loads(body)
+        object_type = event["object_type"]
+        aspect_type = event["aspect_type"]
+        object_id = int(event["object_id"])
+        owner_id = str(int(event["owner_id"]))
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"malformed webhook event: {e!r}") from e
+    if aspect_type not in ASPECT_TYPES:
+        raise ValueError(f"unknown webhook aspect type {aspect_type!r}")
+    if object_type != "activity":
+        logger.info(f"ignoring {object_type} {aspect_type} event of {owner_id}")
+        return None
+    return dict(
+        aspect_type=aspect_type,
+        activity_id=object_id,
+        owner_id=owner_id,
+        subscription_id=event.get("subscription_id"),
+        updates=event.get("updates") or {},
+    )
+
+
+def pending_changes(events: list[dict]) -> dict[str, tuple[set[int], set[int]]]:
+    """Returns the ids of the activities to fetch and to delete per athlete,
+    so an activity changed by several events in a batch is fetched once and
+    the last event wins."""
+    changes: dict[str, tuple[set[int], set[int]]] = {}
+    for event in events:
+        fetch, delete = changes.setdefault(event["owner_id"], (set(), set()))
+        if event["aspect_type"] == "delete":
+            fetch.discard(event["activity_id"])
+            delete.add(event["activity_id"])
+        else:
+            delete.discard(event["activity_id"])
+            fetch.add(event["activity_id"])
+    return changes
+
+
+def drain_events(events: queue.Queue, first: dict) -> list[dict]:
+    """Returns an event and every other event already queued behind it."""
+    batch = [first]
+    while True:
+        try:
+            batch.append(events.get_nowait())
+        except queue.Empty:
+            return batch
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Receiver of Strava push subscription events.
+
+    Strava posts an event whenever an activity of a subscribed athlete is
+    created, updated or deleted, and expects an answer within two seconds.
+    The server answers the subscription validation and only queues the
+    events posted to WEBHOOK_PATH, they are applied by the sync process that
+    owns the data files. With a ``subscription_id``, events of any other
+    subscription are rejected, since Strava doesn't sign them.
+    """
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        verify_token: str,
+        subscription_id: Optional[int] = None,
+    ):
+        super().__init__(address, WebhookHandler)
+        self.verify_token = verify_token
+        self.subscription_id = subscription_id
+        self.events: queue.Queue = queue.Queue()
+
+    def start(self) -> threading.Thread:
+        """Serves requests from a background thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        host, port = self.server_address[:2]
+        logger.info(f"receiving Strava webhook events on http://{host}:{port}")
+        return thread
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != WEBHOOK_PATH:
+            self._send_json(404, {"message": "not found"})
+            return
+        # the validation request Strava sends when the subscription is created
+        query = parse_qs(url.query)
+        if (
+            query.get("hub.mode") != ["subscribe"]
+            or query.get("hub.verify_token") != [self.server.verify_token]
+            or "hub.challenge" not in query
+        ):
+            logger.warning("rejected webhook subscription validation")
+            self._send_json(403, {"message": "invalid verify token"})
+            return
+        logger.info("validated webhook subscription")
+        self._send_json(200, {"hub.challenge": query["hub.challenge"][0]})
+
+    def do_POST(self):
+        if urlparse(self.path).path != WEBHOOK_PATH:
+            self._send_json(404, {"message": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_EVENT_BYTES:
+            self._send_json(413, {"message": "event too large"})
+            return
+        try:
+            event = parse_webhook_event(self.rfile.read(length))
+        except ValueError:
+            logger.warning("rejected malformed webhook event", exc_info=True)
+            self._send_json(400, {"message": "malformed event"})
+            return
+        if event is not None:
+            if (
+                self.server.subscription_id is not None
+                and event["subscription_id"] != self.server.subscription_id
+            ):
+                logger.warning(
+                    f"rejected event of subscription {event['subscription_id']}"
+                )
+                self._send_json(403, {"message": "unknown subscription"})
+                return
+            self.server.events.put(event)
+            metrics.increment(
+                "strava_webhook_events_total",
+                help="Strava webhook events received by aspect type",
+                aspect_type=event["aspect_type"],
+            )
+        # answered right away, Strava retries events not answered in 2 seconds
+        self._send_json(200, {})
@@ -0,0 +1,91 @@
+import datetime
+import random
+
+import pytest
+
+from strava_stats.scripts.stub_strava_server import StubStravaServer
+from strava_stats.strava_client import StravaClient
+
+ACTIVITY_TYPES = ["Ride", "Run", "Hike"]
+
+
+def encode_polyline(points: list[tuple[float, float]]) -> str:
+    """Encodes points with Google's polyline algorithm, as Strava does."""
+    encoded = []
+    previous = (0, 0)
+    for point in points:
+        current = tuple(round(value * 1e5) for value in point)
+        for value, last in zip(current, previous):
+            delta = value - last
+            delta = ~(delta << 1) if delta < 0 else delta << 1
+            while delta >= 0x20:
+                encoded.append(chr((0x20 | (delta & 0x1F)) + 63))
+                delta >>= 5
+            encoded.append(chr(delta + 63))
+        previous = current
+    return "".join(encoded)
+
+
+def make_activity(
+    activity_id: int, start: datetime.datetime, activity_type: str = "Ride", **fields
+) -> dict:
+    rng = random.Random(activity_id)
+    lat, lng = 47.0 + rng.random() / 10, 8.0 + rng.random() / 10
+    return {
+        "id": activity_id,
+        "name": f"activity {activity_id}",
+        "type": activity_type,
+        "sport_type": activity_type,
+        "start_date": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "distance": rng.uniform(2000, 80000),
+        "moving_time": rng.randint(600, 14400),
+        "elapsed_time": 15000,
+        "total_elevation_gain": rng.uniform(0, 1500),
+        "suffer_score": rng.randint(5, 200),
+        "map": {
+            "summary_polyline": encode_polyline(
+                [(lat, lng), (lat + 0.01, lng + 0.02), (lat + 0.02, lng)]
+            )
+        },
+        **fields,
+    }
+
+
+@pytest.fixture
+def activities() -> list[dict]:
+    """Returns two years of activities, newest first, the last one yesterday."""
+    yesterday = datetime.datetime.now(datetime.timezone.utc).replace(
+        hour=8, minute=0, second=0, microsecond=0
+    ) - datetime.timedelta(days=1)
+    activities = [
+        make_activity(
+            activity_id,
+            yesterday - datetime.timedelta(days=(200 - activity_id) * 3.5),
+            ACTIVITY_TYPES[activity_id % len(ACTIVITY_TYPES)],
+        )
+        for activity_id in range(1, 201)
+    ]
+    return sorted(activities, key=lambda a: a["start_date"], reverse=True)
+
+
+@pytest.fixture
+def stub_server(activities):
+    server = StubStravaServer(("127.0.0.1", 0), activities)
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(stub_server) -> StravaClient:
+    base_url = f"http://127.0.0.1:{stub_server.server_address[1]}"
+    return StravaClient(
+        client_id="client-id",
+        client_secret="client-secret",
+        refresh_token="refresh-token",
+        auth_endpoint=f"{base_url}/oauth/token",
+        api_endpoint=f"{base_url}/api/v3",
+        max_retries=1,
+        backoff_base=0.0,
+    )
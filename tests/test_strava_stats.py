@@ -0,0 +1,35 @@
+import numpy as np
+
+from strava_stats.strava_stats import generate_km_per_day_heatmap_data
+
+
+def activity(start_date: str, distance: float) -> dict:
+    return dict(
+        start_date=f"{start_date}T08:00:00Z",
+        distance=distance,
+        moving_time=3600,
+        total_elevation_gain=0.0,
+        type="Ride",
+    )
+
+
+def test_heatmap_keeps_feb_29_of_a_leap_year():
+    heatmap = generate_km_per_day_heatmap_data(
+        [activity("2024-02-29", 25000.0), activity("2024-02-28", 10000.0)]
+    )
+    assert heatmap[1, 28] == 25.0
+    assert heatmap[1, 27] == 10.0
+    assert np.isnan(heatmap[1, 29:]).all()
+
+
+def test_heatmap_masks_feb_29_of_a_common_year():
+    heatmap = generate_km_per_day_heatmap_data([activity("2025-03-01", 5000.0)])
+    assert np.isnan(heatmap[1, 28:]).all()
+    assert heatmap[2, 0] == 5.0
+    assert np.isnan(heatmap[3, 30])
+
+
+def test_heatmap_of_a_given_year_without_activities():
+    heatmap = generate_km_per_day_heatmap_data([], 2024)
+    assert heatmap[1, 28] == 0.0
+    assert np.isnan(heatmap[1, 29:]).all()
@@ -0,0 +1,186 @@
+import datetime
+import json
+
+import numpy as np
+
+from strava_stats.athletes import DATA_VERSION_FILENAME
+from strava_stats.routes import (
+    ROUTE_TILES_FILENAME,
+    ROUTE_ZOOMS,
+    load_route_tiles,
+    update_route_tiles,
+)
+from strava_stats.scripts.sync_strava_activities import (
+    apply_activity_changes,
+    sync_dataset,
+)
+from strava_stats.storage import DATABASE_FILENAME, ActivityDatabase
+from strava_stats.training_load import (
+    TRAINING_LOAD_FILENAME,
+    load_training_load,
+    update_training_load,
+)
+from strava_stats.webhooks import pending_changes
+from tests.conftest import make_activity
+
+
+def sync(data_dir, client, full: bool = False) -> list[dict]:
+    return sync_dataset(
+        str(data_dir / "activities.json"),
+        str(data_dir / DATABASE_FILENAME),
+        str(data_dir / "rollup.json"),
+        full=full,
+        client=client,
+    )
+
+
+def apply_events(data_dir, client, events: list[dict]) -> list[dict]:
+    ((fetch_ids, delete_ids),) = pending_changes(events).values()
+    return apply_activity_changes(
+        str(data_dir / "activities.json"),
+        str(data_dir / DATABASE_FILENAME),
+        str(data_dir / "rollup.json"),
+        fetch_ids,
+        delete_ids,
+        client=client,
+    )
+
+
+def event(aspect_type: str, activity_id: int) -> dict:
+    return dict(aspect_type=aspect_type, activity_id=activity_id, owner_id="1")
+
+
+def stored_activities(data_dir) -> dict[int, dict]:
+    with open(data_dir / "activities.json") as f:
+        return {activity["id"]: activity for activity in json.load(f)}
+
+
+def tile_cells(tiles: dict) -> dict[int, set[tuple]]:
+    """Returns the (year, type, x, y, count) cells of every zoom."""
+    years, types = tiles["years"].tolist(), tiles["types"].tolist()
+    return {
+        zoom: {
+            (years[group], types[group], x, y, count)
+            for group, x, y, count in zip(
+                tiles[f"group{zoom}"].tolist(),
+                tiles[f"x{zoom}"].tolist(),
+                tiles[f"y{zoom}"].tolist(),
+                tiles[f"count{zoom}"].tolist(),
+            )
+        }
+        for zoom in ROUTE_ZOOMS
+    }
+
+
+def assert_route_tiles_are_full(data_dir, activities: list[dict]) -> None:
+    """Checks the route tiles the sync wrote match ones rasterized from
+    scratch."""
+    expected = update_route_tiles(activities, str(data_dir / "full_tiles.npz"))
+    synced = load_route_tiles(data_dir / ROUTE_TILES_FILENAME)
+    assert sorted(synced["activity_ids"].tolist()) == sorted(
+        expected["activity_ids"].tolist()
+    )
+    assert tile_cells(synced) == tile_cells(expected)
+
+
+def assert_training_load_is_full(data_dir, activities: list[dict]) -> None:
+    """Checks the training load the sync wrote matches one derived from
+    scratch."""
+    full = update_training_load(activities, str(data_dir / "full.npz"))
+    synced = load_training_load(data_dir / TRAINING_LOAD_FILENAME)
+    expected = load_training_load(data_dir / "full.npz")
+    assert full is not None
+    assert synced["start"] == expected["start"]
+    assert synced["series"].keys() == expected["series"].keys()
+    for activity_type, series in expected["series"].items():
+        for name, values in series.items():
+            np.testing.assert_allclose(
+                synced["series"][activity_type][name], values, rtol=1e-5, atol=1e-4
+            )
+
+
+def test_full_sync_mirrors_the_stub(tmp_path, client, activities):
+    synced = sync(tmp_path, client, full=True)
+
+    assert [activity["id"] for activity in synced] == [
+        activity["id"] for activity in activities
+    ]
+    database = ActivityDatabase(tmp_path / DATABASE_FILENAME, create=False)
+    assert database.count() == len(activities)
+    assert_route_tiles_are_full(tmp_path, synced)
+    assert (tmp_path / "rollup.json").exists()
+    assert (tmp_path / DATA_VERSION_FILENAME).exists()
+    assert_training_load_is_full(tmp_path, synced)
+
+
+def test_incremental_sync_applies_new_and_edited_activities(
+    tmp_path, client, stub_server, activities
+):
+    sync(tmp_path, client, full=True)
+    version = ActivityDatabase(tmp_path / DATABASE_FILENAME).version()
+
+    latest = activities[0]
+    stub_server.set_activity(latest["id"], {**latest, "type": "Walk"})
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stub_server.set_activity(1000, make_activity(1000, now, "Run"))
+    synced = sync(tmp_path, client)
+
+    stored = stored_activities(tmp_path)
+    assert len(synced) == len(activities) + 1
+    assert stored[1000]["type"] == "Run"
+    assert stored[latest["id"]]["type"] == "Walk"
+    database = ActivityDatabase(tmp_path / DATABASE_FILENAME)
+    assert database.count() == len(activities) + 1
+    assert database.version() == version + 1
+    # the route of the edited activity moved to the group of its new type
+    assert_route_tiles_are_full(tmp_path, synced)
+    assert_training_load_is_full(tmp_path, synced)
+
+
+def test_incremental_sync_without_changes_keeps_the_database_version(tmp_path, client):
+    sync(tmp_path, client, full=True)
+    version = ActivityDatabase(tmp_path / DATABASE_FILENAME).version()
+    sync(tmp_path, client)
+    assert ActivityDatabase(tmp_path / DATABASE_FILENAME).version() == version
+
+
+def test_webhook_events_create_update_and_delete(
+    tmp_path, client, stub_server, activities
+):
+    sync(tmp_path, client, full=True)
+
+    created = make_activity(1000, datetime.datetime(2025, 3, 1, 8), "Run")
+    stub_server.set_activity(1000, created)
+    apply_events(tmp_path, client, [event("create", 1000)])
+    assert stored_activities(tmp_path)[1000]["distance"] == created["distance"]
+
+    edited = {**created, "distance": created["distance"] + 1000}
+    stub_server.set_activity(1000, edited)
+    apply_events(tmp_path, client, [event("update", 1000)])
+    assert stored_activities(tmp_path)[1000]["distance"] == edited["distance"]
+
+    deleted = activities[100]["id"]
+    stub_server.set_activity(deleted, None)
+    synced = apply_events(tmp_path, client, [event("delete", deleted)])
+
+    stored = stored_activities(tmp_path)
+    assert deleted not in stored and 1000 in stored
+    assert len(stored) == len(activities)
+    database = ActivityDatabase(tmp_path / DATABASE_FILENAME)
+    table = database.query_table("Run", 2025)
+    assert database.count() == len(activities)
+    assert len(table) == sum(
+        activity["type"] == "Run" and activity["start_date"].startswith("2025")
+        for activity in stored.values()
+    )
+    assert_route_tiles_are_full(tmp_path, synced)
+    assert_training_load_is_full(tmp_path, synced)
+
+
+def test_webhook_events_of_one_activity_apply_the_last(tmp_path, client, stub_server):
+    sync(tmp_path, client, full=True)
+    stub_server.set_activity(
+        1000, make_activity(1000, datetime.datetime(2025, 3, 1, 8))
+    )
+    apply_events(tmp_path, client, [event("create", 1000), event("delete", 1000)])
+    assert 1000 not in stored_activities(tmp_path)
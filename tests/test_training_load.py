@@ -0,0 +1,99 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from strava_stats.training_load import load_training_load, update_training_load
+from tests.conftest import make_activity
+
+TODAY = datetime.date(2026, 10, 18)
+
+
+def assert_same_training_load(path, expected_path) -> None:
+    actual, expected = load_training_load(path), load_training_load(expected_path)
+    assert actual["start"] == expected["start"]
+    assert actual["source"] == expected["source"]
+    assert actual["series"].keys() == expected["series"].keys()
+    for activity_type, series in expected["series"].items():
+        assert actual["series"][activity_type].keys() == series.keys()
+        for name, values in series.items():
+            np.testing.assert_allclose(
+                actual["series"][activity_type][name], values, rtol=1e-5, atol=1e-4
+            )
+
+
+def edited(activities: list[dict], index: int, **fields) -> list[dict]:
+    return [
+        {**activity, **fields} if i == index else activity
+        for i, activity in enumerate(activities)
+    ]
+
+
+def changes(activities: list[dict]) -> dict[str, tuple[list[dict], str]]:
+    """Returns changed activities and the first day they changed, by name."""
+    new = make_activity(
+        1000, datetime.datetime(2026, 10, 17, 8), "Run", suffer_score=80
+    )
+    gone_hikes = [activity for activity in activities if activity["type"] != "Hike"]
+    first_hike = min(
+        activity["start_date"] for activity in activities if activity["type"] == "Hike"
+    )
+    return {
+        "append": ([new, *activities], new["start_date"][:10]),
+        "edit": (
+            edited(activities, 50, distance=1.0, suffer_score=1),
+            activities[50]["start_date"][:10],
+        ),
+        "delete": (
+            activities[:80] + activities[81:],
+            activities[80]["start_date"][:10],
+        ),
+        "new type": (
+            edited(activities, 20, type="Kayak"),
+            activities[20]["start_date"][:10],
+        ),
+        "type gone": (gone_hikes, first_hike[:10]),
+        "unchanged": (activities, str(TODAY)),
+    }
+
+
+@pytest.mark.parametrize(
+    "change", ["append", "edit", "delete", "new type", "type gone", "unchanged"]
+)
+def test_incremental_update_matches_full(tmp_path, activities, change):
+    incremental, full = tmp_path / "incremental.npz", tmp_path / "full.npz"
+    update_training_load(activities, str(incremental), TODAY, database_versions=(0, 1))
+    changed, changed_since = changes(activities)[change]
+
+    update_training_load(
+        changed,
+        str(incremental),
+        TODAY,
+        changed_since=changed_since,
+        database_versions=(1, 2),
+    )
+    update_training_load(changed, str(full), TODAY)
+
+    assert load_training_load(incremental)["database_version"] == 2
+    assert_same_training_load(incremental, full)
+
+
+def test_update_of_another_database_version_rebuilds(tmp_path, activities):
+    path, full = tmp_path / "training_load.npz", tmp_path / "full.npz"
+    update_training_load(activities, str(path), TODAY, database_versions=(0, 1))
+    # a sync changed an old activity, version 2, without writing the file
+    missed = edited(activities, 150, distance=1.0, suffer_score=1)
+    # and the next one only a recent activity
+    changed = edited(missed, 2, suffer_score=300)
+
+    update_training_load(
+        changed,
+        str(path),
+        TODAY,
+        changed_since=activities[2]["start_date"][:10],
+        database_versions=(2, 3),
+    )
+    update_training_load(changed, str(full), TODAY)
+
+    assert load_training_load(path)["database_version"] == 3
+    assert_same_training_load(path, full)